@@ -18,4 +18,99 @@ MAILGUN_API_KEY = os.getenv("MAILGUN_API_KEY")
 MAILGUN_DOMAIN = os.getenv("MAILGUN_DOMAIN")
 EMAIL_FROM = os.getenv("EMAIL_FROM", "noreply@yourapp.com")
 
-ENV = os.getenv("ENV", "development")
\ No newline at end of file
+ENV = os.getenv("ENV", "development")
+
+# FHIR HTTP client (shared connection pool)
+FHIR_CONNECT_TIMEOUT = float(os.getenv("FHIR_CONNECT_TIMEOUT", "3"))
+FHIR_READ_TIMEOUT = float(os.getenv("FHIR_READ_TIMEOUT", "15"))
+FHIR_MAX_CONNECTIONS = int(os.getenv("FHIR_MAX_CONNECTIONS", "20"))
+FHIR_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("FHIR_MAX_KEEPALIVE_CONNECTIONS", "10"))
+FHIR_KEEPALIVE_EXPIRY = float(os.getenv("FHIR_KEEPALIVE_EXPIRY", "30"))
+FHIR_SEARCH_PAGE_SIZE = int(os.getenv("FHIR_SEARCH_PAGE_SIZE", "100"))
+FHIR_DELETE_BATCH_SIZE = int(os.getenv("FHIR_DELETE_BATCH_SIZE", "50"))
+FHIR_DELETE_CONCURRENCY = int(os.getenv("FHIR_DELETE_CONCURRENCY", "4"))
+FHIR_IMPORT_BUNDLE_SIZE = int(os.getenv("FHIR_IMPORT_BUNDLE_SIZE", "500"))
+FHIR_IMPORT_CONCURRENCY = int(os.getenv("FHIR_IMPORT_CONCURRENCY", "4"))
+
+# FHIR resilience: retries for idempotent verbs, per-call deadline and circuit breaker
+FHIR_REQUEST_DEADLINE = float(os.getenv("FHIR_REQUEST_DEADLINE", "20"))
+# Seconds added to the timeout and deadline of a Bundle request per entry
+FHIR_BUNDLE_ENTRY_TIMEOUT = float(os.getenv("FHIR_BUNDLE_ENTRY_TIMEOUT", "0.05"))
+FHIR_RETRY_ATTEMPTS = int(os.getenv("FHIR_RETRY_ATTEMPTS", "3"))
+FHIR_RETRY_BASE_DELAY = float(os.getenv("FHIR_RETRY_BASE_DELAY", "0.2"))
+FHIR_RETRY_MAX_DELAY = float(os.getenv("FHIR_RETRY_MAX_DELAY", "2"))
+FHIR_BREAKER_FAILURE_RATIO = float(os.getenv("FHIR_BREAKER_FAILURE_RATIO", "0.5"))
+FHIR_BREAKER_MINIMUM_CALLS = int(os.getenv("FHIR_BREAKER_MINIMUM_CALLS", "10"))
+FHIR_BREAKER_WINDOW = float(os.getenv("FHIR_BREAKER_WINDOW", "30"))
+FHIR_BREAKER_RESET_TIMEOUT = float(os.getenv("FHIR_BREAKER_RESET_TIMEOUT", "15"))
+
+# In-process fake FHIR server for offline load tests (see app/services/fake_fhir.py)
+FHIR_FAKE_SERVER = os.getenv("FHIR_FAKE_SERVER", "false").lower() == "true"
+FHIR_FAKE_LATENCY = float(os.getenv("FHIR_FAKE_LATENCY", "0"))
+FHIR_FAKE_ERROR_RATE = float(os.getenv("FHIR_FAKE_ERROR_RATE", "0"))
+
+# Observation read cache (entries are revalidated with If-None-Match once stale)
+OBSERVATION_CACHE_SIZE = int(os.getenv("OBSERVATION_CACHE_SIZE", "5000"))
+OBSERVATION_CACHE_TTL = float(os.getenv("OBSERVATION_CACHE_TTL", "300"))
+
+# Patient resources kept to build single-request updates (guarded by If-Match)
+PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", "1000"))
+PATIENT_CACHE_TTL = float(os.getenv("PATIENT_CACHE_TTL", "3600"))
+
+# How the FHIR outbox writes queued lab sets: "transaction" sends each one in its own
+# all-or-nothing Bundle, "batch" shares one Bundle whose entries succeed independently
+FHIR_LAB_SET_BUNDLE_TYPE = os.getenv("FHIR_LAB_SET_BUNDLE_TYPE", "transaction") or None
+
+# FHIR outbox: writes are committed to MongoDB and synced to FHIR by a background worker
+FHIR_OUTBOX_WORKER = os.getenv("FHIR_OUTBOX_WORKER", "true").lower() == "true"
+FHIR_OUTBOX_POLL_INTERVAL = float(os.getenv("FHIR_OUTBOX_POLL_INTERVAL", "1"))
+FHIR_OUTBOX_BATCH_SIZE = int(os.getenv("FHIR_OUTBOX_BATCH_SIZE", "200"))
+FHIR_OUTBOX_CONCURRENCY = int(os.getenv("FHIR_OUTBOX_CONCURRENCY", "4"))
+FHIR_OUTBOX_MAX_ATTEMPTS = int(os.getenv("FHIR_OUTBOX_MAX_ATTEMPTS", "10"))
+FHIR_OUTBOX_RETRY_BASE_DELAY = float(os.getenv("FHIR_OUTBOX_RETRY_BASE_DELAY", "2"))
+FHIR_OUTBOX_RETRY_MAX_DELAY = float(os.getenv("FHIR_OUTBOX_RETRY_MAX_DELAY", "300"))
+FHIR_OUTBOX_LEASE = float(os.getenv("FHIR_OUTBOX_LEASE", "60"))
+
+# Background jobs (patient deletion, lab uploads, interpretations), run by a pool of worker threads
+JOB_WORKER = os.getenv("JOB_WORKER", "true").lower() == "true"
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "300"))
+
+# MongoDB connection pool, shared by the sync and async clients (see app/db.py)
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "medical_dashboard")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "majority")
+MONGO_READ_CONCERN = os.getenv("MONGO_READ_CONCERN", "local")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+# OpenAI-compatible inference endpoint (shared, lazily created clients)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://models.inference.ai.azure.com")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "120"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10")
+)
+# Long OCR texts are extracted in chunks of this many (estimated) tokens, concurrently
+OPENAI_EXTRACTION_CHUNK_TOKENS = int(os.getenv("OPENAI_EXTRACTION_CHUNK_TOKENS", "3000"))
+OPENAI_EXTRACTION_CONCURRENCY = int(os.getenv("OPENAI_EXTRACTION_CONCURRENCY", "4"))
+
+# Interpretations cached in MongoDB by hash of their inputs (least recently used evicted)
+INTERPRETATION_CACHE_MAX_ENTRIES = int(
+    os.getenv("INTERPRETATION_CACHE_MAX_ENTRIES", "10000")
+)
+
+# Uploaded lab result files waiting to be processed by a background job
+LAB_UPLOAD_RETENTION_DAYS = int(os.getenv("LAB_UPLOAD_RETENTION_DAYS", "7"))
@@ -0,0 +1,43 @@
+from pymongo import AsyncMongoClient, MongoClient
+from app.config import (
+    MONGO_URI,
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WRITE_CONCERN,
+    MONGO_READ_CONCERN,
+    MONGO_READ_PREFERENCE,
+)
+
+CLIENT_OPTIONS = {
+    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+    "w": (
+        int(MONGO_WRITE_CONCERN)
+        if MONGO_WRITE_CONCERN.isdigit()
+        else MONGO_WRITE_CONCERN
+    ),
+    "readConcernLevel": MONGO_READ_CONCERN,
+    "readPreference": MONGO_READ_PREFERENCE,
+}
+
+# ✅ One pooled client per process, shared by every model.
+# The sync client serves scripts, worker threads and sync route handlers;
+# async route handlers await the async client so they never block the event loop.
+client = MongoClient(MONGO_URI, **CLIENT_OPTIONS)
+async_client = AsyncMongoClient(MONGO_URI, **CLIENT_OPTIONS)
+
+db = client[MONGO_DB_NAME]
+async_db = async_client[MONGO_DB_NAME]
+
+
+async def close_db_clients():
+    """Closes both clients and their connection pools (called on app shutdown)."""
+    client.close()
+    await async_client.close()
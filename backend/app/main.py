@@ -1,18 +1,57 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import router
 from app.config import FRONTEND_URL
 import os
-from pymongo import MongoClient
-import requests
-from app.config import MONGO_URI, FHIR_SERVER_URL
+from app.config import (
+    FHIR_FAKE_SERVER,
+    FHIR_FAKE_LATENCY,
+    FHIR_FAKE_ERROR_RATE,
+    FHIR_OUTBOX_WORKER,
+    JOB_WORKER,
+)
+from app.services import fhir
+from app.services.fhir import close_fhir_clients
+from app.services.openai import close_openai_clients
+from app.db import client, close_db_clients
+from app.services.fake_fhir import FakeFHIRServer, install_fake_fhir_server
+from app.services.outbox import outbox_worker
+from app.services.jobs import job_worker
+from app.models.indexes import ensure_indexes, find_collection_scans
 from app.utils.csrf import CSRFMiddleware
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create missing MongoDB indexes (idempotent) and flag hot queries that scan collections
+    try:
+        for error in ensure_indexes():
+            print(f"❌ MongoDB index not created: {error}")
+        for name in find_collection_scans():
+            print(f"⚠️ {name} does a COLLSCAN")
+    except Exception as e:
+        print(f"❌ MongoDB index bootstrap failed: {e}")
+    # Sync queued writes to FHIR in the background
+    if FHIR_OUTBOX_WORKER:
+        outbox_worker.start()
+    # Run queued background jobs (e.g. patient deletion)
+    if JOB_WORKER:
+        job_worker.start()
+    yield
+    job_worker.stop()
+    outbox_worker.stop()
+    # Release pooled connections on shutdown
+    await close_fhir_clients()
+    await close_openai_clients()
+    await close_db_clients()
+
+
 app = FastAPI(
     title="LabsExplained API",
     description="LabsExplained API is a RESTful API that provides access to users (admins and patients) to manage their resources depending on their role.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -32,6 +71,13 @@ app.include_router(router)
 
 print("🔥 LabsExplained backend is booting up...")
 
+# Serve FHIR from the in-process fake server (offline load tests)
+if FHIR_FAKE_SERVER:
+    install_fake_fhir_server(
+        FakeFHIRServer(latency=FHIR_FAKE_LATENCY, error_rate=FHIR_FAKE_ERROR_RATE)
+    )
+    print("⚠️ Using the in-process fake FHIR server.")
+
 # Check required environment variables
 required_vars = [
     "FHIR_SERVER_URL",
@@ -54,17 +100,16 @@ else:
 
 # Check MongoDB connection
 try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
-    client.server_info()  # Force connection
+    client.admin.command("ping")  # Force connection
     print("✅ MongoDB connection successful.")
 except Exception as e:
     print(f"❌ MongoDB connection failed: {e}")
 
 # Check FHIR server
 try:
-    resp = requests.get(FHIR_SERVER_URL + "/metadata", timeout=3)
-    if resp.ok:
-        print(f"✅ FHIR server reachable: {FHIR_SERVER_URL}")
+    resp = fhir.fhir_client.get("/metadata", timeout=3)
+    if resp.is_success:
+        print(f"✅ FHIR server reachable: {fhir.fhir_client.base_url}")
     else:
         print(f"⚠️ FHIR server returned status {resp.status_code}")
 except Exception as e:
@@ -0,0 +1,190 @@
+from app.db import db, async_db
+
+analyte_series_collection = db["analyte_series"]
+async_analyte_series_collection = async_db["analyte_series"]
+
+# MongoDB Analyte Series Schema: one point per numeric observation, so a patient's
+# history of one analyte is a single index range scan
+analyte_point_schema = {
+    "_id": str,  # The FHIR Observation ID
+    "patient_fhir_id": str,
+    "analyte": str,  # Normalized test name, e.g. "glucose"
+    "name": str,  # Test name as reported
+    "date": str,  # Test date of the lab set
+    "value": float,
+    "unit": str,
+    "lab_test_set_id": str,
+}
+
+
+def analyte_key(name: str):
+    """Normalizes a test name so that "Glucose" and "glucose " are the same analyte."""
+    return name.strip().lower()
+
+
+def lab_set_points(lab_test_set: dict):
+    """Builds the series points of a lab test set's numeric observation snapshots."""
+    return [
+        {
+            "_id": obs["id"],
+            "patient_fhir_id": lab_test_set["patient_fhir_id"],
+            "analyte": analyte_key(obs["name"]),
+            "name": obs["name"],
+            "date": lab_test_set["test_date"],
+            "value": obs["value"],
+            "unit": obs.get("unit"),
+            "lab_test_set_id": lab_test_set["id"],
+        }
+        for obs in lab_test_set.get("observations", [])
+        if isinstance(obs.get("value"), (int, float)) and obs.get("name")
+    ]
+
+
+def add_lab_sets_to_series(lab_test_sets: list):
+    """Adds the points of newly stored lab test sets (with their string `id`)."""
+    points = [point for test_set in lab_test_sets for point in lab_set_points(test_set)]
+    if points:
+        analyte_series_collection.insert_many(points, ordered=False)
+
+
+def replace_lab_set_series(lab_test_set: dict):
+    """Replaces the points of a lab test set whose observations changed."""
+    remove_lab_set_series(lab_test_set["id"])
+    add_lab_sets_to_series([lab_test_set])
+
+
+def remove_lab_set_series(lab_test_set_id: str):
+    """Deletes the points of a lab test set."""
+    analyte_series_collection.delete_many({"lab_test_set_id": lab_test_set_id})
+
+
+def remove_patient_series(patient_fhir_id: str):
+    """Deletes all points of a patient."""
+    analyte_series_collection.delete_many({"patient_fhir_id": patient_fhir_id})
+
+
+def backfill_analyte_series():
+    """
+    Builds the points of every stored lab test set in one aggregation, merged by
+    Observation ID so it can be run again safely. Lab sets stored before value
+    snapshots existed have no points until their snapshots are backfilled.
+
+    Returns:
+        int: The number of points in the series collection.
+    """
+    db["lab_test_sets"].aggregate(
+        [
+            {"$unwind": "$observations"},
+            {"$match": {"$expr": {"$isNumber": "$observations.value"}}},
+            {
+                "$project": {
+                    "_id": "$observations.id",
+                    "patient_fhir_id": 1,
+                    "analyte": {"$toLower": {"$trim": {"input": "$observations.name"}}},
+                    "name": "$observations.name",
+                    "date": "$test_date",
+                    "value": "$observations.value",
+                    "unit": "$observations.unit",
+                    "lab_test_set_id": {"$toString": "$_id"},
+                }
+            },
+            {"$merge": {"into": analyte_series_collection.name}},
+        ]
+    )
+    return analyte_series_collection.estimated_document_count()
+
+
+async def get_patient_analytes_async(patient_fhir_id: str):
+    """Lists the analytes a patient has points for, with their number and date span."""
+    cursor = await async_analyte_series_collection.aggregate(
+        [
+            {"$match": {"patient_fhir_id": patient_fhir_id}},
+            {"$sort": {"analyte": 1, "date": 1}},
+            {
+                "$group": {
+                    "_id": "$analyte",
+                    "name": {"$last": "$name"},
+                    "count": {"$sum": 1},
+                    "first_date": {"$first": "$date"},
+                    "last_date": {"$last": "$date"},
+                }
+            },
+            {"$sort": {"_id": 1}},
+            {"$set": {"analyte": "$_id"}},
+            {"$project": {"_id": 0}},
+        ]
+    )
+    return await cursor.to_list()
+
+
+async def get_analyte_trend_async(
+    patient_fhir_id: str, analyte: str, max_points: int, unit: str | None = None
+):
+    """
+    Returns a patient's series for one analyte in one unit, oldest first.
+
+    Values in different units can't be compared or averaged, so only the points in
+    `unit` are returned, by default the unit of the latest point. Up to `max_points` points are returned as stored. Longer series are down-sampled
+    by MongoDB with $bucketAuto into `max_points` date buckets, each with the average,
+    min and max value and the dates it spans.
+
+    Args:
+        patient_fhir_id (str): The FHIR ID of the patient.
+        analyte (str): The test name (case-insensitive).
+        max_points (int): Maximum number of points to return.
+        unit (str | None): The unit of the series; defaults to that of the latest point.
+
+    Returns:
+        dict: analyte, unit, all units the analyte has points in, total number of points
+        in the unit, whether it was down-sampled, and the points.
+    """
+    query = {"patient_fhir_id": patient_fhir_id, "analyte": analyte_key(analyte)}
+    units = await async_analyte_series_collection.distinct("unit", query)
+    if unit is None:
+        latest = await async_analyte_series_collection.find_one(
+            query, {"_id": 0, "unit": 1}, sort=[("date", -1)]
+        )
+        unit = latest.get("unit") if latest else None
+    query["unit"] = unit
+    total = await async_analyte_series_collection.count_documents(query)
+    projection = {"_id": 0, "date": 1, "value": 1, "unit": 1}
+
+    if total <= max_points:
+        points = (
+            await async_analyte_series_collection.find(query, projection)
+            .sort("date", 1)
+            .to_list()
+        )
+    else:
+        cursor = await async_analyte_series_collection.aggregate(
+            [
+                {"$match": query},
+                {"$sort": {"date": 1}},
+                {
+                    "$bucketAuto": {
+                        "groupBy": "$date",
+                        "buckets": max_points,
+                        "output": {
+                            "date_from": {"$min": "$date"},
+                            "date_to": {"$max": "$date"},
+                            "value": {"$avg": "$value"},
+                            "min": {"$min": "$value"},
+                            "max": {"$max": "$value"},
+                            "count": {"$sum": 1},
+                            "unit": {"$last": "$unit"},
+                        },
+                    }
+                },
+                {"$project": {"_id": 0}},
+            ]
+        )
+        points = await cursor.to_list()
+
+    return {
+        "analyte": analyte_key(analyte),
+        "unit": unit,
+        "units": units,
+        "total_points": total,
+        "downsampled": total > max_points,
+        "points": points,
+    }
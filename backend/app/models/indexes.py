@@ -0,0 +1,133 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from app.models.patient import patients_collection, reset_tokens_collection
+from app.models.lab_test_set import lab_test_sets_collection, LAB_SET_ORDER
+from app.models.outbox import outbox_collection
+from app.models.job import jobs_collection
+from app.models.analyte_series import analyte_series_collection
+from app.models.interpretation_cache import interpretation_cache_collection
+from app.models.lab_upload import lab_uploads_collection
+
+# (collection, keys, options) for every index the queries of the app rely on
+INDEXES = [
+    (patients_collection, [("fhir_id", ASCENDING)], {"unique": True}),
+    (
+        patients_collection,
+        [("email", ASCENDING)],
+        # Patients may have no email: only enforce uniqueness where one is set
+        {"unique": True, "partialFilterExpression": {"email": {"$type": "string"}}},
+    ),
+    (
+        lab_test_sets_collection,
+        [
+            ("patient_fhir_id", ASCENDING),
+            ("test_date", DESCENDING),
+            ("_id", DESCENDING),
+        ],
+        {},
+    ),
+    (lab_test_sets_collection, [("observations.id", ASCENDING)], {}),
+    (reset_tokens_collection, [("token", ASCENDING)], {"unique": True}),
+    (reset_tokens_collection, [("email", ASCENDING)], {"unique": True}),
+    # TTL: MongoDB removes each token once its expires_at has passed
+    (reset_tokens_collection, [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    (outbox_collection, [("status", ASCENDING), ("_id", ASCENDING)], {}),
+    (outbox_collection, [("patient_fhir_id", ASCENDING), ("status", ASCENDING)], {}),
+    (outbox_collection, [("source.id", ASCENDING)], {}),
+    (jobs_collection, [("status", ASCENDING), ("_id", ASCENDING)], {}),
+    (jobs_collection, [("type", ASCENDING), ("params", ASCENDING)], {}),
+    (
+        analyte_series_collection,
+        [
+            ("patient_fhir_id", ASCENDING),
+            ("analyte", ASCENDING),
+            ("date", ASCENDING),
+        ],
+        {},
+    ),
+    (analyte_series_collection, [("lab_test_set_id", ASCENDING)], {}),
+    (interpretation_cache_collection, [("last_used_at", ASCENDING)], {}),
+    # TTL: uploads whose job never completed are removed after LAB_UPLOAD_RETENTION_DAYS
+    (lab_uploads_collection, [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+]
+
+# Indexes made redundant by a wider one above: (collection, index name)
+OBSOLETE_INDEXES = [
+    # Prefix of the (patient_fhir_id, test_date, _id) keyset pagination index
+    (lab_test_sets_collection, "patient_fhir_id_1_test_date_-1"),
+]
+
+
+def ensure_indexes():
+    """
+    Creates the indexes in INDEXES and drops OBSOLETE_INDEXES. Safe to run on every
+    startup: existing indexes are left untouched.
+
+    Returns:
+        list: Errors for indexes that could not be created (e.g. duplicate keys
+            in existing data for a unique index).
+    """
+    errors = []
+    for collection, keys, options in INDEXES:
+        try:
+            collection.create_index(keys, **options)
+        except OperationFailure as e:
+            errors.append(f"{collection.name} {keys}: {e.details.get('errmsg', e)}")
+
+    for collection, name in OBSOLETE_INDEXES:
+        if name in collection.index_information():
+            collection.drop_index(name)
+    return errors
+
+
+def _hot_queries():
+    """The queries run on (almost) every request, as (name, cursor) pairs."""
+    return [
+        ("get_patient", patients_collection.find({"fhir_id": ""})),
+        ("search_patient_by_email", patients_collection.find({"email": ""})),
+        (
+            "get_lab_test_sets_for_patient",
+            lab_test_sets_collection.find({"patient_fhir_id": ""}).sort(LAB_SET_ORDER),
+        ),
+        (
+            "lab_test_set_by_observation",
+            lab_test_sets_collection.find({"observations.id": ""}),
+        ),
+        (
+            "check_reset_token_expiration",
+            reset_tokens_collection.find({"token": "", "expires_at": {"$gt": 0}}),
+        ),
+        (
+            "get_analyte_trend",
+            analyte_series_collection.find({"patient_fhir_id": "", "analyte": ""}).sort(
+                "date", 1
+            ),
+        ),
+        (
+            "claim_outbox_entries",
+            outbox_collection.find({"status": {"$in": ["pending"]}}).sort("_id", 1),
+        ),
+    ]
+
+
+def _has_stage(plan, stage: str):
+    """Tells whether a query plan (or any of its input stages) is `stage`."""
+    if isinstance(plan, dict):
+        return plan.get("stage") == stage or any(
+            _has_stage(value, stage) for value in plan.values()
+        )
+    if isinstance(plan, list):
+        return any(_has_stage(value, stage) for value in plan)
+    return False
+
+
+def find_collection_scans():
+    """
+    Explains the hot queries and returns the names of those whose winning plan
+    scans the whole collection.
+    """
+    return [
+        name
+        for name, cursor in _hot_queries()
+        if _has_stage(cursor.explain()["queryPlanner"]["winningPlan"], "COLLSCAN")
+    ]
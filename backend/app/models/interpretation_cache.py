@@ -0,0 +1,114 @@
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from app.db import db, async_db
+from app.config import INTERPRETATION_CACHE_MAX_ENTRIES
+
+interpretation_cache_collection = db["interpretation_cache"]
+async_interpretation_cache_collection = async_db["interpretation_cache"]
+
+# MongoDB Interpretation Cache Schema: AI interpretations by hash of their inputs
+interpretation_cache_schema = {
+    "_id": str,  # sha256 of the tests, age, gender, model and prompt version
+    "interpretation": str,
+    "model": str,
+    "created_at": datetime,
+    "last_used_at": datetime,  # Least recently used entries are evicted first
+    "hits": int,
+}
+
+
+def _hit_update():
+    return {"$set": {"last_used_at": datetime.now(timezone.utc)}, "$inc": {"hits": 1}}
+
+
+def _new_entry(interpretation: str, model: str):
+    now = datetime.now(timezone.utc)
+    return {
+        "interpretation": interpretation,
+        "model": model,
+        "created_at": now,
+        "last_used_at": now,
+        "hits": 0,
+    }
+
+
+def get_cached_interpretation(key: str):
+    """Returns the cached interpretation for a key (marking it as used), or None."""
+    entry = interpretation_cache_collection.find_one_and_update(
+        {"_id": key}, _hit_update(), return_document=ReturnDocument.AFTER
+    )
+    return entry["interpretation"] if entry else None
+
+
+async def get_cached_interpretation_async(key: str):
+    """Async counterpart of `get_cached_interpretation`."""
+    entry = await async_interpretation_cache_collection.find_one_and_update(
+        {"_id": key}, _hit_update(), return_document=ReturnDocument.AFTER
+    )
+    return entry["interpretation"] if entry else None
+
+
+def _eviction_query(entries: list):
+    return {"_id": {"$in": [entry["_id"] for entry in entries]}}
+
+
+def cache_interpretation(key: str, interpretation: str, model: str):
+    """
+    Stores an interpretation, then evicts the least recently used entries beyond
+    INTERPRETATION_CACHE_MAX_ENTRIES.
+    """
+    interpretation_cache_collection.replace_one(
+        {"_id": key}, _new_entry(interpretation, model), upsert=True
+    )
+    excess = (
+        interpretation_cache_collection.estimated_document_count()
+        - INTERPRETATION_CACHE_MAX_ENTRIES
+    )
+    if excess > 0:
+        oldest = interpretation_cache_collection.find({}, {"_id": 1}).sort(
+            "last_used_at", 1
+        )
+        interpretation_cache_collection.delete_many(
+            _eviction_query(list(oldest.limit(excess)))
+        )
+
+
+async def cache_interpretation_async(key: str, interpretation: str, model: str):
+    """Async counterpart of `cache_interpretation`."""
+    await async_interpretation_cache_collection.replace_one(
+        {"_id": key}, _new_entry(interpretation, model), upsert=True
+    )
+    excess = (
+        await async_interpretation_cache_collection.estimated_document_count()
+        - INTERPRETATION_CACHE_MAX_ENTRIES
+    )
+    if excess > 0:
+        oldest = async_interpretation_cache_collection.find({}, {"_id": 1}).sort(
+            "last_used_at", 1
+        )
+        await async_interpretation_cache_collection.delete_many(
+            _eviction_query(await oldest.limit(excess).to_list())
+        )
+
+
+def get_interpretation_cache_stats():
+    """Returns the number of cached interpretations and the hits they served."""
+    stats = next(
+        interpretation_cache_collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": None,
+                        "entries": {"$sum": 1},
+                        "hits": {"$sum": "$hits"},
+                    }
+                }
+            ]
+        ),
+        {},
+    )
+    return {
+        "entries": stats.get("entries", 0),
+        "hits": stats.get("hits", 0),
+        "max_entries": INTERPRETATION_CACHE_MAX_ENTRIES,
+    }
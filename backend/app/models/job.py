@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.db import db, async_db
+
+jobs_collection = db["jobs"]
+async_jobs_collection = async_db["jobs"]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# MongoDB Job Schema
+job_schema = {
+    "type": str,  # Selects the handler, e.g. "delete_patient"
+    "params": dict,
+    "status": str,  # queued, running, succeeded or failed
+    "steps": list,  # Step names, run in order
+    "completed_steps": list,  # Checkpoints: a resumed job skips these
+    "progress": dict,  # Step-specific counters and state, kept across resumes
+    "result": dict,
+    "error": str,
+    "created_by": str,  # Email of the user who started the job
+    "attempts": int,
+    "created_at": datetime,
+    "updated_at": datetime,
+    "locked_until": datetime,  # Lease of the worker running the job
+    "run_after": datetime,  # A retried job waits until then before being claimed again
+}
+
+
+def _format_job(job: dict):
+    """Converts ObjectId to string and drops worker bookkeeping."""
+    job["id"] = str(job.pop("_id"))
+    job.pop("locked_until", None)
+    return job
+
+
+def create_job(job_type: str, params: dict, steps: list, created_by: str):
+    """
+    Queues a new job.
+
+    Returns:
+        dict: The stored job, with its string `id`.
+    """
+    now = datetime.now(timezone.utc)
+    job = {
+        "type": job_type,
+        "params": params,
+        "status": QUEUED,
+        "steps": steps,
+        "completed_steps": [],
+        "progress": {},
+        "result": None,
+        "error": None,
+        "created_by": created_by,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+        "locked_until": None,
+        "run_after": None,
+    }
+    jobs_collection.insert_one(job)
+    return _format_job(job)
+
+
+def get_job(job_id: str):
+    """Retrieves a job by ID, or None."""
+    try:
+        object_id = ObjectId(job_id)
+    except Exception:
+        return None
+
+    job = jobs_collection.find_one({"_id": object_id})
+    return _format_job(job) if job else None
+
+
+async def get_job_async(job_id: str):
+    """Async counterpart of `get_job`."""
+    try:
+        object_id = ObjectId(job_id)
+    except Exception:
+        return None
+
+    job = await async_jobs_collection.find_one({"_id": object_id})
+    return _format_job(job) if job else None
+
+
+def find_unfinished_job(job_type: str, params: dict):
+    """Returns the queued, running or failed job of a type with the given params, or None."""
+    job = jobs_collection.find_one(
+        {
+            "type": job_type,
+            "params": params,
+            "status": {"$in": [QUEUED, RUNNING, FAILED]},
+        },
+        sort=[("_id", -1)],
+    )
+    return _format_job(job) if job else None
+
+
+def requeue_job(job_id: str):
+    """
+    Queues a failed job again with a fresh set of attempts; it resumes after its last
+    completed step.
+    """
+    now = datetime.now(timezone.utc)
+    jobs_collection.update_one(
+        {"_id": ObjectId(job_id), "status": FAILED},
+        {
+            "$set": {
+                "status": QUEUED,
+                "error": None,
+                "attempts": 0,
+                "run_after": None,
+                "updated_at": now,
+            }
+        },
+    )
+
+
+def claim_job(job_types: list, lease: float):
+    """
+    Claims the oldest queued job (once its retry delay has passed), or a running job
+    whose worker lease expired (the worker died), and marks it running.
+
+    Returns:
+        dict | None: The claimed job.
+    """
+    now = datetime.now(timezone.utc)
+    job = jobs_collection.find_one_and_update(
+        {
+            "type": {"$in": job_types},
+            "$or": [
+                {"status": QUEUED, "run_after": {"$not": {"$gt": now}}},
+                {"status": RUNNING, "locked_until": {"$lt": now}},
+            ],
+        },
+        {
+            "$set": {
+                "status": RUNNING,
+                "locked_until": now + timedelta(seconds=lease),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("_id", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return _format_job(job) if job else None
+
+
+def update_job_progress(job_id: str, progress: dict, lease: float):
+    """Records step progress and extends the worker lease."""
+    now = datetime.now(timezone.utc)
+    jobs_collection.update_one(
+        {"_id": ObjectId(job_id)},
+        {
+            "$set": {
+                **{f"progress.{key}": value for key, value in progress.items()},
+                "locked_until": now + timedelta(seconds=lease),
+                "updated_at": now,
+            }
+        },
+    )
+
+
+def checkpoint_job(job_id: str, step: str, lease: float):
+    """Marks a step as completed so a resumed job skips it."""
+    now = datetime.now(timezone.utc)
+    jobs_collection.update_one(
+        {"_id": ObjectId(job_id)},
+        {
+            "$addToSet": {"completed_steps": step},
+            "$set": {
+                "locked_until": now + timedelta(seconds=lease),
+                "updated_at": now,
+            },
+        },
+    )
+
+
+def finish_job(job_id: str, result: dict | None = None):
+    """Marks a job as succeeded."""
+    jobs_collection.update_one(
+        {"_id": ObjectId(job_id)},
+        {
+            "$set": {
+                "status": SUCCEEDED,
+                "result": result,
+                "locked_until": None,
+                "updated_at": datetime.now(timezone.utc),
+            }
+        },
+    )
+
+
+def retry_job(job_id: str, error: str, delay: float):
+    """Queues a job that failed an attempt again, to resume after `delay` seconds."""
+    now = datetime.now(timezone.utc)
+    jobs_collection.update_one(
+        {"_id": ObjectId(job_id)},
+        {
+            "$set": {
+                "status": QUEUED,
+                "error": error,
+                "locked_until": None,
+                "run_after": now + timedelta(seconds=delay),
+                "updated_at": now,
+            }
+        },
+    )
+
+
+def fail_job(job_id: str, error: str):
+    """Marks a job as failed; it can be requeued to resume from its last checkpoint."""
+    jobs_collection.update_one(
+        {"_id": ObjectId(job_id)},
+        {
+            "$set": {
+                "status": FAILED,
+                "error": error,
+                "locked_until": None,
+                "updated_at": datetime.now(timezone.utc),
+            }
+        },
+    )
+
+
+def get_job_stats():
+    """Returns the number of jobs per type and status."""
+    groups = jobs_collection.aggregate(
+        [{"$group": {"_id": {"type": "$type", "status": "$status"}, "n": {"$sum": 1}}}]
+    )
+    stats = {}
+    for group in groups:
+        job_type, status = group["_id"]["type"], group["_id"]["status"]
+        stats.setdefault(job_type, {})[status] = group["n"]
+    return stats
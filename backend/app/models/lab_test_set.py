@@ -1,12 +1,26 @@
+import base64
+import json
 from bson import ObjectId
-from pymongo import MongoClient
-from app.config import MONGO_URI
+from pymongo import ReturnDocument
+from app.db import db, async_db
 from app.models.patient import get_patient
+from app.models.outbox import new_outbox_entry, insert_with_outbox
+from app.models.patient_stats import (
+    add_lab_sets_to_stats,
+    update_lab_set_in_stats,
+    remove_lab_set_from_stats,
+    remove_patient_stats,
+)
+from app.models.analyte_series import (
+    add_lab_sets_to_series,
+    replace_lab_set_series,
+    remove_lab_set_series,
+    remove_patient_series,
+)
 
 
-client = MongoClient(MONGO_URI)
-db = client.medical_dashboard
 lab_test_sets_collection = db["lab_test_sets"]
+async_lab_test_sets_collection = async_db["lab_test_sets"]
 
 # MongoDB Lab Test Set Schema
 lab_test_set_schema = {
@@ -14,53 +28,232 @@ lab_test_set_schema = {
     "birth_date": str,  # Patient's birth date for context
     "gender": str,  # Patient's gender for context
     "test_date": str,  # Date of the test set
-    "observations": list,  # Store both FHIR Observation IDs and test names
+    "observations": list,  # FHIR Observation IDs and names, with a snapshot of their values
     "interpretation": str,  # AI summary
 }
 
 
-def store_lab_test_set(patient_fhir_id: str, test_date: str, observations: list):
+def observation_snapshot(observation: dict):
     """
-    Stores a new lab test set in MongoDB with FHIR Observation IDs and test names.
+    Captures what is needed to display an Observation without going back to FHIR:
+    value, unit, reference range and an abnormal flag ("H", "L", "N" or None when unknown).
 
     Args:
-        patient_fhir_id (str): The FHIR ID of the patient.
-        test_date (str): The date the tests were performed.
-        observations (list): List of Observation resources from FHIR.
+        observation (dict): The Observation resource from FHIR.
 
     Returns:
-        dict: The saved lab test set.
+        dict: The snapshot stored in the lab test set.
     """
-    # ✅ Fetch patient details directly from MongoDB
-    patient_details = get_patient(patient_fhir_id)
+    quantity = observation.get("valueQuantity", {})
+    value = quantity.get("value")
+    reference_range = (observation.get("referenceRange") or [{}])[0]
+    low = reference_range.get("low", {}).get("value")
+    high = reference_range.get("high", {}).get("value")
+
+    flag = None
+    if isinstance(value, (int, float)) and (low is not None or high is not None):
+        if low is not None and value < low:
+            flag = "L"
+        elif high is not None and value > high:
+            flag = "H"
+        else:
+            flag = "N"
+
+    return {
+        "id": observation["id"],
+        "name": observation["code"]["text"],
+        "value": value,
+        "unit": quantity.get("unit"),
+        "reference_range": (
+            {"low": low, "high": high} if low is not None or high is not None else None
+        ),
+        "flag": flag,
+        "abnormal": flag in ["H", "L"] if flag else None,
+    }
 
-    if not patient_details:
-        return {"error": "Patient not found in MongoDB."}
 
+def has_snapshot(observation: dict):
+    """Tells whether a stored observation carries a value snapshot (older sets only have id and name)."""
+    return "value" in observation
+
+
+def snapshot_to_observation(snapshot: dict, patient_fhir_id: str, test_date: str):
+    """Rebuilds a FHIR-shaped Observation from a stored snapshot."""
+    observation = {
+        "resourceType": "Observation",
+        "id": snapshot["id"],
+        "status": "final",
+        "code": {"text": snapshot["name"]},
+        "subject": {"reference": f"Patient/{patient_fhir_id}"},
+        "effectiveDateTime": test_date,
+        "valueQuantity": {"value": snapshot["value"], "unit": snapshot["unit"]},
+    }
+
+    reference_range = snapshot.get("reference_range")
+    if reference_range:
+        observation["referenceRange"] = [
+            {
+                bound: {"value": reference_range[bound], "unit": snapshot["unit"]}
+                for bound in ["low", "high"]
+                if reference_range.get(bound) is not None
+            }
+        ]
+
+    if snapshot.get("flag"):
+        observation["interpretation"] = [
+            {
+                "coding": [
+                    {
+                        "system": "http://terminology.hl7.org/CodeSystem/v3-ObservationInterpretation",
+                        "code": snapshot["flag"],
+                    }
+                ]
+            }
+        ]
+
+    return observation
+
+
+def build_lab_test_set(patient_details: dict, test_date: str, observations: list):
+    """
+    Builds a lab test set document from the patient record and the created FHIR Observations.
+
+    Args:
+        patient_details (dict): The patient record from MongoDB.
+        test_date (str): The date the tests were performed.
+        observations (list): List of Observation resources from FHIR.
+
+    Returns:
+        dict: The lab test set document, ready to be inserted.
+    """
     # ✅ Extract birth date & gender from the patient record
     birth_date = patient_details.get("birth_date", "Unknown")
     gender = patient_details.get("gender", "Unknown")
 
-    # Extract observation IDs and names
+    # Keep a snapshot of each observation so reads don't need FHIR
     observation_data = []
     for obs in observations:
         if "id" in obs and "code" in obs and "text" in obs["code"]:
-            observation_data.append({"id": obs["id"], "name": obs["code"]["text"]})
+            observation_data.append(observation_snapshot(obs))
 
-    lab_test_set = {
-        "patient_fhir_id": patient_fhir_id,
+    return {
+        "patient_fhir_id": patient_details["fhir_id"],
         "test_date": test_date,
         "birth_date": birth_date,
         "gender": gender,
-        "observations": observation_data,  # Store both IDs and names
+        "observations": observation_data,  # Store IDs, names and value snapshots
         "interpretation": None,  # Placeholder for future AI summary
     }
 
-    result = lab_test_sets_collection.insert_one(lab_test_set)
+
+def store_lab_test_set(
+    patient_fhir_id: str,
+    test_date: str,
+    observations: list,
+    sync_to_fhir: bool = False,
+    lab_test_set_id: ObjectId | None = None,
+):
+    """
+    Stores a new lab test set in MongoDB with FHIR Observation IDs and test names.
+
+    Args:
+        patient_fhir_id (str): The FHIR ID of the patient.
+        test_date (str): The date the tests were performed.
+        observations (list): List of Observation resources from FHIR.
+        sync_to_fhir (bool): If True, the Observations (with client-assigned ids) are not in
+            FHIR yet and are queued in the FHIR outbox, atomically with the lab test set.
+        lab_test_set_id (ObjectId | None): ID to store the lab test set under; storing the
+            same ID again raises DuplicateKeyError, so a retried job stores it only once.
+
+    Returns:
+        dict: The saved lab test set.
+    """
+    # ✅ Fetch patient details directly from MongoDB
+    patient_details = get_patient(patient_fhir_id)
+
+    if not patient_details:
+        return {"error": "Patient not found in MongoDB."}
+
+    lab_test_set = build_lab_test_set(patient_details, test_date, observations)
+
+    if lab_test_set_id:
+        lab_test_set["_id"] = lab_test_set_id
+
+    if sync_to_fhir:
+        lab_test_set.setdefault("_id", ObjectId())
+        outbox_entry = new_outbox_entry(
+            patient_fhir_id,
+            observations,
+            {"collection": lab_test_sets_collection.name, "id": lab_test_set["_id"]},
+        )
+        result = insert_with_outbox(
+            lab_test_sets_collection, lab_test_set, [outbox_entry]
+        )
+    else:
+        result = lab_test_sets_collection.insert_one(lab_test_set)
     lab_test_set["id"] = str(result.inserted_id)
+    add_lab_sets_to_stats([lab_test_set])
+    add_lab_sets_to_series([lab_test_set])
     return lab_test_set
 
 
+def store_lab_test_sets(lab_test_sets: list):
+    """
+    Stores many lab test sets in MongoDB with a single insert_many.
+
+    Args:
+        lab_test_sets (list): Documents built with `build_lab_test_set`.
+
+    Returns:
+        list: The IDs of the stored lab test sets.
+    """
+    if not lab_test_sets:
+        return []
+
+    result = lab_test_sets_collection.insert_many(lab_test_sets, ordered=False)
+    inserted_ids = [str(inserted_id) for inserted_id in result.inserted_ids]
+    for lab_test_set, inserted_id in zip(lab_test_sets, inserted_ids):
+        lab_test_set["id"] = inserted_id
+    add_lab_sets_to_stats(lab_test_sets)
+    add_lab_sets_to_series(lab_test_sets)
+    return inserted_ids
+
+
+def find_lab_sets_by_observation_ids(observation_ids: list):
+    """
+    Finds the stored lab test sets holding any of the given Observation IDs.
+
+    Args:
+        observation_ids (list): FHIR Observation IDs.
+
+    Returns:
+        dict: Maps each stored Observation ID to its lab test set, as returned by the API.
+    """
+    wanted = set(observation_ids)
+    by_observation = {}
+    for test_set in lab_test_sets_collection.find(
+        {"observations.id": {"$in": observation_ids}}
+    ):
+        lab_test_set = _format_lab_test_set(test_set)
+        for obs in lab_test_set["observations"]:
+            if obs.get("id") in wanted:
+                by_observation[obs["id"]] = lab_test_set
+    return by_observation
+
+
+def _format_lab_test_set(test_set: dict):
+    """Converts a lab test set document to the shape returned by the API."""
+    return {
+        "id": str(test_set["_id"]),
+        "patient_fhir_id": test_set["patient_fhir_id"],
+        "test_date": test_set["test_date"],
+        "observations": test_set.get("observations", []),
+        "birth_date": test_set.get("birth_date", "Unknown"),
+        "gender": test_set.get("gender", "Unknown"),
+        "interpretation": test_set.get("interpretation"),
+    }
+
+
 def get_lab_test_sets_for_patient(patient_fhir_id: str):
     """
     Retrieves all lab test sets for a patient from MongoDB.
@@ -71,25 +264,171 @@ def get_lab_test_sets_for_patient(patient_fhir_id: str):
     Returns:
         list: A list of lab test sets with observation IDs and names.
     """
-    lab_test_sets = list(
+    lab_test_sets = lab_test_sets_collection.find({"patient_fhir_id": patient_fhir_id})
+
+    # Convert ObjectId to string and remove _id field
+    return [_format_lab_test_set(test_set) for test_set in lab_test_sets]
+
+
+async def get_lab_test_sets_for_patient_async(patient_fhir_id: str):
+    """Async counterpart of `get_lab_test_sets_for_patient`."""
+    lab_test_sets = async_lab_test_sets_collection.find(
+        {"patient_fhir_id": patient_fhir_id}
+    )
+    return [_format_lab_test_set(test_set) async for test_set in lab_test_sets]
+
+
+# Newest first; _id breaks ties between sets of the same date (index-backed)
+LAB_SET_ORDER = [("test_date", -1), ("_id", -1)]
+
+# What the patient stats and analyte series are computed from
+_STATS_FIELDS = {
+    "patient_fhir_id": 1,
+    "test_date": 1,
+    "interpretation": 1,
+    "observations.abnormal": 1,
+}
+
+
+def count_lab_test_sets_for_patient(patient_fhir_id: str):
+    """Counts a patient's lab test sets (answered from the index)."""
+    return lab_test_sets_collection.count_documents(
+        {"patient_fhir_id": patient_fhir_id}
+    )
+
+
+async def count_lab_test_sets_for_patient_async(patient_fhir_id: str):
+    """Async counterpart of `count_lab_test_sets_for_patient`."""
+    return await async_lab_test_sets_collection.count_documents(
+        {"patient_fhir_id": patient_fhir_id}
+    )
+
+
+def encode_lab_set_cursor(lab_test_set: dict):
+    """Builds the opaque cursor pointing after a lab test set."""
+    position = json.dumps([lab_test_set["test_date"], lab_test_set["id"]])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def _decode_lab_set_cursor(cursor: str):
+    """Reads a cursor back into (test_date, ObjectId); raises ValueError if invalid."""
+    try:
+        test_date, lab_test_set_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return test_date, ObjectId(lab_test_set_id)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+def get_lab_test_sets_page(
+    patient_fhir_id: str,
+    page_size: int,
+    page: int = 1,
+    cursor: str | None = None,
+):
+    """
+    Retrieves one page of a patient's lab test sets, newest first, sorted and sliced by MongoDB.
+
+    With a `cursor` (from a previous page), the page starts right after that lab test set
+    using a keyset condition on (test_date, _id), so deep pages cost the same as the first.
+    Without one, `page` is used with skip/limit.
+
+    Args:
+        patient_fhir_id (str): The FHIR ID of the patient.
+        page_size (int): Number of lab test sets per page.
+        page (int): The page number (1-based), used when no cursor is given.
+        cursor (str | None): Opaque cursor returned with the previous page.
+
+    Returns:
+        tuple: (lab test sets, cursor for the next page or None on the last page).
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    query, skip = _lab_sets_page_query(patient_fhir_id, page_size, page, cursor)
+    documents = list(
+        lab_test_sets_collection.find(query)
+        .sort(LAB_SET_ORDER)
+        .skip(skip)
+        .limit(page_size + 1)
+    )
+    return _lab_sets_page_result(documents, page_size)
+
+
+async def get_lab_test_sets_page_async(
+    patient_fhir_id: str,
+    page_size: int,
+    page: int = 1,
+    cursor: str | None = None,
+):
+    """Async counterpart of `get_lab_test_sets_page`."""
+    query, skip = _lab_sets_page_query(patient_fhir_id, page_size, page, cursor)
+    documents = await (
+        async_lab_test_sets_collection.find(query)
+        .sort(LAB_SET_ORDER)
+        .skip(skip)
+        .limit(page_size + 1)
+        .to_list()
+    )
+    return _lab_sets_page_result(documents, page_size)
+
+
+def _lab_sets_page_query(patient_fhir_id, page_size, page, cursor):
+    """Returns the (query, skip) selecting a page of lab test sets."""
+    query = {"patient_fhir_id": patient_fhir_id}
+    if not cursor:
+        return query, (page - 1) * page_size
+
+    test_date, last_id = _decode_lab_set_cursor(cursor)
+    query["$or"] = [
+        {"test_date": {"$lt": test_date}},
+        {"test_date": test_date, "_id": {"$lt": last_id}},
+    ]
+    return query, 0
+
+
+def _lab_sets_page_result(documents: list, page_size: int):
+    """
+    Formats a page fetched with one extra document, which tells whether there is
+    a next page.
+    """
+    lab_test_sets = [_format_lab_test_set(test_set) for test_set in documents]
+
+    if len(lab_test_sets) > page_size:
+        lab_test_sets = lab_test_sets[:page_size]
+        return lab_test_sets, encode_lab_set_cursor(lab_test_sets[-1])
+    return lab_test_sets, None
+
+
+def iter_lab_test_sets_for_patient(patient_fhir_id: str, batch_size: int = 100):
+    """
+    Streams all lab test sets of a patient from a MongoDB cursor, oldest first,
+    without loading them all into memory.
+
+    Args:
+        patient_fhir_id (str): The FHIR ID of the patient.
+        batch_size (int): Number of documents fetched from MongoDB per round trip.
+
+    Yields:
+        dict: Lab test sets, with `_id` converted to a string `id`.
+    """
+    cursor = (
         lab_test_sets_collection.find({"patient_fhir_id": patient_fhir_id})
+        .sort("test_date", 1)
+        .batch_size(batch_size)
     )
+    for test_set in cursor:
+        test_set["id"] = str(test_set.pop("_id"))
+        yield test_set
 
-    # Convert ObjectId to string and remove _id field
-    formatted_sets = []
-    for test_set in lab_test_sets:
-        formatted_set = {
-            "id": str(test_set["_id"]),
-            "patient_fhir_id": test_set["patient_fhir_id"],
-            "test_date": test_set["test_date"],
-            "observations": test_set.get("observations", []),
-            "birth_date": test_set.get("birth_date", "Unknown"),
-            "gender": test_set.get("gender", "Unknown"),
-            "interpretation": test_set.get("interpretation"),
-        }
-        formatted_sets.append(formatted_set)
-
-    return formatted_sets
+
+def iter_lab_test_sets_without_snapshots(batch_size: int = 100):
+    """Streams the lab test sets that still have observations without a value snapshot."""
+    cursor = lab_test_sets_collection.find(
+        {"observations": {"$elemMatch": {"value": {"$exists": False}}}}
+    ).batch_size(batch_size)
+    for test_set in cursor:
+        test_set["id"] = str(test_set.pop("_id"))
+        yield test_set
 
 
 def get_lab_test_set_by_id(lab_test_set_id: str):
@@ -114,6 +453,19 @@ def get_lab_test_set_by_id(lab_test_set_id: str):
     return test_set
 
 
+async def get_lab_test_set_by_id_async(lab_test_set_id: str):
+    """Async counterpart of `get_lab_test_set_by_id`."""
+    try:
+        object_id = ObjectId(lab_test_set_id)
+    except Exception:
+        return None
+
+    test_set = await async_lab_test_sets_collection.find_one({"_id": object_id})
+    if test_set:
+        test_set["id"] = str(test_set.pop("_id"))
+    return test_set
+
+
 def update_lab_test_set(lab_test_set_id: str, update_data: dict):
     """
     Updates a lab test set in MongoDB with new data.
@@ -130,11 +482,18 @@ def update_lab_test_set(lab_test_set_id: str, update_data: dict):
     except Exception:
         return {"error": "Invalid lab test set ID format."}
 
-    result = lab_test_sets_collection.update_one(
-        {"_id": object_id}, {"$set": update_data}
+    # The previous version tells how the patient's stats change
+    before = lab_test_sets_collection.find_one_and_update(
+        {"_id": object_id},
+        {"$set": update_data},
+        projection=_STATS_FIELDS,
+        return_document=ReturnDocument.BEFORE,
     )
 
-    if result.matched_count:
+    if before:
+        update_lab_set_in_stats(before, {**before, **update_data})
+        if "observations" in update_data:
+            replace_lab_set_series({**before, **update_data, "id": lab_test_set_id})
         return {"message": "Lab test set updated successfully."}
     return {"error": "Lab test set not found."}
 
@@ -154,8 +513,33 @@ def remove_lab_test_set(lab_test_set_id: str):
     except Exception:
         return {"error": "Invalid lab test set ID format."}
 
-    result = lab_test_sets_collection.delete_one({"_id": object_id})
+    deleted = lab_test_sets_collection.find_one_and_delete(
+        {"_id": object_id}, projection=_STATS_FIELDS
+    )
 
-    if result.deleted_count:
+    if deleted:
+        newest = lab_test_sets_collection.find_one(
+            {"patient_fhir_id": deleted["patient_fhir_id"]},
+            projection={"test_date": 1},
+            sort=LAB_SET_ORDER,
+        )
+        remove_lab_set_from_stats(deleted, newest["test_date"] if newest else None)
+        remove_lab_set_series(lab_test_set_id)
         return {"message": f"Lab test set {lab_test_set_id} deleted successfully."}
     return {"error": "Lab test set not found."}
+
+
+def remove_lab_test_sets_for_patient(patient_fhir_id: str):
+    """
+    Deletes all lab test sets of a patient from MongoDB with a single delete_many.
+
+    Args:
+        patient_fhir_id (str): The FHIR ID of the patient.
+
+    Returns:
+        int: The number of deleted lab test sets.
+    """
+    result = lab_test_sets_collection.delete_many({"patient_fhir_id": patient_fhir_id})
+    remove_patient_stats(patient_fhir_id)
+    remove_patient_series(patient_fhir_id)
+    return result.deleted_count
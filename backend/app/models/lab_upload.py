@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from app.db import db
+from app.config import LAB_UPLOAD_RETENTION_DAYS
+
+lab_uploads_collection = db["lab_uploads"]
+
+# MongoDB Lab Upload Schema: an uploaded file and what was extracted from it so far,
+# kept while the background job processing it runs
+lab_upload_schema = {
+    "filename": str,
+    "content_type": str,
+    "contents": bytes,
+    "pages": list,  # Text extracted from each page of the file (OCR)
+    "observations": list,  # Observations built from the extracted lab results
+    "created_at": datetime,
+    "expires_at": datetime,  # Removed by a TTL index if never processed
+}
+
+
+def store_lab_upload(filename: str, content_type: str, contents: bytes):
+    """Stores an uploaded file and returns its ID."""
+    now = datetime.now(timezone.utc)
+    result = lab_uploads_collection.insert_one(
+        {
+            "filename": filename,
+            "content_type": content_type,
+            "contents": contents,
+            "created_at": now,
+            "expires_at": now + timedelta(days=LAB_UPLOAD_RETENTION_DAYS),
+        }
+    )
+    return str(result.inserted_id)
+
+
+def get_lab_upload(upload_id: str):
+    """Retrieves an upload by ID, or None."""
+    return lab_uploads_collection.find_one({"_id": ObjectId(upload_id)})
+
+
+def update_lab_upload(upload_id: str, update_data: dict):
+    """Records what a processing step extracted from an upload."""
+    lab_uploads_collection.update_one(
+        {"_id": ObjectId(upload_id)}, {"$set": update_data}
+    )
+
+
+def remove_lab_upload(upload_id: str):
+    """Deletes an upload once it has been processed."""
+    lab_uploads_collection.delete_one({"_id": ObjectId(upload_id)})
@@ -0,0 +1,290 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from app.db import db
+
+
+outbox_collection = db["fhir_outbox"]
+
+# Returned by MongoDB when transactions are used on a standalone server
+ILLEGAL_OPERATION = 20
+
+PENDING = "pending"
+PROCESSING = "processing"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# MongoDB FHIR Outbox Schema
+outbox_schema = {
+    "patient_fhir_id": str,  # Entries of a patient are synced in order
+    "resources": list,  # FHIR resources with client-assigned ids, written with PUT
+    "source": dict,  # {"collection", "id"} of the document that queued the entry
+    "status": str,  # pending, processing, failed or cancelled (synced entries are removed)
+    "attempts": int,
+    "last_error": str,
+    "created_at": datetime,
+    "next_attempt_at": datetime,  # Retries are delayed with exponential backoff
+    "locked_until": datetime,  # Lease of the worker processing the entry
+    "redriven_at": datetime,  # Last time the failed entry was put back in the queue
+}
+
+# Unsynced entries hold back the later entries of their patient, failed ones included
+UNSYNCED = [PENDING, PROCESSING, FAILED]
+
+
+def new_outbox_entry(patient_fhir_id: str, resources: list, source: dict | None = None):
+    """Builds an outbox entry that writes `resources` to FHIR."""
+    now = datetime.now(timezone.utc)
+    return {
+        "patient_fhir_id": patient_fhir_id,
+        "resources": resources,
+        "source": source,
+        "status": PENDING,
+        "attempts": 0,
+        "last_error": None,
+        "created_at": now,
+        "next_attempt_at": now,
+        "locked_until": None,
+        "redriven_at": None,
+    }
+
+
+def insert_with_outbox(collection, document: dict, entries: list):
+    """
+    Inserts a document and its outbox entries atomically, in a MongoDB transaction.
+
+    Standalone servers don't support transactions; there the entries are written first,
+    so a crash in between can only leave FHIR ahead of MongoDB, never silently behind.
+
+    Args:
+        collection: The collection the document belongs to.
+        document (dict): The document to insert.
+        entries (list): Outbox entries built with `new_outbox_entry`.
+
+    Returns:
+        InsertOneResult: The result of inserting the document.
+    """
+    outbox = collection.database[outbox_collection.name]
+
+    def write(session=None):
+        outbox.insert_many(entries, session=session)
+        return collection.insert_one(document, session=session)
+
+    with collection.database.client.start_session() as session:
+        try:
+            return session.with_transaction(write)
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION:
+                raise
+
+    return write()
+
+
+def enqueue_outbox_entry(
+    patient_fhir_id: str, resources: list, source: dict | None = None
+):
+    """Queues resources to be written to FHIR after the patient's pending entries."""
+    entry = new_outbox_entry(patient_fhir_id, resources, source)
+    outbox_collection.insert_one(entry)
+    return entry
+
+
+def claim_outbox_entries(max_resources: int, lease: float):
+    """
+    Claims the entries that are ready to be synced, at most one per patient: the oldest
+    unsynced entry of each patient, so a patient's writes reach FHIR in order. A failed
+    entry holds back the rest of its patient's queue until it is redriven or cancelled.
+
+    Args:
+        max_resources (int): Stop claiming once about this many resources are claimed.
+        lease (float): Seconds the entries stay locked to this worker.
+
+    Returns:
+        list: The claimed entries, oldest first.
+    """
+    now = datetime.now(timezone.utc)
+    heads = outbox_collection.aggregate(
+        [
+            {"$match": {"status": {"$in": UNSYNCED}}},
+            {"$sort": {"_id": 1}},
+            {"$group": {"_id": "$patient_fhir_id", "head": {"$first": "$$ROOT"}}},
+            {"$replaceWith": "$head"},
+            {"$match": {"status": PENDING, "next_attempt_at": {"$lte": now}}},
+            {"$sort": {"_id": 1}},
+            {"$limit": max_resources},
+        ]
+    )
+
+    claimed, size = [], 0
+    for head in heads:
+        if claimed and size + len(head["resources"]) > max_resources:
+            break
+        # Another worker may have claimed it in the meantime
+        entry = outbox_collection.find_one_and_update(
+            {"_id": head["_id"], "status": PENDING},
+            {
+                "$set": {
+                    "status": PROCESSING,
+                    "locked_until": now + timedelta(seconds=lease),
+                }
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if entry:
+            claimed.append(entry)
+            size += len(entry["resources"])
+    return claimed
+
+
+def complete_outbox_entry(entry_id):
+    """
+    Removes an entry once synced.
+
+    Returns:
+        bool: False if the entry was cancelled while it was being synced.
+    """
+    result = outbox_collection.delete_one({"_id": entry_id, "status": PROCESSING})
+    if result.deleted_count:
+        return True
+
+    outbox_collection.delete_one({"_id": entry_id, "status": CANCELLED})
+    return False
+
+
+def retry_outbox_entry(entry: dict, error: str, delay: float, max_attempts: int):
+    """Puts an entry back in the queue after `delay` seconds, or marks it failed."""
+    attempts = entry["attempts"] + 1
+    update = {
+        "attempts": attempts,
+        "last_error": error,
+        "locked_until": None,
+    }
+    if attempts >= max_attempts:
+        update["status"] = FAILED
+    else:
+        update["status"] = PENDING
+        update["next_attempt_at"] = datetime.now(timezone.utc) + timedelta(
+            seconds=delay
+        )
+
+    outbox_collection.update_one(
+        {"_id": entry["_id"], "status": PROCESSING}, {"$set": update}
+    )
+
+
+def requeue_expired_outbox_entries():
+    """Releases entries whose worker died (or stalled) past its lease; this counts as an attempt."""
+    result = outbox_collection.update_many(
+        {
+            "status": PROCESSING,
+            "locked_until": {"$lt": datetime.now(timezone.utc)},
+        },
+        {"$set": {"status": PENDING, "locked_until": None}, "$inc": {"attempts": 1}},
+    )
+    return result.modified_count
+
+
+def claim_expired_cancelled_outbox_entry(lease: float):
+    """
+    Claims a cancelled entry whose worker died (or stalled) past its lease before removing
+    its resources from FHIR, extending the lease so other workers leave it alone.
+
+    Returns:
+        dict | None: The claimed entry, or None if there is none.
+    """
+    now = datetime.now(timezone.utc)
+    return outbox_collection.find_one_and_update(
+        {"status": CANCELLED, "locked_until": {"$lt": now}},
+        {"$set": {"locked_until": now + timedelta(seconds=lease)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def remove_cancelled_outbox_entry(entry_id):
+    """Removes a cancelled entry once its resources are gone from FHIR."""
+    outbox_collection.delete_one({"_id": entry_id, "status": CANCELLED})
+
+
+def redrive_failed_outbox_entries(query: dict | None = None):
+    """
+    Puts failed entries (matching `query`, e.g. one patient) back in the queue with a
+    fresh set of attempts, once the cause of their failure is fixed.
+
+    Returns:
+        int: The number of entries put back in the queue.
+    """
+    now = datetime.now(timezone.utc)
+    result = outbox_collection.update_many(
+        {**(query or {}), "status": FAILED},
+        {
+            "$set": {
+                "status": PENDING,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "redriven_at": now,
+            }
+        },
+    )
+    return result.modified_count
+
+
+def cancel_outbox_entries(query: dict):
+    """
+    Cancels the unsynced entries matching `query`, e.g. when their lab set or patient is deleted.
+    Entries being synced are flagged so the worker removes their resources from FHIR afterwards.
+
+    Returns:
+        set: IDs of the resources that were never sent to FHIR.
+    """
+    never_sent = set()
+    for entry in outbox_collection.find(
+        {**query, "status": {"$in": [PENDING, FAILED]}}
+    ):
+        if entry["attempts"] == 0 and not entry.get("redriven_at"):
+            never_sent.update(resource["id"] for resource in entry["resources"])
+
+    outbox_collection.delete_many({**query, "status": {"$in": [PENDING, FAILED]}})
+    outbox_collection.update_many(
+        {**query, "status": PROCESSING}, {"$set": {"status": CANCELLED}}
+    )
+    return never_sent
+
+
+def has_pending_outbox_entries(patient_fhir_id: str):
+    """Tells whether some writes of the patient have not reached FHIR yet (failed ones included)."""
+    return (
+        outbox_collection.count_documents(
+            {
+                "patient_fhir_id": patient_fhir_id,
+                "status": {"$in": UNSYNCED},
+            },
+            limit=1,
+        )
+        > 0
+    )
+
+
+def get_outbox_stats():
+    """Returns the queue depth per status and the age of the oldest unsynced entry."""
+    depth = {
+        status["_id"]: status["count"]
+        for status in outbox_collection.aggregate(
+            [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        )
+    }
+
+    oldest = outbox_collection.find_one(
+        {"status": {"$in": [PENDING, PROCESSING]}}, sort=[("_id", 1)]
+    )
+    lag = 0.0
+    if oldest:
+        created_at = oldest["created_at"].replace(tzinfo=timezone.utc)
+        lag = (datetime.now(timezone.utc) - created_at).total_seconds()
+
+    return {
+        "pending": depth.get(PENDING, 0),
+        "processing": depth.get(PROCESSING, 0),
+        "failed": depth.get(FAILED, 0),
+        "cancelled": depth.get(CANCELLED, 0),
+        "lag_seconds": round(lag, 3),
+    }
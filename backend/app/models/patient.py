@@ -1,14 +1,15 @@
 from datetime import datetime, timezone
-from pymongo import MongoClient
-from app.config import MONGO_URI
+from app.db import db, async_db
 from pydantic import BaseModel
 from enum import Enum
 from fastapi import HTTPException
+from app.models.outbox import new_outbox_entry, insert_with_outbox
 
 
-client = MongoClient(MONGO_URI)
-db = client.medical_dashboard
 patients_collection = db["patients"]
+async_patients_collection = async_db["patients"]
+# Expired tokens are removed by a TTL index on expires_at (see app/models/indexes.py)
+reset_tokens_collection = db["password_reset_tokens"]
 
 
 class Gender(str, Enum):
@@ -32,8 +33,11 @@ class Patient(BaseModel):
     updated_at: datetime = None
 
 
-def store_patient(patient: Patient):
-    """Stores the patient in MongoDB, ensuring gender validation."""
+def store_patient(patient: Patient, fhir_resource: dict | None = None):
+    """
+    Stores the patient in MongoDB, ensuring gender validation.
+    If a FHIR Patient resource is given, it is queued in the FHIR outbox atomically with the patient.
+    """
     # Convert Pydantic model to dictionary for MongoDB
     patient_dict = patient.model_dump(by_alias=True)
 
@@ -42,7 +46,11 @@ def store_patient(patient: Patient):
     patient_dict["created_at"] = now
     patient_dict["updated_at"] = now
 
-    result = patients_collection.insert_one(patient_dict)
+    if fhir_resource:
+        outbox_entry = new_outbox_entry(patient.fhir_id, [fhir_resource])
+        result = insert_with_outbox(patients_collection, patient_dict, [outbox_entry])
+    else:
+        result = patients_collection.insert_one(patient_dict)
 
     # Check if the insert was acknowledged
     if not result.acknowledged:
@@ -66,8 +74,78 @@ def update_patient(fhir_id: str, update_data: dict):
 
 
 def get_patients():
-    """Retrieves patients from MongoDB"""
-    return patients_collection.find()
+    """Retrieves patients from MongoDB, except those being deleted"""
+    return patients_collection.find({"deleting": {"$ne": True}})
+
+
+# The patient's counters, maintained incrementally in patient_stats (an _id lookup)
+_lab_set_counts_lookup = {
+    "$lookup": {
+        "from": "patient_stats",
+        "localField": "fhir_id",
+        "foreignField": "_id",
+        "as": "lab_stats",
+    }
+}
+
+
+def _first_or_zero(field: str):
+    return {"$ifNull": [{"$arrayElemAt": [f"$lab_stats.{field}", 0]}, 0]}
+
+
+def _patients_page_pipeline(page: int, page_size: int):
+    """
+    One aggregation for a page of patients (except those being deleted) with their
+    lab set stats: the page and the total come from one $facet and passwords are
+    dropped server-side.
+    """
+    page_pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$skip": (page - 1) * page_size},
+        {"$limit": page_size},
+        _lab_set_counts_lookup,
+        {
+            "$set": {
+                "lab_set_count": _first_or_zero("lab_set_count"),
+                "interpreted_count": _first_or_zero("interpreted_count"),
+                "abnormal_count": _first_or_zero("abnormal_count"),
+                "last_test_date": {"$arrayElemAt": ["$lab_stats.last_test_date", 0]},
+            }
+        },
+        {"$project": {"_id": 0, "password": 0, "lab_stats": 0}},
+    ]
+    return [
+        {"$match": {"deleting": {"$ne": True}}},
+        {"$facet": {"total": [{"$count": "count"}], "patients": page_pipeline}},
+    ]
+
+
+def _patients_page_result(result: dict):
+    total = result["total"][0]["count"] if result["total"] else 0
+    return result["patients"], total
+
+
+def get_patients_page(page: int, page_size: int):
+    """
+    Retrieves one page of patients with their lab set stats, in a single aggregation.
+
+    Args:
+        page (int): The page number (1-based).
+        page_size (int): Number of patients per page.
+
+    Returns:
+        tuple: (patients with their lab set stats, total number of patients)
+    """
+    pipeline = _patients_page_pipeline(page, page_size)
+    return _patients_page_result(patients_collection.aggregate(pipeline).next())
+
+
+async def get_patients_page_async(page: int, page_size: int):
+    """Async counterpart of `get_patients_page`."""
+    cursor = await async_patients_collection.aggregate(
+        _patients_page_pipeline(page, page_size)
+    )
+    return _patients_page_result(await cursor.next())
 
 
 def get_patient(fhir_id):
@@ -75,6 +153,21 @@ def get_patient(fhir_id):
     return patients_collection.find_one({"fhir_id": fhir_id})
 
 
+async def get_patient_async(fhir_id: str):
+    """Async counterpart of `get_patient`."""
+    return await async_patients_collection.find_one({"fhir_id": fhir_id})
+
+
+def get_patients_by_fhir_ids(fhir_ids: list):
+    """Retrieves many patients from MongoDB in one query, keyed by fhir_id"""
+    return {
+        patient["fhir_id"]: patient
+        for patient in patients_collection.find(
+            {"fhir_id": {"$in": list(fhir_ids)}}, {"password": 0}
+        )
+    }
+
+
 def search_patient(first_name, last_name):
     """Retrieves patient from MongoDB by first and lastname"""
     return patients_collection.find_one(
@@ -87,11 +180,24 @@ def search_patient_by_email(email: str):
     return patients_collection.find_one({"email": email})
 
 
+async def search_patient_by_email_async(email: str):
+    """Async counterpart of `search_patient_by_email`."""
+    return await async_patients_collection.find_one({"email": email})
+
+
 def delete_patient(fhir_id):
     """Deletes a patient from MongoDB"""
     patients_collection.delete_one({"fhir_id": fhir_id})
 
 
+def mark_patient_deleting(fhir_id: str):
+    """Flags a patient whose deletion job is in progress, hiding them from the patient list"""
+    now = datetime.now(timezone.utc)
+    patients_collection.update_one(
+        {"fhir_id": fhir_id}, {"$set": {"deleting": True, "updated_at": now}}
+    )
+
+
 def assign_admin(email: str):
     """Assigns admin role to a patient."""
     now = datetime.now(timezone.utc)
@@ -109,14 +215,18 @@ def update_password(email: str, new_password: str):
             "$unset": {"reset_token": "", "reset_token_expires": ""},
         },
     )
+    reset_tokens_collection.delete_many({"email": email})
 
 
 def check_reset_token_expiration(token: str):
-    patient = patients_collection.find_one(
-        {
-            "reset_token": token,
-            "reset_token_expires": {"$gt": datetime.now(timezone.utc)},
-        }
+    # The TTL monitor only runs every minute, so expiry is still checked here
+    reset_token = reset_tokens_collection.find_one(
+        {"token": token, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    patient = (
+        patients_collection.find_one({"email": reset_token["email"]})
+        if reset_token
+        else None
     )
     if not patient:
         raise HTTPException(status_code=400, detail="Invalid or expired reset token")
@@ -124,14 +234,15 @@ def check_reset_token_expiration(token: str):
 
 
 def update_reset_token(email: str, reset_token: str, expires_at: datetime):
+    # One active token per email: a new request replaces the previous token
     now = datetime.now(timezone.utc)
-    patients_collection.update_one(
+    reset_tokens_collection.replace_one(
         {"email": email},
         {
-            "$set": {
-                "reset_token": reset_token,
-                "reset_token_expires": expires_at,
-                "updated_at": now,
-            }
+            "email": email,
+            "token": reset_token,
+            "expires_at": expires_at,
+            "created_at": now,
         },
+        upsert=True,
     )
@@ -0,0 +1,137 @@
+from pymongo import UpdateOne
+from app.db import db
+
+patient_stats_collection = db["patient_stats"]
+
+# MongoDB Patient Stats Schema: one document per patient, kept up to date with $inc
+# as lab test sets are stored, interpreted and removed
+patient_stats_schema = {
+    "_id": str,  # The patient's FHIR ID
+    "lab_set_count": int,
+    "interpreted_count": int,  # Lab sets with an AI interpretation
+    "abnormal_count": int,  # Abnormal observations across all lab sets
+    "last_test_date": str,  # Test date of the newest lab set
+}
+
+COUNTERS = ["lab_set_count", "interpreted_count", "abnormal_count"]
+
+# Whether a lab test set has an interpretation, in aggregation expressions
+_has_interpretation = {
+    "$not": [{"$in": [{"$ifNull": ["$interpretation", None]}, [None, ""]]}]
+}
+
+
+def lab_set_counters(lab_test_set: dict):
+    """The counters a single lab test set contributes to its patient's stats."""
+    return {
+        "lab_set_count": 1,
+        "interpreted_count": 1 if lab_test_set.get("interpretation") else 0,
+        "abnormal_count": sum(
+            1 for obs in lab_test_set.get("observations", []) if obs.get("abnormal")
+        ),
+    }
+
+
+def _counters_update(counters: dict, sign: int = 1):
+    return {"$inc": {key: sign * counters[key] for key in COUNTERS if counters[key]}}
+
+
+def add_lab_sets_to_stats(lab_test_sets: list):
+    """
+    Adds newly stored lab test sets to their patients' stats: one atomic $inc
+    (and $max of the last test date) per patient, in a single bulk write.
+    """
+    totals = {}
+    for lab_test_set in lab_test_sets:
+        patient_fhir_id = lab_test_set["patient_fhir_id"]
+        counters = lab_set_counters(lab_test_set)
+        total = totals.setdefault(
+            patient_fhir_id, {"counters": dict.fromkeys(COUNTERS, 0), "dates": []}
+        )
+        for key in COUNTERS:
+            total["counters"][key] += counters[key]
+        total["dates"].append(lab_test_set["test_date"])
+
+    if not totals:
+        return
+    patient_stats_collection.bulk_write(
+        [
+            UpdateOne(
+                {"_id": patient_fhir_id},
+                {
+                    **_counters_update(total["counters"]),
+                    "$max": {"last_test_date": max(total["dates"])},
+                },
+                upsert=True,
+            )
+            for patient_fhir_id, total in totals.items()
+        ],
+        ordered=False,
+    )
+
+
+def update_lab_set_in_stats(before: dict, after: dict):
+    """Applies the change of a lab test set (e.g. a new interpretation) to its patient's stats."""
+    old, new = lab_set_counters(before), lab_set_counters(after)
+    delta = {key: new[key] - old[key] for key in COUNTERS}
+    update = _counters_update(delta)
+    if update["$inc"]:
+        patient_stats_collection.update_one({"_id": before["patient_fhir_id"]}, update)
+
+
+def remove_lab_set_from_stats(lab_test_set: dict, last_test_date: str | None):
+    """
+    Removes a deleted lab test set from its patient's stats.
+
+    Args:
+        lab_test_set (dict): The deleted lab test set.
+        last_test_date (str | None): Test date of the patient's newest remaining lab set.
+    """
+    patient_stats_collection.update_one(
+        {"_id": lab_test_set["patient_fhir_id"]},
+        {
+            **_counters_update(lab_set_counters(lab_test_set), sign=-1),
+            "$set": {"last_test_date": last_test_date},
+        },
+    )
+
+
+def remove_patient_stats(patient_fhir_id: str):
+    """Deletes a patient's stats (once all of their lab sets are gone)."""
+    patient_stats_collection.delete_one({"_id": patient_fhir_id})
+
+
+def rebuild_patient_stats():
+    """
+    Recomputes every patient's stats from their lab test sets in one aggregation,
+    replacing the patient_stats collection (counters updated while it runs may be lost).
+
+    Returns:
+        int: The number of patients with stats.
+    """
+    db["lab_test_sets"].aggregate(
+        [
+            {
+                "$group": {
+                    "_id": "$patient_fhir_id",
+                    "lab_set_count": {"$sum": 1},
+                    "interpreted_count": {
+                        "$sum": {"$cond": [_has_interpretation, 1, 0]}
+                    },
+                    "abnormal_count": {
+                        "$sum": {
+                            "$size": {
+                                "$filter": {
+                                    "input": {"$ifNull": ["$observations", []]},
+                                    "cond": {"$eq": ["$$this.abnormal", True]},
+                                }
+                            }
+                        }
+                    },
+                    "last_test_date": {"$max": "$test_date"},
+                }
+            },
+            {"$out": patient_stats_collection.name},
+        ]
+    )
+    return patient_stats_collection.estimated_document_count()
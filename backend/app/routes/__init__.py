@@ -1,9 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from .lab_results import router as lab_results_router
 from .patients import router as patients_router
 from .auth import router as auth_router
-from app.config import MONGO_URI
-from pymongo import MongoClient
+from .jobs import router as jobs_router
+from app.services.fhir import (
+    get_observation_cache_stats,
+    get_fhir_circuit_breaker_stats,
+)
+from app.services.outbox import get_outbox_metrics
+from app.models.outbox import redrive_failed_outbox_entries
+from app.models.job import get_job_stats
+from app.models.interpretation_cache import get_interpretation_cache_stats
+from app.utils.auth import admin_required
+from app.db import client
 
 
 router = APIRouter()
@@ -21,13 +30,37 @@ def health_check():
 @router.get("/test-db", include_in_schema=False)
 def test_db_connection():
     try:
-        client = MongoClient(MONGO_URI)
         db_names = client.list_database_names()
         return {"status": "success", "databases": db_names}
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
 
+@router.get("/metrics", include_in_schema=False)
+def metrics(current_user: dict = Depends(admin_required)):
+    """Runtime counters used to size caches and pools (admin only)."""
+    return {
+        "observation_cache": get_observation_cache_stats(),
+        "fhir_circuit_breaker": get_fhir_circuit_breaker_stats(),
+        "fhir_outbox": get_outbox_metrics(),
+        "jobs": get_job_stats(),
+        "interpretation_cache": get_interpretation_cache_stats(),
+    }
+
+
+@router.post("/fhir_outbox/redrive")
+def redrive_fhir_outbox(
+    patient_fhir_id: str | None = None, current_user: dict = Depends(admin_required)
+):
+    """
+    Puts failed FHIR outbox entries (of one patient, or all) back in the queue once the
+    cause of their failure is fixed (admin only).
+    """
+    query = {"patient_fhir_id": patient_fhir_id} if patient_fhir_id else {}
+    return {"redriven": redrive_failed_outbox_entries(query)}
+
+
 router.include_router(auth_router, prefix="/auth", tags=["Auth"])
 router.include_router(patients_router, tags=["Patients"])
 router.include_router(lab_results_router, tags=["Lab Results"])
+router.include_router(jobs_router, tags=["Jobs"])
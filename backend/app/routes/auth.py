@@ -1,8 +1,10 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from app.models.patient import (
     search_patient_by_email,
+    search_patient_by_email_async,
     assign_admin,
     update_reset_token,
     update_password,
@@ -32,9 +34,12 @@ class LoginInput(BaseModel):
 @router.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # Search for patient by email
-    user = search_patient_by_email(form_data.username)
+    user = await search_patient_by_email_async(form_data.username)
 
-    if not user or not verify_password(form_data.password, user["password"]):
+    # bcrypt is deliberately slow: verify off the event loop
+    if not user or not await run_in_threadpool(
+        verify_password, form_data.password, user["password"]
+    ):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     # ✅ Generate CSRF token securely
@@ -76,14 +81,14 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 @router.get("/check-email")
 async def check_patient_exists(email: str = Query(...)):
     """Check if a patient exists by email."""
-    existing_patient = search_patient_by_email(email)
+    existing_patient = await search_patient_by_email_async(email)
     if existing_patient:
         return {"message": "Patient exists. Please log in.", "exists": True}
     return {"message": "Patient not found. You can register now.", "exists": False}
 
 
 @router.get("/assign-admin")
-async def assign_admin_role(email: str, current_user: dict = Depends(admin_required)):
+def assign_admin_role(email: str, current_user: dict = Depends(admin_required)):
     """Assign admin role to a patient."""
     user = search_patient_by_email(email)
     if not user:
@@ -102,7 +107,7 @@ class ForgotPasswordRequest(BaseModel):
 
 
 @router.post("/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
+def forgot_password(request: ForgotPasswordRequest):
     # Find the patient by email
     patient = search_patient_by_email(request.email)
 
@@ -150,7 +155,7 @@ class ResetPasswordRequest(BaseModel):
 
 
 @router.post("/reset-password")
-async def reset_password(request: ResetPasswordRequest):
+def reset_password(request: ResetPasswordRequest):
     # Find the patient by reset token and check if token is not expired
     patient = check_reset_token_expiration(request.token)
     if not patient:
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, HTTPException, Depends
+from app.models.job import get_job_async
+from app.utils.auth import get_current_user
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Retrieves the status and progress of a background job.
+    Only admins or the user who started the job can see it.
+
+    Args:
+        job_id (str): The job ID returned when the job was started.
+
+    Returns:
+        dict: The job: status, steps, completed_steps, progress, result and error.
+    """
+    job = await get_job_async(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if current_user["role"] != "admin" and job["created_by"] != current_user["email"]:
+        raise HTTPException(status_code=403, detail="Not authorized to view this job")
+
+    return job
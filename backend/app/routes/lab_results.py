@@ -1,23 +1,46 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
+from bson import ObjectId
 from typing import Optional
-from app.utils.auth import self_or_admin_required, get_current_user_with_patient
+import json
+from app.utils.auth import (
+    admin_required,
+    self_or_admin_required,
+    get_current_user_with_patient,
+    get_optional_current_user,
+)
 from app.services.fhir import (
-    send_lab_results_to_fhir,
     remove_all_observations_for_patient,
     remove_fhir_observation,
-    get_fhir_observations,
+    remove_fhir_observations_async,
     get_fhir_observation,
 )
-from app.utils.file_parser import extract_text
-from app.services.openai import extract_lab_results_with_gpt, interpret_full_lab_set
+from app.utils.file_parser import extract_pages
+from app.services.openai import (
+    extract_lab_results_with_gpt_async,
+    interpret_full_lab_set_async,
+    stream_full_lab_set_interpretation,
+)
+from app.services.bulk_import import parse_import_rows, import_lab_results
+from app.services.lab_sets import resolve_lab_set_observations
+from app.services.jobs import submit_job
+from app.services.lab_uploads import (
+    PROCESS_LAB_UPLOAD_JOB,
+    INTERPRET_LAB_TEST_SET_JOB,
+    build_upload_observations,
+)
+from app.models.lab_upload import store_lab_upload
 from app.models.lab_test_set import (
-    get_lab_test_sets_for_patient,
+    get_lab_test_sets_page_async,
+    count_lab_test_sets_for_patient_async,
     remove_lab_test_set,
     store_lab_test_set,
-    get_lab_test_set_by_id,
+    get_lab_test_set_by_id_async,
     update_lab_test_set,
 )
+from app.models.outbox import cancel_outbox_entries
 
 # Constants
 MAX_FILE_SIZE = 1024 * 1024  # 1MB in bytes
@@ -32,8 +55,10 @@ router = APIRouter()
 async def get_all_patient_lab_sets(
     fhir_id: str,
     include_observations: bool = False,
+    refresh: bool = False,
     page: Optional[int] = 1,
     page_size: Optional[int] = 5,
+    cursor: Optional[str] = None,
     auth: tuple[dict, dict | None] = Depends(get_current_user_with_patient),
 ):
     """
@@ -43,9 +68,11 @@ async def get_all_patient_lab_sets(
 
     Args:
         fhir_id (str): The patient's FHIR ID
-        include_observations (bool): If True, fetches full observation details from FHIR
-        page (int): The page number (1-based)
+        include_observations (bool): If True, includes full observation details
+        refresh (bool): If True, re-reads the observations from FHIR instead of the stored snapshots
+        page (int): The page number (1-based), ignored when a cursor is given
         page_size (int): Number of items per page
+        cursor (str): The `next_cursor` of the previous page; deep pages then cost the same as the first
         auth: Tuple of (current_user, patient) from authentication
     """
     if page < 1:
@@ -55,49 +82,67 @@ async def get_all_patient_lab_sets(
     if page_size < 1:
         raise HTTPException(status_code=400, detail="Page size must be greater than 0")
 
-    # Get all lab test sets
-    all_lab_test_sets = get_lab_test_sets_for_patient(fhir_id)
-
-    # Sort lab test sets by test date in descending order (newest first)
-    all_lab_test_sets.sort(key=lambda x: x["test_date"], reverse=True)
+    # Sorting, slicing and counting happen in MongoDB, on the (patient_fhir_id, test_date) index
+    try:
+        current_page_sets, next_cursor = await get_lab_test_sets_page_async(
+            fhir_id, page_size, page=page, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # Calculate pagination
-    total_sets = len(all_lab_test_sets)
+    total_sets = await count_lab_test_sets_for_patient_async(fhir_id)
     total_pages = (total_sets + page_size - 1) // page_size
 
-    # Calculate slice indices
-    start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
-
-    # Get the current page's lab sets
-    current_page_sets = all_lab_test_sets[start_idx:end_idx]
-
     if include_observations:
-        for test_set in current_page_sets:
-            observation_ids = [obs["id"] for obs in test_set["observations"]]
-            full_observations = get_fhir_observations(observation_ids)
-            test_set["full_observations"] = full_observations
+        # Served from the stored snapshots; FHIR is only read on refresh or for older sets
+        full_observations = await run_in_threadpool(
+            resolve_lab_set_observations, current_page_sets, refresh
+        )
+        for test_set, observations in zip(current_page_sets, full_observations):
+            test_set["full_observations"] = observations
 
     return {
         "lab_test_sets": current_page_sets,
         "pagination": {
             "total": total_sets,
-            "page": page,
+            "page": None if cursor else page,
             "page_size": page_size,
             "total_pages": total_pages,
+            "next_cursor": next_cursor,
         },
     }
 
 
+def _job_accepted(message: str, job: dict):
+    """The 202 response of a request handed over to a background job."""
+    return JSONResponse(
+        {
+            "message": message,
+            "job_id": job["id"],
+            "status_url": f"/jobs/{job['id']}",
+        },
+        status_code=202,
+    )
+
+
 @router.post("/lab_set")
 async def upload_patient_lab_test_set(
     patient_fhir_id: str = Form(...),
     test_date: str = Form(...),
     file: UploadFile = File(...),
+    sync: bool = False,
+    current_user: dict | None = Depends(get_optional_current_user),
 ):
     """
     Uploads and processes a lab test set for a patient.
-    Stores both observation IDs and test names in MongoDB.
+    Stores both observation IDs and test names in MongoDB; the Observations are
+    written to FHIR in the background by the FHIR outbox worker.
+
+    The file is stored and 202 is returned at once; OCR, extraction and storage run as
+    a background job (GET /jobs/{job_id}), whose result is the lab test set. With
+    `sync=true`, or without a token (nobody could poll the job), the file is processed
+    before responding and the lab test set returned.
 
     File size limit: 1MB
     Accepted formats: PDF, JPEG, PNG
@@ -120,22 +165,42 @@ async def upload_patient_lab_test_set(
                 detail=f"File size ({file_size / 1024 / 1024:.1f}MB) exceeds maximum allowed size (1MB)",
             )
 
-        # Extract text from the file
-        extracted_text = extract_text(file.filename, contents)
+        if not sync and current_user:
+            upload_id = await run_in_threadpool(
+                store_lab_upload, file.filename, file.content_type, contents
+            )
+            job = await run_in_threadpool(
+                submit_job,
+                PROCESS_LAB_UPLOAD_JOB,
+                {
+                    "patient_fhir_id": patient_fhir_id,
+                    "test_date": test_date,
+                    "upload_id": upload_id,
+                },
+                current_user["email"],
+            )
+            return _job_accepted("Lab results upload accepted", job)
+
+        # Extract the text of each page from the file (OCR), off the event loop
+        extracted_pages = await run_in_threadpool(
+            extract_pages, file.filename, contents
+        )
 
         # Extract lab results using GPT
-        lab_results = extract_lab_results_with_gpt(extracted_text)
+        lab_results = await extract_lab_results_with_gpt_async(extracted_pages)
 
-        # Send results to FHIR and get responses
-        fhir_responses = send_lab_results_to_fhir(
+        # Build the Observations with their FHIR IDs assigned up front
+        observations = build_upload_observations(
             lab_results, patient_fhir_id, test_date
         )
 
-        # Store lab test set in MongoDB with full observation data
-        lab_test_set = store_lab_test_set(
+        # Store lab test set in MongoDB and queue the Observations for FHIR in one write
+        lab_test_set = await run_in_threadpool(
+            store_lab_test_set,
             patient_fhir_id=patient_fhir_id,
             test_date=test_date,
-            observations=fhir_responses,
+            observations=observations,
+            sync_to_fhir=True,
         )
 
         # Convert ObjectId to string for JSON response
@@ -150,6 +215,31 @@ async def upload_patient_lab_test_set(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/lab_set/import")
+async def bulk_import_lab_results(
+    file: UploadFile = File(...),
+    current_user: dict = Depends(admin_required),
+):
+    """
+    Bulk-imports historical lab results from an NDJSON or CSV file (admin only).
+    Rows (patient_fhir_id, test_date, name, value, unit, reference_range) are grouped into
+    lab sets per patient and date; OCR and GPT are skipped entirely.
+
+    Progress is streamed back as NDJSON events, the last one with `"done": true`.
+    """
+    contents = await file.read()
+    try:
+        rows = parse_import_rows(file.filename, contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not rows:
+        raise HTTPException(status_code=400, detail="The file contains no rows.")
+
+    progress_events = (json.dumps(event) + "\n" for event in import_lab_results(rows))
+    return StreamingResponse(progress_events, media_type="application/x-ndjson")
+
+
 @router.delete("/lab_set/{lab_test_set_id}")
 async def delete_lab_test_set(
     lab_test_set_id: str,
@@ -172,7 +262,7 @@ async def delete_lab_test_set(
     current_user, patient = auth
 
     # Retrieve lab test set details to get the observation IDs
-    lab_test_set = get_lab_test_set_by_id(lab_test_set_id)
+    lab_test_set = await get_lab_test_set_by_id_async(lab_test_set_id)
 
     if not lab_test_set:
         raise HTTPException(status_code=404, detail="Lab test set not found.")
@@ -184,22 +274,30 @@ async def delete_lab_test_set(
                 status_code=403, detail="Not authorized to delete this lab test set"
             )
 
+    # Drop the Observations still waiting to be written to FHIR
+    never_sent = await run_in_threadpool(
+        cancel_outbox_entries, {"source.id": ObjectId(lab_test_set_id)}
+    )
+
     # Extract FHIR observation IDs from the lab test set
     observation_ids = [obs["id"] for obs in lab_test_set.get("observations", [])]
+    deleted_observations = [
+        obs_id for obs_id in observation_ids if obs_id in never_sent
+    ]
+    observation_ids = [obs_id for obs_id in observation_ids if obs_id not in never_sent]
 
-    # Delete observations from FHIR server
-    deleted_observations = []
+    # Delete observations from FHIR server, concurrently
     failed_observations = []
 
-    for obs_id in observation_ids:
-        delete_result = remove_fhir_observation(obs_id)
+    delete_results = await remove_fhir_observations_async(observation_ids)
+    for obs_id, delete_result in zip(observation_ids, delete_results):
         if "message" in delete_result:
             deleted_observations.append(obs_id)
         else:
             failed_observations.append(delete_result)
 
     # Now delete the lab test set from MongoDB
-    result = remove_lab_test_set(lab_test_set_id)
+    result = await run_in_threadpool(remove_lab_test_set, lab_test_set_id)
 
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
@@ -234,7 +332,7 @@ async def delete_observation(
 
     try:
         # First get the observation to check ownership
-        observation = get_fhir_observation(observation_id)
+        observation = await run_in_threadpool(get_fhir_observation, observation_id)
         if not observation:
             raise HTTPException(status_code=404, detail="Observation not found")
 
@@ -252,7 +350,7 @@ async def delete_observation(
 
         # For admins, allow deletion of any observation
         if current_user["role"] == "admin":
-            result = remove_fhir_observation(observation_id)
+            result = await run_in_threadpool(remove_fhir_observation, observation_id)
             return result
 
         # For patients, check if the observation belongs to them
@@ -262,7 +360,7 @@ async def delete_observation(
             )
 
         # If authorized, proceed with deletion
-        result = remove_fhir_observation(observation_id)
+        result = await run_in_threadpool(remove_fhir_observation, observation_id)
         return result
 
     except HTTPException as he:
@@ -276,21 +374,27 @@ async def delete_all_observations_for_patient(
     fhir_id: str, current_user: dict = Depends(self_or_admin_required)
 ):
     """Deletes all Observations linked to a specific patient."""
-    result = remove_all_observations_for_patient(fhir_id)
+    result = await run_in_threadpool(remove_all_observations_for_patient, fhir_id)
     return result
 
 
 @router.post("/lab_set/{lab_test_set_id}/interpret")
-def interpret_lab_test_set(
+async def interpret_lab_test_set(
     lab_test_set_id: str,
+    refresh: bool = False,
+    sync: bool = False,
     auth: tuple[dict, dict | None] = Depends(get_current_user_with_patient),
 ):
     """
     Generates an AI-based interpretation for the entire lab test set.
     Only admins or the patient who owns the lab set can interpret it.
+    Returns 202 at once and interprets in a background job (GET /jobs/{job_id}),
+    or interprets before responding with `sync=true`.
 
     Args:
         lab_test_set_id (str): The MongoDB ID of the lab test set.
+        refresh (bool): If True, re-reads the observations from FHIR instead of the stored snapshots
+        sync (bool): If True, interprets before responding instead of in a background job
         auth: Tuple of (current_user, patient) from authentication
 
 
@@ -300,7 +404,7 @@ def interpret_lab_test_set(
     current_user, patient = auth
 
     # Retrieve the lab test set
-    lab_test_set = get_lab_test_set_by_id(lab_test_set_id)
+    lab_test_set = await get_lab_test_set_by_id_async(lab_test_set_id)
 
     if not lab_test_set:
         raise HTTPException(status_code=404, detail="Lab test set not found.")
@@ -313,16 +417,23 @@ def interpret_lab_test_set(
             )
 
     # If authorized, proceed with interpretation
+    if not sync:
+        job = await run_in_threadpool(
+            submit_job,
+            INTERPRET_LAB_TEST_SET_JOB,
+            {"lab_test_set_id": lab_test_set_id, "refresh": refresh},
+            current_user["email"],
+        )
+        return _job_accepted("Interpretation started", job)
 
     # Retrieve birth date & gender from lab test set
     birth_date = lab_test_set.get("birth_date", "Unknown")
     gender = lab_test_set.get("gender", "Unknown")
 
-    # Get observation IDs from the observations array
-    observation_ids = [obs["id"] for obs in lab_test_set.get("observations", [])]
-
-    # Fetch full lab set results from FHIR using the stored observation IDs
-    full_lab_tests = get_fhir_observations(observation_ids)
+    # Full lab set results, from the stored snapshots (or FHIR on refresh)
+    full_lab_tests = (
+        await run_in_threadpool(resolve_lab_set_observations, [lab_test_set], refresh)
+    )[0]
 
     if not full_lab_tests:
         raise HTTPException(
@@ -330,11 +441,13 @@ def interpret_lab_test_set(
         )
 
     # Generate AI-based summary using OpenAI
-    interpretation = interpret_full_lab_set(full_lab_tests, birth_date, gender)
+    interpretation = await interpret_full_lab_set_async(
+        full_lab_tests, birth_date, gender
+    )
 
     # Store the interpretation in MongoDB
-    update_result = update_lab_test_set(
-        lab_test_set_id, {"interpretation": interpretation}
+    update_result = await run_in_threadpool(
+        update_lab_test_set, lab_test_set_id, {"interpretation": interpretation}
     )
 
     if "error" in update_result:
@@ -346,6 +459,82 @@ def interpret_lab_test_set(
     }
 
 
+def _sse(event: str, data: dict):
+    """Formats a Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/lab_set/{lab_test_set_id}/interpret/stream")
+async def stream_lab_test_set_interpretation(
+    lab_test_set_id: str,
+    refresh: bool = False,
+    auth: tuple[dict, dict | None] = Depends(get_current_user_with_patient),
+):
+    """
+    Streams the AI interpretation of a lab test set as Server-Sent Events while it is
+    generated: `token` events carry `{"text"}` fragments, then a `done` event carries
+    the full `{"interpretation"}` once it is stored, or an `error` event `{"detail"}`.
+    Only admins or the patient who owns the lab set can interpret it.
+
+    Args:
+        lab_test_set_id (str): The MongoDB ID of the lab test set.
+        refresh (bool): If True, re-reads the observations from FHIR instead of the stored snapshots
+        auth: Tuple of (current_user, patient) from authentication
+    """
+    current_user, patient = auth
+
+    lab_test_set = await get_lab_test_set_by_id_async(lab_test_set_id)
+    if not lab_test_set:
+        raise HTTPException(status_code=404, detail="Lab test set not found.")
+
+    if current_user["role"] != "admin":
+        if not patient or patient["fhir_id"] != lab_test_set["patient_fhir_id"]:
+            raise HTTPException(
+                status_code=403, detail="Not authorized to interpret this lab test set"
+            )
+
+    full_lab_tests = (
+        await run_in_threadpool(resolve_lab_set_observations, [lab_test_set], refresh)
+    )[0]
+    if not full_lab_tests:
+        raise HTTPException(
+            status_code=400, detail="No lab test results found in FHIR."
+        )
+
+    chunks = stream_full_lab_set_interpretation(
+        full_lab_tests,
+        lab_test_set.get("birth_date", "Unknown"),
+        lab_test_set.get("gender", "Unknown"),
+    )
+
+    async def events():
+        parts = []
+        try:
+            async for text in chunks:
+                parts.append(text)
+                yield _sse("token", {"text": text})
+        except Exception as e:
+            yield _sse("error", {"detail": f"Error generating interpretation: {e}"})
+            return
+
+        # Store the interpretation in MongoDB once the stream completes
+        interpretation = "".join(parts).strip()
+        update_result = await run_in_threadpool(
+            update_lab_test_set, lab_test_set_id, {"interpretation": interpretation}
+        )
+        if "error" in update_result:
+            yield _sse("error", {"detail": update_result["error"]})
+        else:
+            yield _sse("done", {"interpretation": interpretation})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Don't let proxies buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/observations/{observation_id}")
 async def get_observation(
     observation_id: str,
@@ -369,7 +558,7 @@ async def get_observation(
 
     try:
         # Get the observation to check ownership
-        observation = get_fhir_observation(observation_id)
+        observation = await run_in_threadpool(get_fhir_observation, observation_id)
         if not observation:
             raise HTTPException(status_code=404, detail="Observation not found")
 
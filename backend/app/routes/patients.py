@@ -1,28 +1,37 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Literal, Optional
 from datetime import timedelta
 from app.services.fhir import (
-    create_fhir_patient,
-    delete_fhir_patient,
-    remove_all_observations_for_patient,
-    get_fhir_observations,
+    new_fhir_id,
+    build_fhir_patient,
+    get_fhir_patient,
     update_fhir_patient,
 )
+from app.services.export import start_patient_record, iter_ndjson, iter_bundle_json
+from app.services.lab_sets import resolve_lab_set_observations
 from app.models.patient import (
     store_patient,
     Patient,
     Gender,
-    get_patients as get_patients_from_db,
+    get_patients_page_async,
     get_patient as get_patient_from_db,
-    delete_patient as delete_patient_from_db,
+    get_patient_async,
+    mark_patient_deleting,
     search_patient_by_email,
     update_patient as update_patient_in_db,
 )
-from app.models.lab_test_set import (
-    get_lab_test_sets_for_patient,
-    remove_lab_test_set,
+from app.models.lab_test_set import get_lab_test_sets_for_patient_async
+from app.models.analyte_series import (
+    get_patient_analytes_async,
+    get_analyte_trend_async,
 )
+from app.models.outbox import enqueue_outbox_entry, has_pending_outbox_entries
+from app.models.job import FAILED, find_unfinished_job, requeue_job
+from app.services.jobs import submit_job
+from app.services.patient_deletion import DELETE_PATIENT_JOB
 from app.utils.auth import admin_required, set_password, self_or_admin_required
 
 router = APIRouter()
@@ -36,21 +45,18 @@ class PatientRegister(BaseModel):
 
 
 @router.post("/patients")
-async def register_patient(patient: PatientRegister):
-    """Registers a new patient in the FHIR system and stores their FHIR ID in MongoDB or errors if patient already existing"""
+def register_patient(patient: PatientRegister):
+    """
+    Registers a new patient and stores them in MongoDB, or errors if the patient already exists.
+    The FHIR Patient gets its ID up front and is created by the FHIR outbox worker.
+    """
     # First, check if the patient exists by email
     existing_patient = search_patient_by_email(patient.email)
     if existing_patient:
         raise HTTPException(status_code=400, detail="Patient already exists.")
 
-    # Call the external FHIR service to create the patient and retrieve their FHIR ID
-    try:
-        fhir_created_id = create_fhir_patient(patient.email)
-    except HTTPException as e:
-        raise HTTPException(
-            status_code=e.status_code,
-            detail=f"Failed to register patient with FHIR server. ({e.status_code}): {e.detail}",
-        )
+    # Assign the FHIR ID now; the Patient resource is written to FHIR in the background
+    fhir_created_id = new_fhir_id()
 
     # Hash the patient's password before saving
     hashed_password = set_password(patient.password)
@@ -61,9 +67,11 @@ async def register_patient(patient: PatientRegister):
         password=hashed_password,
         is_admin=patient.is_admin,
     )
-    # Store the patient in MongoDB, now with a FHIR ID and check the insertion
+    # Store the patient in MongoDB with the queued FHIR write and check the insertion
     try:
-        store_patient(new_patient_data)
+        store_patient(
+            new_patient_data, build_fhir_patient(patient.email, fhir_created_id)
+        )
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=e.detail)
 
@@ -91,8 +99,9 @@ async def get_patients(
     if page_size < 1:
         raise HTTPException(status_code=400, detail="Page size must be greater than 0")
 
-    patients = get_patients_from_db()
-    if not patients:
+    # One aggregation: page, total and lab set stats, without passwords
+    formatted_patients, total_patients = await get_patients_page_async(page, page_size)
+    if not total_patients:
         return {
             "message": "No patients found",
             "patients": [],
@@ -104,40 +113,8 @@ async def get_patients(
             },
         }
 
-    # Convert patients to list if it's a cursor
-    patients_list = list(patients)
-    total_patients = len(patients_list)
     total_pages = (total_patients + page_size - 1) // page_size
 
-    # Calculate slice indices
-    start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
-
-    # Slice the patients list for the current page
-    current_page_patients = patients_list[start_idx:end_idx]
-
-    # Format patients for the current page
-    formatted_patients = []
-
-    for patient in current_page_patients:
-        patient_dict = dict(patient)
-        patient_dict.pop("_id", None)
-        patient_dict.pop("password", None)  # ✅ safely removes if it exists
-
-        # Get lab test sets for this patient
-        lab_test_sets = get_lab_test_sets_for_patient(patient_dict["fhir_id"])
-
-        # Count total lab sets and interpreted sets
-        total_lab_sets = len(lab_test_sets)
-        interpreted_sets = sum(
-            1 for test_set in lab_test_sets if test_set.get("interpretation")
-        )
-
-        patient_dict["lab_set_count"] = total_lab_sets
-        patient_dict["interpreted_count"] = interpreted_sets
-
-        formatted_patients.append(patient_dict)
-
     return {
         "message": "Patients retrieved",
         "patients": formatted_patients,
@@ -154,13 +131,15 @@ async def get_patients(
 async def get_patient(
     fhir_id: str,
     include_observations: bool = False,
+    refresh: bool = False,
     patient: dict = Depends(self_or_admin_required),
 ):
     """
     Retrieves the patient from MongoDB using the FHIR ID.
-    If include_observations=True, includes all lab test sets with their FHIR observations.
+    If include_observations=True, includes all lab test sets with their observations,
+    served from the stored snapshots unless refresh=True.
     """
-    patient = get_patient_from_db(fhir_id)
+    patient = await get_patient_async(fhir_id)
     if patient:
         patient_dict = dict(patient)
         patient_dict.pop("_id", None)
@@ -169,11 +148,14 @@ async def get_patient(
         if include_observations:
             # Get all lab test sets for the patient
 
-            lab_test_sets = get_lab_test_sets_for_patient(fhir_id)
+            lab_test_sets = await get_lab_test_sets_for_patient_async(fhir_id)
 
             # Include full observation details for each lab test set
-            for test_set in lab_test_sets:
-                observations = get_fhir_observations(test_set["observation_ids"])
+            # FHIR reads (for refresh or older sets) use the blocking client: off the event loop
+            full_observations = await run_in_threadpool(
+                resolve_lab_set_observations, lab_test_sets, refresh
+            )
+            for test_set, observations in zip(lab_test_sets, full_observations):
                 test_set["observations"] = observations
 
             patient_dict["lab_test_sets"] = lab_test_sets
@@ -183,9 +165,97 @@ async def get_patient(
     raise HTTPException(status_code=404, detail="Patient not found")
 
 
-@router.delete("/patients/{fhir_id}")
-async def delete_patient(fhir_id: str, current_user: dict = Depends(admin_required)):
-    """Deletes a patient from both MongoDB and the FHIR server"""
+@router.get("/patients/{fhir_id}/export")
+def export_patient_record(
+    fhir_id: str,
+    format: Literal["ndjson", "bundle"] = "ndjson",
+    current_user: dict = Depends(self_or_admin_required),
+):
+    """
+    Streams the patient's complete record: the Patient, every Observation and every
+    stored lab test set interpretation (as DiagnosticReports).
+
+    Args:
+        fhir_id (str): The patient's FHIR ID
+        format (str): "ndjson" (one resource per line) or "bundle" (a FHIR collection Bundle)
+    """
+    # Writes still queued in the outbox are not in FHIR yet, so the export would miss them
+    if has_pending_outbox_entries(fhir_id):
+        raise HTTPException(
+            status_code=409,
+            detail="The patient's record is still being synced to FHIR, retry shortly",
+            headers={"Retry-After": "5"},
+        )
+
+    # Resolve the patient and the first page before streaming, so errors still get
+    # a proper status code; later failures end the body with an OperationOutcome
+    patient_resource = get_fhir_patient(fhir_id)
+    if not patient_resource:
+        raise HTTPException(status_code=404, detail="Patient not found in FHIR")
+
+    resources = start_patient_record(patient_resource)
+    if format == "bundle":
+        content, media_type, extension = (
+            iter_bundle_json(resources),
+            "application/fhir+json",
+            "json",
+        )
+    else:
+        content, media_type, extension = (
+            iter_ndjson(resources),
+            "application/fhir+ndjson",
+            "ndjson",
+        )
+
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="patient-{fhir_id}.{extension}"'
+        },
+    )
+
+
+@router.get("/patients/{fhir_id}/trends")
+async def get_patient_trends(
+    fhir_id: str,
+    analyte: Optional[str] = None,
+    unit: Optional[str] = None,
+    max_points: Optional[int] = 100,
+    patient: dict = Depends(self_or_admin_required),
+):
+    """
+    Retrieves how one of the patient's lab values changed over time, from the analyte
+    series store (no FHIR reads). Without `analyte`, lists the analytes available.
+
+    Args:
+        fhir_id (str): The patient's FHIR ID
+        analyte (str): The test name, e.g. "Glucose" (case-insensitive)
+        unit (str): The unit of the series; defaults to the unit of the latest result
+        max_points (int): Longer series are down-sampled to this many date buckets
+    """
+    if max_points < 1:
+        raise HTTPException(status_code=400, detail="max_points must be greater than 0")
+
+    if not analyte:
+        return {"analytes": await get_patient_analytes_async(fhir_id)}
+
+    trend = await get_analyte_trend_async(fhir_id, analyte, max_points, unit)
+    if not trend["total_points"]:
+        detail = f"No results found for analyte '{analyte}'"
+        if unit:
+            detail += f" in unit '{unit}'"
+        raise HTTPException(status_code=404, detail=detail)
+    return trend
+
+
+@router.delete("/patients/{fhir_id}", status_code=202)
+def delete_patient(fhir_id: str, current_user: dict = Depends(admin_required)):
+    """
+    Starts deleting a patient from both MongoDB and the FHIR server, as a background job.
+    Returns 202 with the job ID; progress can be polled at GET /jobs/{job_id}.
+    Deleting a patient whose previous deletion failed resumes that job.
+    """
     patient = get_patient_from_db(fhir_id)
 
     if not patient:
@@ -197,32 +267,22 @@ async def delete_patient(fhir_id: str, current_user: dict = Depends(admin_requir
             status_code=403, detail="You cannot delete your own account"
         )
 
-    # First delete all observations for this patient
-    obs_result = remove_all_observations_for_patient(fhir_id)
-    if "error" in obs_result:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to delete patient's observations: {obs_result['error']}",
-        )
+    # Hide the patient from the patient list right away
+    mark_patient_deleting(fhir_id)
 
-    # Now delete patient from FHIR
-    fhir_response = delete_fhir_patient(fhir_id)
-    if fhir_response is False:
-        raise HTTPException(
-            status_code=500, detail="Failed to delete patient from FHIR"
+    job = find_unfinished_job(DELETE_PATIENT_JOB, {"fhir_id": fhir_id})
+    if job and job["status"] == FAILED:
+        requeue_job(job["id"])
+    elif not job:
+        job = submit_job(
+            DELETE_PATIENT_JOB, {"fhir_id": fhir_id}, current_user["email"]
         )
 
-    # Delete all lab test sets for this patient
-    lab_test_sets = get_lab_test_sets_for_patient(fhir_id)
-    for lab_test_set in lab_test_sets:
-        remove_lab_test_set(lab_test_set["id"])
-
-    # Finally delete patient from MongoDB
-    delete_patient_from_db(fhir_id)
-
     return {
-        "message": "Patient and all associated data deleted successfully",
+        "message": "Patient deletion started",
         "fhir_id": fhir_id,
+        "job_id": job["id"],
+        "status_url": f"/jobs/{job['id']}",
     }
 
 
@@ -235,7 +295,7 @@ class PatientUpdate(BaseModel):
 
 
 @router.put("/patients/{fhir_id}")
-async def update_patient(
+def update_patient(
     fhir_id: str,
     patient_update: PatientUpdate,
     current_user: dict = Depends(self_or_admin_required),
@@ -254,14 +314,35 @@ async def update_patient(
             f"Attempting to update FHIR patient {fhir_id} with data: {update_data}"
         )  # Debug log
 
-        try:
-            # First update FHIR
-            fhir_updated = update_fhir_patient(fhir_id=fhir_id, **update_data)
-        except Exception as e:
-            print(f"FHIR update failed: {str(e)}")  # Debug log
-            raise HTTPException(
-                status_code=500, detail=f"Failed to update patient in FHIR: {str(e)}"
+        if has_pending_outbox_entries(fhir_id):
+            # Not synced to FHIR yet: queue the full resource behind the pending writes
+            stored_patient = get_patient_from_db(fhir_id)
+            if not stored_patient:
+                raise HTTPException(status_code=404, detail="Patient not found")
+            details = {
+                field: stored_patient[field]
+                for field in ["first_name", "last_name", "birth_date", "gender"]
+                if stored_patient.get(field)
+            }
+            enqueue_outbox_entry(
+                fhir_id,
+                [
+                    build_fhir_patient(
+                        stored_patient["email"], fhir_id, **{**details, **update_data}
+                    )
+                ],
             )
+            fhir_updated = True
+        else:
+            try:
+                # First update FHIR
+                fhir_updated = update_fhir_patient(fhir_id=fhir_id, **update_data)
+            except Exception as e:
+                print(f"FHIR update failed: {str(e)}")  # Debug log
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to update patient in FHIR: {str(e)}",
+                )
 
         if fhir_updated:
             try:
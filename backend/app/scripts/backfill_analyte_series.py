@@ -0,0 +1,18 @@
+"""
+Fills the analyte series store (used by GET /patients/{fhir_id}/trends) from the lab
+test sets stored before it existed. Run backfill_observation_snapshots first so older
+lab sets have values.
+
+Usage:
+    python -m app.scripts.backfill_analyte_series
+"""
+
+from app.models.analyte_series import backfill_analyte_series
+
+
+def main():
+    print(f"✅ Analyte series store holds {backfill_analyte_series()} points")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Adds observation value snapshots to lab test sets stored before snapshots existed.
+
+Usage:
+    python -m app.scripts.backfill_observation_snapshots [batch_size]
+"""
+
+import sys
+from app.services.lab_sets import backfill_observation_snapshots
+
+
+def main(batch_size: int = 50):
+    progress = {"processed": 0, "incomplete": 0}
+    for progress in backfill_observation_snapshots(batch_size):
+        print(f"{progress['processed']} lab sets processed")
+
+    print(f"✅ Backfilled {progress['processed'] - progress['incomplete']} lab sets")
+    if progress["incomplete"]:
+        print(
+            f"⚠️ {progress['incomplete']} lab sets have observations missing from FHIR"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        sys.exit(__doc__)
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,27 @@
+"""
+Creates the MongoDB indexes and fails if a hot query still scans a whole collection.
+
+Usage:
+    python -m app.scripts.check_indexes
+"""
+
+import sys
+from app.models.indexes import ensure_indexes, find_collection_scans
+
+
+def main():
+    errors = ensure_indexes()
+    for error in errors:
+        print(f"❌ Index not created: {error}")
+
+    collection_scans = find_collection_scans()
+    for name in collection_scans:
+        print(f"❌ {name} does a COLLSCAN")
+
+    if errors or collection_scans:
+        sys.exit(1)
+    print("✅ All indexes in place, no hot query scans a collection.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Bulk-imports historical lab results from an NDJSON or CSV file.
+
+Usage:
+    python -m app.scripts.import_lab_results results.csv
+"""
+
+import sys
+from app.services.bulk_import import parse_import_rows, import_lab_results
+
+
+def main(path: str):
+    with open(path, "rb") as f:
+        rows = parse_import_rows(path, f.read())
+
+    for progress in import_lab_results(rows):
+        print(
+            f"{progress['processed_rows']}/{progress['total_rows']} rows, "
+            f"{progress['lab_sets_created']} lab sets, "
+            f"{progress['observations_created']} observations created, "
+            f"{progress['failed_observations']} failed"
+        )
+
+    for error in progress["errors"]:
+        print(f"⚠️ {error}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
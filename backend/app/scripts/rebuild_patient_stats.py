@@ -0,0 +1,17 @@
+"""
+Rebuilds the per-patient stats (lab set, interpreted and abnormal counts, last test
+date) from the lab test sets. Run it once after upgrading, or whenever they drift.
+
+Usage:
+    python -m app.scripts.rebuild_patient_stats
+"""
+
+from app.models.patient_stats import rebuild_patient_stats
+
+
+def main():
+    print(f"✅ Rebuilt stats for {rebuild_patient_stats()} patients")
+
+
+if __name__ == "__main__":
+    main()
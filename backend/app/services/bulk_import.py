@@ -0,0 +1,284 @@
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from uuid import NAMESPACE_URL, uuid5
+from fastapi import HTTPException
+from app.config import FHIR_IMPORT_BUNDLE_SIZE, FHIR_IMPORT_CONCURRENCY
+from app.services.fhir import build_lab_observation, post_fhir_bundle
+from app.models.patient import get_patients_by_fhir_ids
+from app.models.lab_test_set import (
+    build_lab_test_set,
+    store_lab_test_sets,
+    update_lab_test_set,
+    find_lab_sets_by_observation_ids,
+)
+from app.utils.file_parser import clean_reference_range
+
+
+def parse_import_rows(filename: str, contents: bytes):
+    """
+    Parses structured lab results from an NDJSON or CSV file.
+
+    Each row holds one result: patient_fhir_id, test_date, name, value, unit and
+    an optional reference_range ("low - high", ">X" or "<X"). `analyte` is accepted
+    as an alias of `name`.
+
+    Args:
+        filename (str): The file name, used to tell NDJSON (.ndjson/.jsonl) from CSV.
+        contents (bytes): The file contents.
+
+    Returns:
+        list: The rows as dicts, in file order.
+    """
+    text = contents.decode("utf-8-sig")
+
+    if filename.endswith((".ndjson", ".jsonl")):
+        rows = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise ValueError(f"Line {line_number} is not valid JSON.")
+        return rows
+
+    if filename.endswith(".csv"):
+        return list(csv.DictReader(io.StringIO(text)))
+
+    raise ValueError("Unsupported file type. Use .ndjson, .jsonl or .csv")
+
+
+def _normalize_row(row: dict):
+    """Validates one import row and converts it to a lab test dict."""
+    name = row.get("name") or row.get("analyte")
+    missing = [
+        field
+        for field, value in [
+            ("patient_fhir_id", row.get("patient_fhir_id")),
+            ("test_date", row.get("test_date")),
+            ("name", name),
+            ("value", row.get("value")),
+        ]
+        if value in [None, ""]
+    ]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    try:
+        value = float(row["value"])
+    except (TypeError, ValueError):
+        raise ValueError(f"value {row['value']!r} is not a number")
+
+    return {
+        "patient_fhir_id": str(row["patient_fhir_id"]).strip(),
+        "test_date": str(row["test_date"]).strip(),
+        "name": str(name).strip(),
+        "value": value,
+        "unit": (row.get("unit") or "").strip(),
+        "reference_range": clean_reference_range(row.get("reference_range")),
+    }
+
+
+def _group_rows(rows: list):
+    """
+    Groups rows into lab sets, one per (patient, test date).
+
+    Returns:
+        tuple: (lab sets as a dict keyed by (patient_fhir_id, test_date), row errors)
+    """
+    lab_sets = {}
+    errors = []
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            test = _normalize_row(row)
+        except ValueError as e:
+            errors.append({"row": row_number, "error": str(e)})
+            continue
+        key = (test["patient_fhir_id"], test["test_date"])
+        lab_sets.setdefault(key, []).append(test)
+    return lab_sets, errors
+
+
+def _batches(lab_sets: list, bundle_size: int):
+    """Packs whole lab sets into batches of about `bundle_size` observations."""
+    batch, size = [], 0
+    for lab_set in lab_sets:
+        if batch and size + len(lab_set[1]) > bundle_size:
+            yield batch
+            batch, size = [], 0
+        batch.append(lab_set)
+        size += len(lab_set[1])
+    if batch:
+        yield batch
+
+
+def import_observation_id(patient_fhir_id: str, test_date: str, position: int, name: str):
+    """
+    The FHIR ID of an imported Observation, derived from the lab set and the test's
+    position in it, so that importing the same file again rewrites the same resources.
+    """
+    return str(
+        uuid5(NAMESPACE_URL, f"lab-import:{patient_fhir_id}:{test_date}:{position}:{name}")
+    )
+
+
+def _create_batch_observations(batch: list):
+    """
+    Writes the Observations of several lab sets with one batch Bundle of PUTs. Their IDs
+    are assigned here, so a Bundle that timed out can be sent again without duplicates.
+
+    Returns:
+        list: For each lab set of the batch, the created Observations (failed entries omitted),
+            or an error message if the whole Bundle failed.
+    """
+    observations = [
+        [
+            {
+                **build_lab_observation(test, patient_fhir_id, test_date),
+                "id": import_observation_id(
+                    patient_fhir_id, test_date, position, test["name"]
+                ),
+            }
+            for position, test in enumerate(tests)
+        ]
+        for (patient_fhir_id, test_date), tests in batch
+    ]
+    entries = [
+        {
+            "fullUrl": f"Observation/{obs['id']}",
+            "resource": obs,
+            "request": {"method": "PUT", "url": f"Observation/{obs['id']}"},
+        }
+        for lab_set_observations in observations
+        for obs in lab_set_observations
+    ]
+
+    try:
+        response_entries = iter(post_fhir_bundle(entries, "batch"))
+    except HTTPException as e:
+        return [str(e.detail)] * len(batch)
+
+    created = []
+    for lab_set_observations in observations:
+        lab_set_created = []
+        for obs in lab_set_observations:
+            entry_response = next(response_entries, {}).get("response", {})
+            if entry_response.get("status", "").startswith("2"):
+                lab_set_created.append(obs)
+        created.append(lab_set_created)
+    return created
+
+
+def import_lab_results(
+    rows: list,
+    bundle_size: int = FHIR_IMPORT_BUNDLE_SIZE,
+    concurrency: int = FHIR_IMPORT_CONCURRENCY,
+):
+    """
+    Imports structured historical lab results, skipping OCR and GPT entirely.
+
+    Rows are grouped into lab sets per patient and test date. Observations are written to
+    FHIR with batch Bundles of PUTs (several running concurrently) and the lab sets are written
+    to MongoDB with one insert_many per Bundle. Observation IDs are derived from the rows, so
+    importing a file again rewrites the same Observations and skips lab sets already stored;
+    a stored lab set missing some of its Observations (an earlier run failed part-way) gets
+    them attached instead.
+
+    Args:
+        rows (list): Rows from `parse_import_rows`.
+        bundle_size (int): Target number of Observations per Bundle.
+        concurrency (int): Number of Bundles in flight at once.
+
+    Yields:
+        dict: Progress events; the last one has `"done": True` and the final totals.
+    """
+    lab_sets, errors = _group_rows(rows)
+
+    # Look up all patients at once for their birth date and gender
+    patients = get_patients_by_fhir_ids({key[0] for key in lab_sets})
+    for patient_fhir_id, test_date in list(lab_sets):
+        if patient_fhir_id not in patients:
+            errors.append(
+                {
+                    "lab_set": f"{patient_fhir_id} {test_date}",
+                    "error": "Patient not found in MongoDB.",
+                }
+            )
+            del lab_sets[(patient_fhir_id, test_date)]
+
+    progress = {
+        "total_rows": len(rows),
+        "processed_rows": len(rows) - sum(len(tests) for tests in lab_sets.values()),
+        "lab_sets_created": 0,
+        "observations_created": 0,
+        "failed_observations": 0,
+        "errors": errors,
+        "done": False,
+    }
+    yield {**progress, "errors": len(errors)}
+
+    batches = list(_batches(list(lab_sets.items()), bundle_size))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch, created in zip(
+            batches, executor.map(_create_batch_observations, batches)
+        ):
+            # Lab sets of an earlier import of the same rows are already stored
+            stored_lab_sets = find_lab_sets_by_observation_ids(
+                [
+                    obs["id"]
+                    for observations in created
+                    if not isinstance(observations, str)
+                    for obs in observations
+                ]
+            )
+            documents = []
+            for ((patient_fhir_id, test_date), tests), observations in zip(
+                batch, created
+            ):
+                progress["processed_rows"] += len(tests)
+                if isinstance(observations, str):
+                    progress["failed_observations"] += len(tests)
+                    errors.append(
+                        {
+                            "lab_set": f"{patient_fhir_id} {test_date}",
+                            "error": observations,
+                        }
+                    )
+                    continue
+
+                progress["observations_created"] += len(observations)
+                progress["failed_observations"] += len(tests) - len(observations)
+                stored = next(
+                    (
+                        stored_lab_sets[obs["id"]]
+                        for obs in observations
+                        if obs["id"] in stored_lab_sets
+                    ),
+                    None,
+                )
+                if stored is None:
+                    if observations:
+                        documents.append(
+                            build_lab_test_set(
+                                patients[patient_fhir_id], test_date, observations
+                            )
+                        )
+                    continue
+
+                # An earlier run may have stored the set before all of its
+                # Observations were written; attach the ones it is missing
+                stored_ids = {obs.get("id") for obs in stored["observations"]}
+                missing = [obs for obs in observations if obs["id"] not in stored_ids]
+                if missing:
+                    update_lab_test_set(
+                        stored["id"],
+                        {"observations": stored["observations"] + missing},
+                    )
+                    stored["observations"] = stored["observations"] + missing
+
+            progress["lab_sets_created"] += len(store_lab_test_sets(documents))
+            yield {**progress, "errors": len(errors)}
+
+    yield {**progress, "done": True}
@@ -0,0 +1,126 @@
+import json
+from itertools import chain, islice
+from app.config import FHIR_SEARCH_PAGE_SIZE
+from app.services.fhir import iter_fhir_search
+from app.models.lab_test_set import iter_lab_test_sets_for_patient
+
+
+def lab_test_set_to_diagnostic_report(lab_test_set: dict):
+    """
+    Represents a stored lab test set (and its AI interpretation) as a FHIR DiagnosticReport.
+
+    Args:
+        lab_test_set (dict): The lab test set from MongoDB.
+
+    Returns:
+        dict: A DiagnosticReport referencing the set's Observations.
+    """
+    report = {
+        "resourceType": "DiagnosticReport",
+        "id": lab_test_set["id"],
+        "status": "final",
+        "category": [
+            {
+                "coding": [
+                    {
+                        "system": "http://terminology.hl7.org/CodeSystem/v2-0074",
+                        "code": "LAB",
+                    }
+                ]
+            }
+        ],
+        "code": {"text": "Lab test set"},
+        "subject": {"reference": f"Patient/{lab_test_set['patient_fhir_id']}"},
+        "effectiveDateTime": lab_test_set.get("test_date"),
+        "result": [
+            {"reference": f"Observation/{obs['id']}", "display": obs.get("name")}
+            for obs in lab_test_set.get("observations", [])
+            if obs.get("id")
+        ],
+    }
+
+    if lab_test_set.get("interpretation"):
+        report["conclusion"] = lab_test_set["interpretation"]
+
+    return report
+
+
+def iter_patient_record(patient_resource: dict):
+    """
+    Yields every resource of a patient's record: the Patient, all of their Observations
+    (paged FHIR search) and one DiagnosticReport per stored lab test set (MongoDB cursor).
+    Only one page / batch is held in memory at a time.
+
+    Args:
+        patient_resource (dict): The patient's FHIR Patient resource.
+
+    Yields:
+        dict: FHIR resources.
+    """
+    fhir_id = patient_resource["id"]
+    yield patient_resource
+
+    yield from iter_fhir_search(
+        "Observation",
+        {"subject": f"Patient/{fhir_id}", "_count": FHIR_SEARCH_PAGE_SIZE},
+    )
+
+    for lab_test_set in iter_lab_test_sets_for_patient(fhir_id):
+        yield lab_test_set_to_diagnostic_report(lab_test_set)
+
+
+def start_patient_record(patient_resource: dict):
+    """
+    Starts `iter_patient_record` and fetches its first Observation page right away, so
+    that a failing FHIR search raises before the response (and its status) is sent.
+
+    Returns:
+        Iterator[dict]: The patient's resources, the first ones already fetched.
+    """
+    resources = iter_patient_record(patient_resource)
+    return chain(list(islice(resources, 2)), resources)
+
+
+def export_error_outcome(error: Exception):
+    """The OperationOutcome written at the end of an export that failed mid-stream."""
+    diagnostics = getattr(error, "detail", None) or str(error)
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [
+            {
+                "severity": "error",
+                "code": "incomplete",
+                "diagnostics": f"Export aborted, the record is incomplete: {diagnostics}",
+            }
+        ],
+    }
+
+
+def iter_ndjson(resources):
+    """
+    Serializes resources as newline-delimited JSON, one line per resource. If reading
+    the resources fails, an OperationOutcome is written as the last line.
+    """
+    try:
+        for resource in resources:
+            yield json.dumps(resource, default=str) + "\n"
+    except Exception as e:
+        print(f"❌ Export failed mid-stream: {e}")
+        yield json.dumps(export_error_outcome(e)) + "\n"
+
+
+def iter_bundle_json(resources):
+    """
+    Serializes resources as a FHIR collection Bundle, streamed entry by entry. If reading
+    the resources fails, an OperationOutcome entry ends the Bundle, which stays valid JSON.
+    """
+    yield '{"resourceType": "Bundle", "type": "collection", "entry": ['
+    separator = ""
+    try:
+        for resource in resources:
+            yield separator + json.dumps({"resource": resource}, default=str)
+            separator = ","
+    except Exception as e:
+        print(f"❌ Export failed mid-stream: {e}")
+        yield separator + json.dumps({"resource": export_error_outcome(e)})
+    yield "]}"
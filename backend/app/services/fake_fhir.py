@@ -0,0 +1,629 @@
+"""
+In-process stand-in for the HAPI FHIR server, served through an httpx mock transport.
+
+It implements the subset of the FHIR REST API used by `app/services/fhir.py`:
+- create/read/update/delete of any resource type (versioned, with ETag, If-Match, If-None-Match)
+- JSON Patch on a resource
+- search with `_id`, `subject`/`patient`, `_count`, `_elements` and paging through `next` links
+- transaction and batch Bundles
+- `DELETE Patient/{id}?_cascade=delete`
+
+Latency and failures can be injected to measure and regression-test FHIR performance offline:
+
+    server = FakeFHIRServer(latency=0.05, error_rate=0.1)
+    install_fake_fhir_server(server)
+
+or start the API with FHIR_FAKE_SERVER=true. Running this module benchmarks the main
+fhir.py operations against the fake server.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import Counter
+from copy import deepcopy
+from datetime import datetime, timezone
+from itertools import count
+from uuid import uuid4
+
+import httpx
+
+FAKE_FHIR_BASE_URL = "http://fake-fhir.local/fhir"
+DEFAULT_PAGE_SIZE = 20  # HAPI's default page size
+
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    410: "Gone",
+    412: "Precondition Failed",
+    500: "Internal Server Error",
+}
+
+
+class FHIRError(Exception):
+    """Raised by request handlers to produce an OperationOutcome response."""
+
+    def __init__(self, status_code: int, diagnostics: str):
+        super().__init__(diagnostics)
+        self.status_code = status_code
+        self.diagnostics = diagnostics
+
+
+def _operation_outcome(diagnostics: str, severity: str = "error"):
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [
+            {"severity": severity, "code": "processing", "diagnostics": diagnostics}
+        ],
+    }
+
+
+def _etag(resource: dict):
+    return f'W/"{resource["meta"]["versionId"]}"'
+
+
+def _apply_json_patch(document: dict, operations: list):
+    """Applies JSON Patch operations (add, replace, remove, test) to a copy of `document`."""
+    document = deepcopy(document)
+
+    for operation in operations:
+        tokens = [
+            token.replace("~1", "/").replace("~0", "~")
+            for token in operation["path"].lstrip("/").split("/")
+        ]
+        parent = document
+        try:
+            for token in tokens[:-1]:
+                parent = (
+                    parent[int(token)] if isinstance(parent, list) else parent[token]
+                )
+        except (KeyError, IndexError, ValueError):
+            raise FHIRError(400, f"Invalid JSON Patch path: {operation['path']}")
+
+        key = tokens[-1]
+        op = operation["op"]
+        try:
+            if isinstance(parent, list):
+                index = len(parent) if key == "-" else int(key)
+                if op == "add":
+                    parent.insert(index, operation["value"])
+                elif op == "replace":
+                    parent[index] = operation["value"]
+                elif op == "remove":
+                    del parent[index]
+                elif op == "test" and parent[index] != operation["value"]:
+                    raise FHIRError(400, f"JSON Patch test failed: {operation['path']}")
+            else:
+                if op in ["replace", "remove", "test"] and key not in parent:
+                    raise FHIRError(
+                        400, f"Invalid JSON Patch path: {operation['path']}"
+                    )
+                if op in ["add", "replace"]:
+                    parent[key] = operation["value"]
+                elif op == "remove":
+                    del parent[key]
+                elif op == "test" and parent[key] != operation["value"]:
+                    raise FHIRError(400, f"JSON Patch test failed: {operation['path']}")
+        except (IndexError, ValueError, TypeError):
+            raise FHIRError(400, f"Invalid JSON Patch path: {operation['path']}")
+
+    return document
+
+
+class FakeFHIRServer:
+    """
+    An in-memory FHIR server.
+
+    Args:
+        latency (float | tuple): Seconds added to every request, or a (min, max) range.
+        error_rate (float): Probability that a request fails with a 500 before being handled.
+        page_size (int): Default search page size when `_count` is not given.
+        base_url (str): Base URL the shared FHIR clients should use.
+    """
+
+    def __init__(
+        self,
+        latency: float | tuple = 0.0,
+        error_rate: float = 0.0,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        base_url: str = FAKE_FHIR_BASE_URL,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.base_url = base_url.rstrip("/")
+        self.base_path = httpx.URL(self.base_url).path.rstrip("/")
+        self._lock = threading.RLock()
+        self._ids = count(1)
+        self.reset()
+
+    def reset(self):
+        """Drops all stored resources, injected failures and request counters."""
+        with self._lock:
+            self.resources = {}  # (resource type, id) -> current resource
+            self.deleted = set()  # (resource type, id) of deleted resources
+            self._pages = {}  # paging token -> list of (resource type, id)
+            self._injected_failures = []
+            self.requests = Counter()
+
+    # ---- Failure injection -------------------------------------------------
+
+    def fail_next(self, times: int = 1, status_code: int = 500, diagnostics: str = ""):
+        """Makes the next `times` requests fail with `status_code`."""
+        with self._lock:
+            self._injected_failures.extend(
+                [(status_code, diagnostics or "Injected failure")] * times
+            )
+
+    def _injected_failure(self):
+        with self._lock:
+            if self._injected_failures:
+                return self._injected_failures.pop(0)
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, "Injected random failure"
+        return None
+
+    def _delay(self):
+        if isinstance(self.latency, tuple):
+            return random.uniform(*self.latency)
+        return self.latency
+
+    # ---- Transports --------------------------------------------------------
+
+    def transport(self):
+        """Transport for the sync client; latency blocks the calling thread."""
+
+        def handler(request: httpx.Request):
+            delay = self._delay()
+            if delay:
+                time.sleep(delay)
+            return self.handle(request)
+
+        return httpx.MockTransport(handler)
+
+    def async_transport(self):
+        """Transport for the async client; latency is awaited."""
+
+        async def handler(request: httpx.Request):
+            delay = self._delay()
+            if delay:
+                await asyncio.sleep(delay)
+            return self.handle(request)
+
+        return httpx.MockTransport(handler)
+
+    # ---- Request handling --------------------------------------------------
+
+    def handle(self, request: httpx.Request):
+        """Handles one HTTP request and returns the response."""
+        self.requests[request.method] += 1
+        self.requests["total"] += 1
+
+        failure = self._injected_failure()
+        if failure:
+            status_code, diagnostics = failure
+            return self._json_response(status_code, _operation_outcome(diagnostics))
+
+        path = request.url.path
+        if path.startswith(self.base_path):
+            path = path[len(self.base_path) :]
+        parts = [part for part in path.split("/") if part]
+        params = request.url.params
+
+        try:
+            with self._lock:
+                return self._route(request, parts, params)
+        except FHIRError as e:
+            return self._json_response(e.status_code, _operation_outcome(e.diagnostics))
+
+    def _route(self, request: httpx.Request, parts: list, params):
+        method = request.method
+
+        if not parts:
+            if "_getpages" in params:
+                return self._json_response(200, self._page(params))
+            if method == "POST":
+                return self._json_response(200, self._process_bundle(_body(request)))
+            raise FHIRError(400, "Unsupported request on the base URL")
+
+        if parts == ["metadata"]:
+            return self._json_response(
+                200,
+                {
+                    "resourceType": "CapabilityStatement",
+                    "status": "active",
+                    "fhirVersion": "4.0.1",
+                },
+            )
+
+        resource_type = parts[0]
+        resource_id = parts[1] if len(parts) > 1 else None
+
+        if resource_id is None:
+            if method == "GET":
+                return self._json_response(200, self._search(resource_type, params))
+            if method == "POST":
+                status, resource = self._create(resource_type, _body(request))
+                return self._resource_response(status, resource)
+            raise FHIRError(405, f"{method} not allowed on {resource_type}")
+
+        if method == "GET":
+            resource = self._read(resource_type, resource_id)
+            if request.headers.get("If-None-Match") == _etag(resource):
+                return httpx.Response(304, headers={"ETag": _etag(resource)})
+            return self._resource_response(200, resource)
+        if method == "PUT":
+            status, resource = self._update(
+                resource_type,
+                resource_id,
+                _body(request),
+                request.headers.get("If-Match"),
+            )
+            return self._resource_response(status, resource)
+        if method == "PATCH":
+            resource = self._patch(
+                resource_type,
+                resource_id,
+                _body(request),
+                request.headers.get("If-Match"),
+            )
+            return self._resource_response(200, resource)
+        if method == "DELETE":
+            cascade = params.get("_cascade") == "delete"
+            return self._json_response(
+                *self._delete(resource_type, resource_id, cascade)
+            )
+
+        raise FHIRError(405, f"{method} not allowed")
+
+    # ---- CRUD --------------------------------------------------------------
+
+    def _stamp(self, resource: dict, version: int):
+        resource["meta"] = {
+            **resource.get("meta", {}),
+            "versionId": str(version),
+            "lastUpdated": datetime.now(timezone.utc).isoformat(),
+        }
+        return resource
+
+    def _create(self, resource_type: str, resource: dict, resource_id: str = None):
+        resource = deepcopy(resource)
+        resource["resourceType"] = resource_type
+        resource["id"] = resource_id or str(next(self._ids))
+        self._stamp(resource, 1)
+        self.resources[(resource_type, resource["id"])] = resource
+        self.deleted.discard((resource_type, resource["id"]))
+        return 201, resource
+
+    def _read(self, resource_type: str, resource_id: str):
+        key = (resource_type, resource_id)
+        if key in self.deleted:
+            raise FHIRError(410, f"Resource {resource_type}/{resource_id} is deleted")
+        if key not in self.resources:
+            raise FHIRError(404, f"Resource {resource_type}/{resource_id} is not known")
+        return self.resources[key]
+
+    def _check_version(self, resource: dict, if_match: str | None):
+        if if_match and if_match != _etag(resource):
+            raise FHIRError(
+                412,
+                f"Version conflict: expected {if_match}, current is {_etag(resource)}",
+            )
+
+    def _update(
+        self, resource_type: str, resource_id: str, resource: dict, if_match=None
+    ):
+        current = self.resources.get((resource_type, resource_id))
+        if current is None:
+            # Update-as-create with a client assigned id
+            return self._create(resource_type, resource, resource_id)
+
+        self._check_version(current, if_match)
+        resource = deepcopy(resource)
+        resource["resourceType"] = resource_type
+        resource["id"] = resource_id
+        self._stamp(resource, int(current["meta"]["versionId"]) + 1)
+        self.resources[(resource_type, resource_id)] = resource
+        return 200, resource
+
+    def _patch(
+        self, resource_type: str, resource_id: str, operations: list, if_match=None
+    ):
+        current = self._read(resource_type, resource_id)
+        self._check_version(current, if_match)
+        patched = _apply_json_patch(current, operations)
+        self._stamp(patched, int(current["meta"]["versionId"]) + 1)
+        self.resources[(resource_type, resource_id)] = patched
+        return patched
+
+    def _references(self, resource_type: str, resource_id: str):
+        reference = f"{resource_type}/{resource_id}"
+        return [
+            key
+            for key, resource in self.resources.items()
+            if resource.get("subject", {}).get("reference") == reference
+        ]
+
+    def _delete(self, resource_type: str, resource_id: str, cascade: bool = False):
+        key = (resource_type, resource_id)
+        if key in self.deleted:
+            return 200, _operation_outcome(
+                "SUCCESSFUL_DELETE_ALREADY_DELETED", severity="information"
+            )
+        if key not in self.resources:
+            return 404, _operation_outcome(
+                f"Resource {resource_type}/{resource_id} is not known"
+            )
+
+        referencing = self._references(resource_type, resource_id)
+        if referencing and not cascade:
+            raise FHIRError(
+                409,
+                f"Unable to delete {resource_type}/{resource_id} because "
+                f"{len(referencing)} resources refer to it",
+            )
+        for referencing_key in referencing:
+            self.resources.pop(referencing_key)
+            self.deleted.add(referencing_key)
+
+        self.resources.pop(key)
+        self.deleted.add(key)
+        return 204, None
+
+    # ---- Search ------------------------------------------------------------
+
+    def _search(self, resource_type: str, params):
+        ids = set(params["_id"].split(",")) if "_id" in params else None
+        subject = params.get("subject") or params.get("patient")
+        if subject and "/" not in subject:
+            subject = f"Patient/{subject}"
+
+        matches = [
+            key
+            for key, resource in self.resources.items()
+            if key[0] == resource_type
+            and (ids is None or key[1] in ids)
+            and (
+                subject is None
+                or resource.get("subject", {}).get("reference") == subject
+            )
+        ]
+
+        token = uuid4().hex
+        self._pages[token] = matches
+        page_params = {
+            "_count": int(params.get("_count", self.page_size)),
+            "_elements": params.get("_elements"),
+        }
+        return self._build_page(token, 0, page_params)
+
+    def _page(self, params):
+        token = params["_getpages"]
+        if token not in self._pages:
+            raise FHIRError(410, f"Search {token} has expired")
+        page_params = {
+            "_count": int(params.get("_count", self.page_size)),
+            "_elements": params.get("_elements"),
+        }
+        return self._build_page(
+            token, int(params.get("_getpagesoffset", 0)), page_params
+        )
+
+    def _build_page(self, token: str, offset: int, page_params: dict):
+        matches = self._pages[token]
+        page_size = page_params["_count"]
+        elements = page_params["_elements"]
+
+        entries = []
+        for key in matches[offset : offset + page_size]:
+            resource = self.resources.get(key)
+            if resource is None:  # Deleted since the search was run
+                continue
+            if elements:
+                fields = set(elements.split(",")) | {"resourceType", "id", "meta"}
+                resource = {k: v for k, v in resource.items() if k in fields}
+            entries.append(
+                {
+                    "fullUrl": f"{self.base_url}/{key[0]}/{key[1]}",
+                    "resource": deepcopy(resource),
+                    "search": {"mode": "match"},
+                }
+            )
+
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "total": len(matches),
+            "link": [],
+            "entry": entries,
+        }
+        if offset + page_size < len(matches):
+            query = f"_getpages={token}&_getpagesoffset={offset + page_size}&_count={page_size}"
+            if elements:
+                query += f"&_elements={elements}"
+            bundle["link"].append(
+                {"relation": "next", "url": f"{self.base_url}?{query}"}
+            )
+        return bundle
+
+    # ---- Bundles -----------------------------------------------------------
+
+    def _process_bundle(self, bundle: dict):
+        bundle_type = bundle.get("type")
+        if bundle.get("resourceType") != "Bundle" or bundle_type not in [
+            "transaction",
+            "batch",
+        ]:
+            raise FHIRError(400, "Expected a transaction or batch Bundle")
+
+        snapshot = (deepcopy(self.resources), set(self.deleted))
+        response_entries = []
+
+        for entry in bundle.get("entry", []):
+            try:
+                response_entries.append(self._process_entry(entry))
+            except FHIRError as e:
+                if bundle_type == "transaction":
+                    # All-or-nothing: roll back every change made by this Bundle
+                    self.resources, self.deleted = snapshot
+                    raise
+                response_entries.append(
+                    {
+                        "response": {
+                            "status": f"{e.status_code} {STATUS_TEXT.get(e.status_code, '')}".strip(),
+                            "outcome": _operation_outcome(e.diagnostics),
+                        }
+                    }
+                )
+
+        return {
+            "resourceType": "Bundle",
+            "type": f"{bundle_type}-response",
+            "entry": response_entries,
+        }
+
+    def _process_entry(self, entry: dict):
+        request = entry.get("request", {})
+        method = request.get("method", "").upper()
+        url = request.get("url", "")
+        path, _, query = url.partition("?")
+        parts = [part for part in path.split("/") if part]
+        params = httpx.QueryParams(query)
+
+        if method == "POST" and len(parts) == 1:
+            status, resource = self._create(parts[0], entry["resource"])
+        elif method == "PUT" and len(parts) == 2:
+            status, resource = self._update(
+                parts[0], parts[1], entry["resource"], request.get("ifMatch")
+            )
+        elif method == "DELETE" and len(parts) == 2:
+            status, outcome = self._delete(
+                parts[0], parts[1], params.get("_cascade") == "delete"
+            )
+            if status >= 400:
+                raise FHIRError(status, outcome["issue"][0]["diagnostics"])
+            return {"response": {"status": f"{status} {STATUS_TEXT[status]}"}}
+        elif method == "GET" and len(parts) == 2:
+            resource = self._read(parts[0], parts[1])
+            return {
+                "resource": deepcopy(resource),
+                "response": {"status": "200 OK", "etag": _etag(resource)},
+            }
+        else:
+            raise FHIRError(400, f"Unsupported Bundle entry: {method} {url}")
+
+        return {
+            "response": {
+                "status": f"{status} {STATUS_TEXT[status]}",
+                "location": f"{resource['resourceType']}/{resource['id']}/_history/{resource['meta']['versionId']}",
+                "etag": _etag(resource),
+            }
+        }
+
+    # ---- Responses ---------------------------------------------------------
+
+    def _json_response(self, status_code: int, body: dict | None):
+        if body is None:
+            return httpx.Response(status_code)
+        return httpx.Response(
+            status_code,
+            content=json.dumps(body),
+            headers={"Content-Type": "application/fhir+json"},
+        )
+
+    def _resource_response(self, status_code: int, resource: dict):
+        response = self._json_response(status_code, resource)
+        response.headers["ETag"] = _etag(resource)
+        response.headers["Location"] = (
+            f"{self.base_url}/{resource['resourceType']}/{resource['id']}"
+            f"/_history/{resource['meta']['versionId']}"
+        )
+        return response
+
+
+def _body(request: httpx.Request):
+    try:
+        return json.loads(request.content or b"{}")
+    except json.JSONDecodeError:
+        raise FHIRError(400, "Request body is not valid JSON")
+
+
+def install_fake_fhir_server(server: FakeFHIRServer | None = None):
+    """Routes the shared FHIR clients of `app.services.fhir` to a fake server."""
+    from app.services.fhir import configure_fhir_clients
+
+    server = server or FakeFHIRServer()
+    configure_fhir_clients(
+        server.transport(), server.async_transport(), base_url=server.base_url
+    )
+    return server
+
+
+def run_benchmark(observations: int = 40, latency: float = 0.02):
+    """Times the main FHIR operations against the fake server and prints request counts."""
+    from app.services import fhir
+
+    server = install_fake_fhir_server(FakeFHIRServer(latency=latency))
+    lab_tests = [
+        {
+            "name": f"Analyte {i}",
+            "value": i,
+            "unit": "mg/dL",
+            "reference_range": "1 - 9",
+        }
+        for i in range(observations)
+    ]
+    patient_id = fhir.create_fhir_patient("benchmark@example.com")
+
+    def measure(label, operation):
+        server.requests.clear()
+        started = time.perf_counter()
+        result = operation()
+        elapsed = time.perf_counter() - started
+        print(
+            f"{label:<45} {elapsed * 1000:8.1f} ms {server.requests['total']:5d} requests"
+        )
+        return result
+
+    created = measure(
+        f"create {observations} observations (transaction)",
+        lambda: fhir.send_lab_results_to_fhir(lab_tests, patient_id, "2024-01-01"),
+    )
+    measure(
+        f"create {observations} observations (one by one)",
+        lambda: fhir.send_lab_results_to_fhir(
+            lab_tests, patient_id, "2024-01-02", bundle_type=None
+        ),
+    )
+    ids = [obs["id"] for obs in created]
+    fhir.observation_cache.clear()
+    measure(
+        f"read {observations} observations (batched)",
+        lambda: fhir.get_fhir_observations(ids),
+    )
+    measure(
+        f"read {observations} observations (cached)",
+        lambda: fhir.get_fhir_observations(ids),
+    )
+    measure(
+        "update patient",
+        lambda: fhir.update_fhir_patient(
+            patient_id, first_name="Bench", last_name="Mark"
+        ),
+    )
+    measure(
+        f"delete {observations * 2} observations",
+        lambda: fhir.remove_all_observations_for_patient(patient_id),
+    )
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -1,23 +1,337 @@
-import requests
+import asyncio
+import httpx
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from fastapi import HTTPException
 import json
-from app.config import FHIR_SERVER_URL
+from urllib.parse import quote
+from uuid import uuid4
+from app.config import (
+    FHIR_SERVER_URL,
+    FHIR_CONNECT_TIMEOUT,
+    FHIR_READ_TIMEOUT,
+    FHIR_MAX_CONNECTIONS,
+    FHIR_MAX_KEEPALIVE_CONNECTIONS,
+    FHIR_KEEPALIVE_EXPIRY,
+    FHIR_LAB_SET_BUNDLE_TYPE,
+    FHIR_SEARCH_PAGE_SIZE,
+    FHIR_DELETE_BATCH_SIZE,
+    FHIR_DELETE_CONCURRENCY,
+    OBSERVATION_CACHE_SIZE,
+    OBSERVATION_CACHE_TTL,
+    PATIENT_CACHE_SIZE,
+    PATIENT_CACHE_TTL,
+    FHIR_REQUEST_DEADLINE,
+    FHIR_BUNDLE_ENTRY_TIMEOUT,
+    FHIR_RETRY_ATTEMPTS,
+    FHIR_RETRY_BASE_DELAY,
+    FHIR_RETRY_MAX_DELAY,
+    FHIR_BREAKER_FAILURE_RATIO,
+    FHIR_BREAKER_MINIMUM_CALLS,
+    FHIR_BREAKER_WINDOW,
+    FHIR_BREAKER_RESET_TIMEOUT,
+)
+from app.utils.cache import TTLCache
+from app.utils.circuit_breaker import CircuitBreaker
 from app.utils.file_parser import parse_reference_range
 
 VALID_GENDER_VALUES = ["male", "female", "other", "unknown"]
 
+FHIR_TIMEOUT = httpx.Timeout(FHIR_READ_TIMEOUT, connect=FHIR_CONNECT_TIMEOUT)
+FHIR_LIMITS = httpx.Limits(
+    max_connections=FHIR_MAX_CONNECTIONS,
+    max_keepalive_connections=FHIR_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=FHIR_KEEPALIVE_EXPIRY,
+)
+FHIR_HEADERS = {"Accept": "application/fhir+json"}
+# Keeps `_id=a,b,c` search URLs well below common 2KB URL limits
+FHIR_MAX_ID_PARAM_LENGTH = 1500
 
-def create_fhir_patient(email: str):
-    """Creates a new patient in FHIR and stores the FHIR ID in MongoDB"""
+
+def _build_fhir_client(
+    transport: httpx.BaseTransport | None = None, base_url: str | None = None
+):
+    """Builds the pooled, keep-alive sync client used for every FHIR call."""
+    return httpx.Client(
+        base_url=base_url or FHIR_SERVER_URL or "",
+        timeout=FHIR_TIMEOUT,
+        limits=FHIR_LIMITS,
+        headers=FHIR_HEADERS,
+        transport=transport,
+    )
+
+
+def _build_async_fhir_client(
+    transport: httpx.AsyncBaseTransport | None = None, base_url: str | None = None
+):
+    """Builds the pooled, keep-alive async client used for every FHIR call."""
+    return httpx.AsyncClient(
+        base_url=base_url or FHIR_SERVER_URL or "",
+        timeout=FHIR_TIMEOUT,
+        limits=FHIR_LIMITS,
+        headers=FHIR_HEADERS,
+        transport=transport,
+    )
+
+
+# Shared clients, created once at startup and reused by every function below
+fhir_client = _build_fhir_client()
+async_fhir_client = _build_async_fhir_client()
+
+# Observations are immutable once written, so reads are cached by ID
+observation_cache = TTLCache(maxsize=OBSERVATION_CACHE_SIZE, ttl=OBSERVATION_CACHE_TTL)
+
+# Last known version of each Patient, used to build patches and If-Match headers
+patient_cache = TTLCache(maxsize=PATIENT_CACHE_SIZE, ttl=PATIENT_CACHE_TTL)
+
+# Flipped off the first time the server rejects a JSON Patch
+_patch_supported = True
+
+
+# Closing tasks of replaced async clients, referenced until they finish
+_closing_clients = set()
+
+
+def _close_async_client(client: httpx.AsyncClient):
+    """Closes a replaced async client, on the running event loop if there is one."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(client.aclose())
+        return
+    task = loop.create_task(client.aclose())
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+
+def configure_fhir_clients(
+    transport: httpx.BaseTransport | None = None,
+    async_transport: httpx.AsyncBaseTransport | None = None,
+    base_url: str | None = None,
+):
+    """
+    Replaces the shared FHIR clients, e.g. to route calls through a custom transport
+    such as the in-process fake server (`app.services.fake_fhir`).
+    The previous clients are closed, so their connection pools are released.
+    """
+    global fhir_client, async_fhir_client
+    fhir_client.close()
+    _close_async_client(async_fhir_client)
+    fhir_client = _build_fhir_client(transport, base_url)
+    async_fhir_client = _build_async_fhir_client(async_transport, base_url)
+    observation_cache.clear()
+    patient_cache.clear()
+
+
+async def close_fhir_clients():
+    """Closes the shared FHIR clients and their connection pools (app shutdown)."""
+    fhir_client.close()
+    await async_fhir_client.aclose()
+
+
+# Verbs that are safe to repeat after a failure or timeout
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+fhir_circuit_breaker = CircuitBreaker(
+    failure_ratio=FHIR_BREAKER_FAILURE_RATIO,
+    minimum_calls=FHIR_BREAKER_MINIMUM_CALLS,
+    window=FHIR_BREAKER_WINDOW,
+    reset_timeout=FHIR_BREAKER_RESET_TIMEOUT,
+)
+
+
+def get_fhir_circuit_breaker_stats():
+    """Returns the state of the FHIR circuit breaker."""
+    return fhir_circuit_breaker.stats()
+
+
+def _is_retryable(response: httpx.Response):
+    """5xx/429 responses are retried, except HAPI indexing errors (the write went through)."""
+    return response.status_code in RETRYABLE_STATUS_CODES and not _is_indexing_failure(
+        response.text
+    )
+
+
+def _backoff_delay(attempt: int):
+    """Exponential backoff with full jitter."""
+    return random.uniform(
+        0, min(FHIR_RETRY_MAX_DELAY, FHIR_RETRY_BASE_DELAY * 2**attempt)
+    )
+
+
+def _attempt_timeout(give_up_at: float, read_timeout: float):
+    """Caps the timeout of one attempt so the whole call stays within its deadline."""
+    remaining = max(give_up_at - time.monotonic(), 0.001)
+    return httpx.Timeout(
+        min(read_timeout, remaining), connect=min(FHIR_CONNECT_TIMEOUT, remaining)
+    )
+
+
+def _fhir_unavailable(method: str, url: str, error: Exception | None):
+    """Builds the error raised when a FHIR call cannot be completed."""
+    if error is None:
+        return HTTPException(
+            status_code=503,
+            detail="FHIR server is currently unavailable, please try again later.",
+        )
+    if isinstance(error, httpx.TimeoutException):
+        return HTTPException(
+            status_code=504, detail=f"FHIR request timed out: {method} {url}"
+        )
+    return HTTPException(
+        status_code=503, detail=f"FHIR request failed: {method} {url}: {error}"
+    )
+
+
+def fhir_request(
+    method: str,
+    url: str,
+    deadline: float = FHIR_REQUEST_DEADLINE,
+    idempotent: bool | None = None,
+    **kwargs,
+):
+    """
+    Sends a request to the FHIR server through the shared client.
+
+    Idempotent verbs are retried with jittered exponential backoff on connection errors,
+    timeouts and 5xx responses. Every attempt counts towards the circuit breaker, and while
+    it is open calls fail immediately with a 503. Retries never run past `deadline` seconds.
+
+    Args:
+        method (str): HTTP verb.
+        url (str): Path relative to FHIR_SERVER_URL, or an absolute URL (e.g. a paging link).
+        deadline (float): Total time budget for the call, including retries.
+        idempotent (bool | None): Whether the call is safe to retry; by default decided
+            by the verb (a POSTed Bundle of PUTs, for instance, is).
+        **kwargs: Passed on to `httpx.Client.request` (params, headers, json, content, timeout).
+
+    Returns:
+        httpx.Response: The final response. Non-retryable errors (4xx) are returned as-is.
+
+    Raises:
+        HTTPException: 503 when the circuit is open or the server is unreachable, 504 on timeout.
+    """
+    method = method.upper()
+    read_timeout = kwargs.pop("timeout", FHIR_READ_TIMEOUT)
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    attempts = FHIR_RETRY_ATTEMPTS if idempotent else 1
+    give_up_at = time.monotonic() + deadline
+    response, error = None, None
+
+    for attempt in range(attempts):
+        if not fhir_circuit_breaker.allow_request():
+            break
+
+        try:
+            response = fhir_client.request(
+                method,
+                url,
+                timeout=_attempt_timeout(give_up_at, read_timeout),
+                **kwargs,
+            )
+            error = None
+        except httpx.TransportError as e:
+            response, error = None, e
+
+        if response is not None and not _is_retryable(response):
+            fhir_circuit_breaker.record_success()
+            return response
+        fhir_circuit_breaker.record_failure()
+
+        delay = _backoff_delay(attempt)
+        if attempt + 1 >= attempts or time.monotonic() + delay >= give_up_at:
+            break
+        print(
+            f"FHIR {method} {url} failed (attempt {attempt + 1}), retrying in {delay:.2f}s"
+        )
+        time.sleep(delay)
+
+    if response is not None:
+        return response
+    raise _fhir_unavailable(method, url, error)
+
+
+async def fhir_request_async(
+    method: str,
+    url: str,
+    deadline: float = FHIR_REQUEST_DEADLINE,
+    idempotent: bool | None = None,
+    **kwargs,
+):
+    """Async counterpart of `fhir_request`, sent through the shared async client."""
+    method = method.upper()
+    read_timeout = kwargs.pop("timeout", FHIR_READ_TIMEOUT)
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    attempts = FHIR_RETRY_ATTEMPTS if idempotent else 1
+    give_up_at = time.monotonic() + deadline
+    response, error = None, None
+
+    for attempt in range(attempts):
+        if not fhir_circuit_breaker.allow_request():
+            break
+
+        try:
+            response = await async_fhir_client.request(
+                method,
+                url,
+                timeout=_attempt_timeout(give_up_at, read_timeout),
+                **kwargs,
+            )
+            error = None
+        except httpx.TransportError as e:
+            response, error = None, e
+
+        if response is not None and not _is_retryable(response):
+            fhir_circuit_breaker.record_success()
+            return response
+        fhir_circuit_breaker.record_failure()
+
+        delay = _backoff_delay(attempt)
+        if attempt + 1 >= attempts or time.monotonic() + delay >= give_up_at:
+            break
+        print(
+            f"FHIR {method} {url} failed (attempt {attempt + 1}), retrying in {delay:.2f}s"
+        )
+        await asyncio.sleep(delay)
+
+    if response is not None:
+        return response
+    raise _fhir_unavailable(method, url, error)
+
+
+def new_fhir_id():
+    """
+    Returns a client-assigned FHIR resource id. Resources written with their own id
+    (PUT) can be retried safely, which the FHIR outbox relies on.
+    """
+    return str(uuid4())
+
+
+def build_fhir_patient(email: str, fhir_id: str | None = None, **details):
+    """Builds a Patient resource, optionally with an id and name, birth date and gender."""
     patient_resource = {
         "resourceType": "Patient",
         "telecom": [{"system": "email", "value": email}],
     }
-    response = requests.post(f"{FHIR_SERVER_URL}/Patient", json=patient_resource)
+    if fhir_id:
+        patient_resource["id"] = fhir_id
+    return _apply_patient_updates(patient_resource, details)
+
+
+def create_fhir_patient(email: str):
+    """Creates a new patient in FHIR and stores the FHIR ID in MongoDB"""
+    patient_resource = build_fhir_patient(email)
+    response = fhir_request("POST", "/Patient", json=patient_resource)
     print(f"FHIR Response {response.status_code}: {response.text}")
 
     if response.status_code == 201:
         fhir_id = response.json()["id"]
+        _cache_patient_response(fhir_id, response)
         return fhir_id
     else:
         raise HTTPException(
@@ -26,18 +340,36 @@ def create_fhir_patient(email: str):
         )
 
 
-def update_fhir_patient(fhir_id: str, **update_data):
-    """Updates an existing patient in FHIR server with partial updates supported"""
-    # First get the existing patient data
-    response = requests.get(f"{FHIR_SERVER_URL}/Patient/{fhir_id}")
+def get_fhir_patient(fhir_id: str):
+    """
+    Fetches a Patient resource from the FHIR server.
+
+    Returns:
+        dict | None: The Patient resource, or None if it does not exist.
+    """
+    response = fhir_request("GET", f"/Patient/{fhir_id}")
     if response.status_code != 200:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to fetch existing patient data from FHIR: {response.text}",
-        )
+        return None
+
+    _cache_patient_response(fhir_id, response)
+    return response.json()
+
+
+def _cache_patient_response(fhir_id: str, response: httpx.Response):
+    """Keeps the Patient returned by a create/update so the next update can skip the GET."""
+    try:
+        resource = response.json()
+    except json.JSONDecodeError:
+        resource = None
+
+    if isinstance(resource, dict) and resource.get("resourceType") == "Patient":
+        patient_cache.set(fhir_id, resource)
+    else:
+        patient_cache.invalidate(fhir_id)
 
-    current_patient = response.json()
 
+def _apply_patient_updates(current_patient: dict, update_data: dict):
+    """Applies name, birth date and gender updates to a Patient resource in place."""
     # Update only the provided fields
     if "first_name" in update_data or "last_name" in update_data:
         # Get current name or initialize if not present
@@ -52,32 +384,173 @@ def update_fhir_patient(fhir_id: str, **update_data):
         current_patient["birthDate"] = update_data["birth_date"]
 
     if "gender" in update_data:
-        if update_data["gender"].lower() not in VALID_GENDER_VALUES:
+        current_patient["gender"] = update_data["gender"]
+
+    return current_patient
+
+
+def _patient_patch_operations(current_patient: dict | None, update_data: dict):
+    """
+    Builds the JSON Patch operations for a patient update.
+
+    Returns:
+        list | None: The operations, or None when a partial name change cannot be expressed
+            without knowing the current resource.
+    """
+    operations = []
+
+    if "first_name" in update_data or "last_name" in update_data:
+        has_name = bool(current_patient and current_patient.get("name"))
+        if has_name:
+            if "first_name" in update_data:
+                operations.append(
+                    {
+                        "op": "add",
+                        "path": "/name/0/given",
+                        "value": [update_data["first_name"]],
+                    }
+                )
+            if "last_name" in update_data:
+                operations.append(
+                    {
+                        "op": "add",
+                        "path": "/name/0/family",
+                        "value": update_data["last_name"],
+                    }
+                )
+        elif current_patient is None and not (
+            "first_name" in update_data and "last_name" in update_data
+        ):
+            return None
+        else:
+            name = _apply_patient_updates({}, update_data).get("name")
+            operations.append({"op": "add", "path": "/name", "value": name})
+
+    if "birth_date" in update_data:
+        operations.append(
+            {"op": "add", "path": "/birthDate", "value": update_data["birth_date"]}
+        )
+
+    if "gender" in update_data:
+        operations.append(
+            {"op": "add", "path": "/gender", "value": update_data["gender"]}
+        )
+
+    return operations
+
+
+def update_fhir_patient(fhir_id: str, **update_data):
+    """
+    Updates an existing patient in FHIR server with partial updates supported.
+
+    The change is sent as a single JSON Patch request. When the server does not support PATCH,
+    the patient is read (or taken from the cache) and written back with a PUT guarded by
+    `If-Match` on its version, so concurrent edits are never silently overwritten.
+    """
+    global _patch_supported
+
+    if "gender" in update_data:
+        gender = str(getattr(update_data["gender"], "value", update_data["gender"]))
+        if gender.lower() not in VALID_GENDER_VALUES:
             raise ValueError(
                 f"Invalid gender. Allowed values: {', '.join(VALID_GENDER_VALUES)}"
             )
-        current_patient["gender"] = update_data["gender"].lower()
+        update_data["gender"] = gender.lower()
 
-    # Send the updated resource back to FHIR
-    update_response = requests.put(
-        f"{FHIR_SERVER_URL}/Patient/{fhir_id}", json=current_patient
-    )
-    print(f"FHIR Update Response {update_response.status_code}: {update_response.text}")
+    cached_patient, _ = patient_cache.get(fhir_id)
+    operations = _patient_patch_operations(cached_patient, update_data)
+
+    if _patch_supported and operations is not None:
+        headers = {"Content-Type": "application/json-patch+json"}
+        if cached_patient and _version_etag(cached_patient):
+            headers["If-Match"] = _version_etag(cached_patient)
+
+        response = fhir_request(
+            "PATCH",
+            f"/Patient/{fhir_id}",
+            headers=headers,
+            content=json.dumps(operations),
+        )
+        print(f"FHIR Patch Response {response.status_code}: {response.text}")
+
+        if response.status_code == 200:
+            _cache_patient_response(fhir_id, response)
+            print("Success: Patient updated in FHIR")
+            return True
+
+        if response.status_code in [405, 415, 501]:
+            print("FHIR server does not support JSON Patch, falling back to PUT")
+            _patch_supported = False
+        elif response.status_code == 412:
+            # Our cached copy is outdated, continue with a fresh read
+            patient_cache.invalidate(fhir_id)
+            cached_patient = None
+        elif response.status_code not in [400, 422]:
+            raise HTTPException(
+                status_code=500,
+                detail=f"FHIR server error ({response.status_code}): {response.text}",
+            )
+
+    return _put_patient_update(fhir_id, update_data, cached_patient)
+
+
+def _put_patient_update(
+    fhir_id: str, update_data: dict, current_patient: dict | None = None
+):
+    """Read-modify-write of a Patient, using `If-Match` so a concurrent edit causes a retry."""
+    for _ in range(2):
+        if current_patient is None:
+            response = fhir_request("GET", f"/Patient/{fhir_id}")
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to fetch existing patient data from FHIR: {response.text}",
+                )
+            current_patient = response.json()
+
+        headers = {}
+        if _version_etag(current_patient):
+            headers["If-Match"] = _version_etag(current_patient)
+
+        # Send the updated resource back to FHIR
+        updated_patient = _apply_patient_updates(deepcopy(current_patient), update_data)
+        update_response = fhir_request(
+            "PUT", f"/Patient/{fhir_id}", json=updated_patient, headers=headers
+        )
+        print(
+            f"FHIR Update Response {update_response.status_code}: {update_response.text}"
+        )
+
+        if update_response.status_code == 412:
+            # Someone else updated the patient in the meantime: re-read and re-apply
+            patient_cache.invalidate(fhir_id)
+            current_patient = None
+            continue
+
+        if update_response.status_code == 200:
+            _cache_patient_response(fhir_id, update_response)
+            print("Success: Patient updated in FHIR")
+            return True
 
-    if update_response.status_code == 200:
-        print("Success: Patient updated in FHIR")
-        return True
-    else:
         raise HTTPException(
             status_code=500,
             detail=f"FHIR server error ({update_response.status_code}): {update_response.text}",
         )
 
+    raise HTTPException(
+        status_code=409,
+        detail="Patient was modified concurrently in FHIR, please retry.",
+    )
+
 
 def delete_fhir_patient(fhir_id: str):
     """Deletes a patient from the FHIR server and handles already deleted cases"""
+    patient_cache.invalidate(fhir_id)
+
     # Try first with cascade delete
-    response = requests.delete(f"{FHIR_SERVER_URL}/Patient/{fhir_id}?_cascade=delete")
+    response = fhir_request(
+        "DELETE", f"/Patient/{fhir_id}", params={"_cascade": "delete"}
+    )
     print(
         "FHIR DELETE Response:", response.status_code, response.text
     )  # Debugging output
@@ -105,7 +578,7 @@ def delete_fhir_patient(fhir_id: str):
 
     # If cascade delete failed, try without it as a fallback
     if response.status_code == 409:  # Conflict error
-        response = requests.delete(f"{FHIR_SERVER_URL}/Patient/{fhir_id}")
+        response = fhir_request("DELETE", f"/Patient/{fhir_id}")
         print("FHIR DELETE Fallback Response:", response.status_code, response.text)
 
         if response.status_code in [204, 410]:
@@ -123,49 +596,236 @@ def delete_fhir_patient(fhir_id: str):
     return False  # Treat other failures as errors
 
 
-def send_lab_results_to_fhir(lab_tests: list, patient_fhir_id: str, date: str):
-    headers = {"Content-Type": "application/fhir+json"}
-    fhir_observations = []
+def build_lab_observation(test: dict, patient_fhir_id: str, date: str):
+    """Builds a laboratory Observation resource from one extracted lab test."""
+    reference_range = parse_reference_range(test["reference_range"], test["unit"])
 
-    for test in lab_tests:
-        reference_range = parse_reference_range(test["reference_range"], test["unit"])
+    observation_resource = {
+        # Specifies the type of FHIR resource being created, in this case, an Observation.
+        "resourceType": "Observation",
+        "status": "final",
+        "category": [
+            {
+                "coding": [
+                    {
+                        "system": "http://terminology.hl7.org/CodeSystem/observation-category",
+                        "code": "laboratory",
+                    }
+                ]
+            }
+        ],
+        "code": {"text": test["name"]},
+        "subject": {"reference": f"Patient/{patient_fhir_id}"},
+        "effectiveDateTime": date,
+        "valueQuantity": {"value": test["value"], "unit": test["unit"]},
+    }
 
-        observation_resource = {
-            # Specifies the type of FHIR resource being created, in this case, an Observation.
-            "resourceType": "Observation",
-            "status": "final",
-            "category": [
-                {
-                    "coding": [
-                        {
-                            "system": "http://terminology.hl7.org/CodeSystem/observation-category",
-                            "code": "laboratory",
-                        }
-                    ]
-                }
-            ],
-            "code": {"text": test["name"]},
-            "subject": {"reference": f"Patient/{patient_fhir_id}"},
-            "effectiveDateTime": date,
-            "valueQuantity": {"value": test["value"], "unit": test["unit"]},
+    # ✅ Only add reference range if it's valid
+    if reference_range:
+        observation_resource["referenceRange"] = [reference_range]
+
+    return observation_resource
+
+
+def post_fhir_bundle(entries: list, bundle_type: str = "transaction"):
+    """
+    Submits a transaction or batch Bundle to the FHIR server in a single request.
+
+    Args:
+        entries (list): Bundle entries, each with a `request` and optionally a `resource`.
+        bundle_type (str): "transaction" (all-or-nothing) or "batch" (entries succeed independently).
+
+    The timeout and deadline grow with the number of entries, and a Bundle whose entries
+    are all idempotent (PUT, DELETE, ...) is retried like a single idempotent request.
+
+    Returns:
+        list: The response entries, in the same order as `entries`.
+    """
+    bundle = {"resourceType": "Bundle", "type": bundle_type, "entry": entries}
+    extra_time = len(entries) * FHIR_BUNDLE_ENTRY_TIMEOUT
+    response = fhir_request(
+        "POST",
+        "",
+        deadline=FHIR_REQUEST_DEADLINE + extra_time,
+        idempotent=all(
+            entry["request"]["method"] in IDEMPOTENT_METHODS for entry in entries
+        ),
+        timeout=FHIR_READ_TIMEOUT + extra_time,
+        headers={"Content-Type": "application/fhir+json"},
+        content=json.dumps(bundle),
+    )
+    print(f"🔍 FHIR {bundle_type} Bundle Response:", response.status_code)
+
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=500,
+            detail=f"FHIR {bundle_type} failed ({response.status_code}): {response.text}",
+        )
+
+    return response.json().get("entry", [])
+
+
+def id_from_location(location: str):
+    """Extracts the resource id from a location such as `Observation/123/_history/1`."""
+    return location.split("/_history")[0].rstrip("/").split("/")[-1]
+
+
+def put_fhir_resources(resources: list, bundle_type: str = "batch"):
+    """
+    Creates or updates resources with client-assigned ids in a single Bundle of PUTs.
+    PUTs are idempotent, so failed resources can simply be sent again.
+
+    Args:
+        resources (list): FHIR resources, each with `resourceType` and `id`.
+        bundle_type (str): "batch" (resources succeed independently) or "transaction"
+            (all of them are written or none).
+
+    Returns:
+        list: For each resource, None if it was written, else an error message.
+    """
+    entries = [
+        {
+            "fullUrl": f"{resource['resourceType']}/{resource['id']}",
+            "resource": resource,
+            "request": {
+                "method": "PUT",
+                "url": f"{resource['resourceType']}/{resource['id']}",
+            },
+        }
+        for resource in resources
+    ]
+    try:
+        response_entries = post_fhir_bundle(entries, bundle_type)
+    except HTTPException as e:
+        return [str(e.detail)] * len(resources)
+
+    errors = []
+    for resource, entry in zip(resources, response_entries + [{}] * len(resources)):
+        if resource["resourceType"] == "Patient":
+            patient_cache.invalidate(resource["id"])
+        else:
+            observation_cache.invalidate(resource["id"])
+
+        status = entry.get("response", {}).get("status", "")
+        errors.append(
+            None
+            if status.startswith("2")
+            else f"Failed to write {resource['resourceType']}/{resource['id']}: {status or 'no response'}"
+        )
+    return errors
+
+
+def delete_fhir_resources(resources: list):
+    """
+    Deletes resources in a single batch Bundle. Resources that are already gone count as deleted.
+
+    Returns:
+        list: For each resource, None if it was deleted, else an error message.
+    """
+    entries = [
+        {
+            "request": {
+                "method": "DELETE",
+                "url": f"{resource['resourceType']}/{resource['id']}",
+            }
         }
+        for resource in resources
+    ]
+    try:
+        response_entries = post_fhir_bundle(entries, "batch")
+    except HTTPException as e:
+        return [str(e.detail)] * len(resources)
 
-        # ✅ Only add reference range if it's valid
-        if reference_range:
-            observation_resource["referenceRange"] = [reference_range]
+    errors = []
+    for resource, entry in zip(resources, response_entries + [{}] * len(resources)):
+        patient_cache.invalidate(resource["id"])
+        observation_cache.invalidate(resource["id"])
 
-        fhir_observations.append(observation_resource)
+        status = entry.get("response", {}).get("status", "")
+        errors.append(
+            None
+            if status.startswith(("2", "404", "410"))
+            else f"Failed to delete {resource['resourceType']}/{resource['id']}: {status or 'no response'}"
+        )
+    return errors
+
+
+def send_lab_results_to_fhir(
+    lab_tests: list,
+    patient_fhir_id: str,
+    date: str,
+    bundle_type: str | None = FHIR_LAB_SET_BUNDLE_TYPE,
+):
+    """
+    Creates the Observations of a lab set in FHIR.
+
+    By default the whole set is sent as one transaction Bundle, so it is written in a single
+    round trip and either fully created or not at all. With `bundle_type="batch"` entries
+    succeed or fail independently; with `bundle_type=None` each Observation is POSTed on its own.
+
+    Args:
+        lab_tests (list): Extracted lab tests (name, value, unit, reference_range).
+        patient_fhir_id (str): The FHIR ID of the patient.
+        date (str): The date the tests were performed.
+        bundle_type (str | None): "transaction", "batch" or None.
+
+    Returns:
+        list: The created Observations (with their FHIR `id`), in the order of `lab_tests`.
+            Failed entries are returned as `{"error": ...}`.
+    """
+    fhir_observations = [
+        build_lab_observation(test, patient_fhir_id, date) for test in lab_tests
+    ]
 
     # ✅ Debug: Print observations before sending
     print(
         "🔍 Observations being sent to FHIR:", json.dumps(fhir_observations, indent=2)
     )
 
-    # Send each Observation to the FHIR server
+    if not bundle_type:
+        return _post_observations_individually(fhir_observations)
+
+    entries = [
+        {
+            "fullUrl": f"urn:uuid:{uuid4()}",
+            "resource": obs,
+            "request": {"method": "POST", "url": "Observation"},
+        }
+        for obs in fhir_observations
+    ]
+    response_entries = post_fhir_bundle(entries, bundle_type)
+
+    # Map Bundle.entry[].response.location back onto the submitted resources
+    responses = []
+    for obs, entry in zip(fhir_observations, response_entries):
+        entry_response = entry.get("response", {})
+        status = entry_response.get("status", "")
+        location = entry_response.get("location")
+
+        if status.startswith("2") and (location or "resource" in entry):
+            created = entry.get("resource") or {
+                **obs,
+                "id": id_from_location(location),
+            }
+            responses.append(created)
+        else:
+            responses.append(
+                {
+                    "error": f"Failed to create Observation {obs['code']['text']}: {status}",
+                    "outcome": entry_response.get("outcome"),
+                }
+            )
+
+    return responses
+
+
+def _post_observations_individually(fhir_observations: list):
+    """Fallback path: POSTs each Observation separately."""
+    headers = {"Content-Type": "application/fhir+json"}
     responses = []
     for obs in fhir_observations:
-        response = requests.post(
-            f"{FHIR_SERVER_URL}/Observation", headers=headers, data=json.dumps(obs)
+        response = fhir_request(
+            "POST", "/Observation", headers=headers, content=json.dumps(obs)
         )
         # ✅ Print actual FHIR response
         print("🔍 FHIR Response:", response.status_code, response.text)
@@ -178,34 +838,124 @@ def send_lab_results_to_fhir(lab_tests: list, patient_fhir_id: str, date: str):
     return responses
 
 
-def get_fhir_observations(observation_ids: list):
+def iter_fhir_search(resource_type: str, params: dict):
+    """
+    Runs a FHIR search and yields every matching resource, following `next` links across pages.
+
+    Args:
+        resource_type (str): The resource type to search, e.g. "Observation".
+        params (dict): Search parameters.
+
+    Yields:
+        dict: Matching resources, page by page.
+    """
+    response = fhir_request("GET", f"/{resource_type}", params=params)
+
+    while True:
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=500,
+                detail=f"FHIR search failed ({response.status_code}): {response.text}",
+            )
+
+        bundle = response.json()
+        for entry in bundle.get("entry", []):
+            # Skip included resources and OperationOutcomes
+            if entry.get("search", {}).get("mode", "match") == "match":
+                yield entry["resource"]
+
+        next_url = next(
+            (
+                link["url"]
+                for link in bundle.get("link", [])
+                if link.get("relation") == "next"
+            ),
+            None,
+        )
+        if not next_url:
+            return
+        response = fhir_request("GET", next_url)
+
+
+def _chunk_ids(ids: list, max_length: int = FHIR_MAX_ID_PARAM_LENGTH):
+    """Splits IDs into chunks whose URL-encoded `_id=a,b,c` value stays under `max_length`."""
+    chunks, current, length = [], [], 0
+    for resource_id in ids:
+        cost = len(quote(resource_id, safe="")) + 3  # 3 chars for the encoded comma
+        if current and length + cost > max_length:
+            chunks.append(current)
+            current, length = [], 0
+        current.append(resource_id)
+        length += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _version_etag(resource: dict):
+    """Builds the weak ETag FHIR servers use for a resource version, e.g. W/"1"."""
+    version_id = resource.get("meta", {}).get("versionId")
+    return f'W/"{version_id}"' if version_id else None
+
+
+def get_observation_cache_stats():
+    """Returns size and hit/miss counters of the Observation read cache."""
+    return observation_cache.stats()
+
+
+def get_fhir_observations(observation_ids: list, refresh: bool = False):
     """
     Fetches full Observation details from the FHIR server using IDs.
+    Fresh entries are served from the Observation cache; the rest are looked up in batches
+    with `Observation?_id=a,b,c` searches instead of one GET each.
 
     Args:
         observation_ids (list): List of Observation IDs.
+        refresh (bool): If True, skips the cache and reads every Observation from FHIR.
 
     Returns:
-        list: List of full Observation resources.
+        list: List of full Observation resources, in the order of `observation_ids`.
+            IDs that could not be found are returned as `{"error": ...}` markers.
     """
-    full_observations = []
-
-    for obs_id in observation_ids:
-        response = requests.get(f"{FHIR_SERVER_URL}/Observation/{obs_id}")
+    found = {}
+    to_fetch = []
 
-        if response.status_code == 200:
-            full_observations.append(response.json())
+    for obs_id in dict.fromkeys(observation_ids):
+        cached, fresh = (None, False) if refresh else observation_cache.get(obs_id)
+        if fresh:
+            found[obs_id] = cached
         else:
-            full_observations.append(
-                {"error": f"Observation {obs_id} not found in FHIR."}
-            )
+            to_fetch.append(obs_id)
+
+    for chunk in _chunk_ids(to_fetch):
+        params = {
+            "_id": ",".join(chunk),
+            "_count": min(len(chunk), FHIR_SEARCH_PAGE_SIZE),
+        }
+        try:
+            for resource in iter_fhir_search("Observation", params):
+                found[resource["id"]] = resource
+                observation_cache.set(resource["id"], resource)
+        except HTTPException as e:
+            if e.status_code in [503, 504]:
+                raise
+            print(f"FHIR batched Observation read failed: {e.detail}")
 
-    return full_observations
+    return [
+        (
+            deepcopy(found[obs_id])
+            if obs_id in found
+            else {"error": f"Observation {obs_id} not found in FHIR."}
+        )
+        for obs_id in observation_ids
+    ]
 
 
 def get_fhir_observation(observation_id: str):
     """
     Fetches single Observation details from the FHIR server using ID.
+    Served from the Observation cache when fresh; stale entries are revalidated
+    with `If-None-Match` against their `meta.versionId`.
 
     Args:
         observation_id: str.
@@ -213,36 +963,44 @@ def get_fhir_observation(observation_id: str):
     Returns:
         Observation resources
     """
+    cached, fresh = observation_cache.get(observation_id)
+    if fresh:
+        return deepcopy(cached)
+
+    headers = {}
+    if cached is not None and _version_etag(cached):
+        headers["If-None-Match"] = _version_etag(cached)
+
     try:
-        response = requests.get(f"{FHIR_SERVER_URL}/Observation/{observation_id}")
+        response = fhir_request(
+            "GET", f"/Observation/{observation_id}", headers=headers
+        )
 
-        if response.status_code == 200:
-            return response.json()
+        if response.status_code == 304 and cached is not None:
+            observation_cache.mark_revalidated(observation_id)
+            return deepcopy(cached)
+        elif response.status_code == 200:
+            observation = response.json()
+            observation_cache.set(observation_id, observation)
+            return deepcopy(observation)
         else:
+            observation_cache.invalidate(observation_id)
             return None
 
-    except HTTPException as e:
+    except httpx.HTTPError as e:
         return {"error": f"Error fetching Observation {observation_id}: {e}"}
 
 
-def remove_fhir_observation(observation_id: str):
-    """
-    Deletes a specific Observation from the FHIR server.
-
-    Args:
-        observation_id (str): The FHIR ID of the Observation to delete.
-
-    Returns:
-        dict: FHIR server response.
-    """
-    response = requests.delete(f"{FHIR_SERVER_URL}/Observation/{observation_id}")
+def _observation_delete_result(observation_id: str, response: httpx.Response):
+    """Turns the FHIR response to an Observation DELETE into the result returned to callers."""
     print("🔍 FHIR Response:", response.status_code, response.text)
+    observation_cache.invalidate(observation_id)
 
     if response.status_code in [200, 204, 410]:  # ✅ 410 means already deleted
         return {"message": f"Observation {observation_id} deleted successfully."}
 
     # ✅ Check for Lucene indexing error (more general detection)
-    if "Indexing failure" in response.text or "HSEARCH700124" in response.text:
+    if _is_indexing_failure(response.text):
         return {
             "message": f"Observation {observation_id} deleted successfully, but FHIR indexing failed.",
             "warning": "This is an issue with the HAPI FHIR public server, not your API.",
@@ -254,58 +1012,165 @@ def remove_fhir_observation(observation_id: str):
     }
 
 
-def remove_all_observations_for_patient(patient_fhir_id: str):
+def remove_fhir_observation(observation_id: str):
+    """
+    Deletes a specific Observation from the FHIR server.
+
+    Args:
+        observation_id (str): The FHIR ID of the Observation to delete.
+
+    Returns:
+        dict: FHIR server response.
+    """
+    response = fhir_request("DELETE", f"/Observation/{observation_id}")
+    return _observation_delete_result(observation_id, response)
+
+
+async def remove_fhir_observation_async(observation_id: str):
+    """Async counterpart of `remove_fhir_observation`."""
+    response = await fhir_request_async("DELETE", f"/Observation/{observation_id}")
+    return _observation_delete_result(observation_id, response)
+
+
+async def remove_fhir_observations_async(
+    observation_ids: list, concurrency: int = FHIR_DELETE_CONCURRENCY
+):
+    """
+    Deletes several Observations concurrently, with at most `concurrency` requests in flight.
+
+    Args:
+        observation_ids (list): The FHIR IDs of the Observations to delete.
+        concurrency (int): Maximum number of concurrent DELETE requests.
+
+    Returns:
+        list: One result per ID (as returned by `remove_fhir_observation`), in input order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def remove(observation_id: str):
+        async with semaphore:
+            try:
+                return await remove_fhir_observation_async(observation_id)
+            except HTTPException as e:
+                return {
+                    "error": f"Failed to delete Observation {observation_id}. {e.detail}"
+                }
+
+    return await asyncio.gather(*(remove(obs_id) for obs_id in observation_ids))
+
+
+def _is_indexing_failure(text: str):
+    """Detects HAPI's Lucene indexing errors, reported even though the delete went through."""
+    return "Indexing failure" in text or "HSEARCH700124" in text
+
+
+def _observation_delete_outcome(obs_id: str, status_code: int, text: str):
+    """
+    Classifies the result of deleting one Observation.
+
+    Returns:
+        tuple: (deleted, warning) where warning is None for a clean delete.
+    """
+    if status_code in [200, 204, 410]:  # ✅ Treat "already deleted" as success
+        return True, None
+    if _is_indexing_failure(text):
+        # ✅ Handle HAPI FHIR's Lucene indexing issue gracefully
+        return True, f"Observation {obs_id} deleted, but FHIR indexing failed."
+    return False, f"Failed to delete Observation {obs_id}. Response: {text}"
+
+
+def _delete_observation_chunk(obs_ids: list):
+    """
+    Deletes a chunk of Observations with one batch Bundle of DELETE entries.
+    Falls back to one DELETE per Observation if the server rejects the Bundle.
+    """
+    entries = [
+        {"request": {"method": "DELETE", "url": f"Observation/{obs_id}"}}
+        for obs_id in obs_ids
+    ]
+    try:
+        response_entries = post_fhir_bundle(entries, "batch")
+    except HTTPException as e:
+        print(f"Batch delete rejected, deleting one by one: {e.detail}")
+        outcomes = []
+        for obs_id in obs_ids:
+            response = fhir_request("DELETE", f"/Observation/{obs_id}")
+            outcomes.append(
+                _observation_delete_outcome(obs_id, response.status_code, response.text)
+            )
+        return list(zip(obs_ids, outcomes))
+
+    outcomes = []
+    for index, obs_id in enumerate(obs_ids):
+        entry_response = (
+            response_entries[index].get("response", {})
+            if index < len(response_entries)
+            else {}
+        )
+        status = entry_response.get("status", "")
+        status_code = int(status.split()[0]) if status[:3].isdigit() else 0
+        outcomes.append(
+            _observation_delete_outcome(
+                obs_id, status_code, json.dumps(entry_response.get("outcome", {}))
+            )
+        )
+    return list(zip(obs_ids, outcomes))
+
+
+def remove_all_observations_for_patient(patient_fhir_id: str, on_progress=None):
     """
     Deletes all Observations linked to a specific patient in FHIR.
 
+    Every page of the search is walked (fetching IDs only), then the Observations are deleted
+    in batch Bundles of FHIR_DELETE_BATCH_SIZE, with up to FHIR_DELETE_CONCURRENCY in flight.
+
     Args:
         patient_fhir_id (str): The FHIR ID of the patient.
+        on_progress (callable, optional): Called after each Bundle with the number of
+            Observations deleted so far and the total found.
 
     Returns:
         dict: Summary of deleted observations.
     """
-    # Step 1: Search for all Observations linked to the patient
-    search_response = requests.get(
-        f"{FHIR_SERVER_URL}/Observation?subject=Patient/{patient_fhir_id}"
-    )
-
-    if search_response.status_code != 200:
+    # Step 1: Collect the IDs of all Observations linked to the patient, across all pages
+    try:
+        observation_ids = [
+            resource["id"]
+            for resource in iter_fhir_search(
+                "Observation",
+                {
+                    "subject": f"Patient/{patient_fhir_id}",
+                    "_elements": "id",
+                    "_count": FHIR_SEARCH_PAGE_SIZE,
+                },
+            )
+        ]
+    except HTTPException as e:
         return {
-            "error": f"Failed to retrieve Observations for Patient {patient_fhir_id}. Response: {search_response.text}"
+            "error": f"Failed to retrieve Observations for Patient {patient_fhir_id}. Response: {e.detail}"
         }
 
-    observations = search_response.json().get("entry", [])
-
-    if not observations:  # ✅ Correctly return if no observations were found
+    if not observation_ids:  # ✅ Correctly return if no observations were found
         return {"message": f"No Observations found for Patient {patient_fhir_id}."}
 
-    # Step 2: Delete each found Observation
+    # Step 2: Delete the found Observations in concurrent batches
+    chunks = [
+        observation_ids[i : i + FHIR_DELETE_BATCH_SIZE]
+        for i in range(0, len(observation_ids), FHIR_DELETE_BATCH_SIZE)
+    ]
     deleted_observations = []
     indexing_warnings = []
 
-    for obs in observations:
-        obs_id = obs["resource"]["id"]
-        delete_response = requests.delete(f"{FHIR_SERVER_URL}/Observation/{obs_id}")
-
-        if delete_response.status_code in [
-            200,
-            204,
-            410,
-        ]:  # ✅ Treat "already deleted" as success
-            deleted_observations.append(obs_id)
-        elif (
-            "Indexing failure" in delete_response.text
-            or "HSEARCH700124" in delete_response.text
-        ):
-            # ✅ Handle HAPI FHIR's Lucene indexing issue gracefully
-            deleted_observations.append(obs_id)
-            indexing_warnings.append(
-                f"Observation {obs_id} deleted, but FHIR indexing failed."
-            )
-        else:
-            indexing_warnings.append(
-                f"Failed to delete Observation {obs_id}. Response: {delete_response.text}"
-            )
+    with ThreadPoolExecutor(max_workers=FHIR_DELETE_CONCURRENCY) as executor:
+        for chunk_outcomes in executor.map(_delete_observation_chunk, chunks):
+            for obs_id, (deleted, warning) in chunk_outcomes:
+                observation_cache.invalidate(obs_id)
+                if deleted:
+                    deleted_observations.append(obs_id)
+                if warning:
+                    indexing_warnings.append(warning)
+            if on_progress:
+                on_progress(len(deleted_observations), len(observation_ids))
 
     # ✅ Format the response with all successful and failed deletions
     response_data = {
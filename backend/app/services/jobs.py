@@ -0,0 +1,128 @@
+import threading
+from app.config import (
+    JOB_WORKER_CONCURRENCY,
+    JOB_POLL_INTERVAL,
+    JOB_LEASE,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE_DELAY,
+    JOB_RETRY_MAX_DELAY,
+)
+from app.models.job import (
+    create_job,
+    claim_job,
+    update_job_progress,
+    checkpoint_job,
+    finish_job,
+    retry_job,
+    fail_job,
+)
+
+# Job type -> list of (step name, step function), run in order
+JOB_HANDLERS = {}
+
+
+def register_job(job_type: str, steps: list):
+    """
+    Registers the steps of a job type.
+
+    Each step is called as `step(job, report)`, where `report(**values)` records progress
+    (kept in `job["progress"]` across resumes). Steps must be safe to run again: a job
+    resumed after a crash re-runs the step that was interrupted. The last step's return
+    value becomes the job result.
+
+    Args:
+        job_type (str): The job type, e.g. "delete_patient".
+        steps (list): (name, function) pairs.
+    """
+    JOB_HANDLERS[job_type] = steps
+
+
+def submit_job(job_type: str, params: dict, created_by: str):
+    """Queues a job of a registered type and returns it."""
+    steps = [name for name, _ in JOB_HANDLERS[job_type]]
+    return create_job(job_type, params, steps, created_by)
+
+
+def _retry_delay(attempts: int):
+    """Exponential backoff between attempts of the same job."""
+    return min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def run_job(job: dict):
+    """
+    Runs the remaining steps of a claimed job, checkpointing after each one. A failed
+    job is retried from the failed step, with backoff, up to JOB_MAX_ATTEMPTS times.
+    """
+    progress = job["progress"]
+
+    def report(**values):
+        progress.update(values)
+        update_job_progress(job["id"], values, JOB_LEASE)
+
+    result = None
+    try:
+        for name, step in JOB_HANDLERS[job["type"]]:
+            if name in job["completed_steps"]:
+                continue
+            report(current_step=name)
+            result = step(job, report)
+            checkpoint_job(job["id"], name, JOB_LEASE)
+    except Exception as e:
+        if job["attempts"] < JOB_MAX_ATTEMPTS:
+            delay = _retry_delay(job["attempts"])
+            print(
+                f"⚠️ Job {job['id']} ({job['type']}) failed, retrying in {delay}s: {e}"
+            )
+            retry_job(job["id"], str(e), delay)
+        else:
+            print(f"❌ Job {job['id']} ({job['type']}) failed: {e}")
+            fail_job(job["id"], str(e))
+        return
+
+    finish_job(job["id"], result)
+
+
+class JobWorker:
+    """Pool of background threads that run queued jobs."""
+
+    def __init__(
+        self,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = claim_job(list(JOB_HANDLERS), JOB_LEASE)
+            except Exception as e:
+                print(f"❌ Could not claim a job: {e}")
+                job = None
+
+            if job:
+                run_job(job)
+            else:
+                self._stop.wait(self.poll_interval)
+
+
+job_worker = JobWorker()
@@ -0,0 +1,102 @@
+from itertools import islice
+from app.services.fhir import get_fhir_observations
+from app.models.lab_test_set import (
+    has_snapshot,
+    observation_snapshot,
+    snapshot_to_observation,
+    update_lab_test_set,
+    iter_lab_test_sets_without_snapshots,
+)
+
+
+def _store_snapshots(lab_test_set: dict, full_observations: list):
+    """
+    Writes fresh snapshots back to a lab test set. Observations that could not be
+    read from FHIR keep their stored entry.
+    """
+    observations = [
+        (
+            observation_snapshot(full)
+            if "error" not in full and "text" in full.get("code", {})
+            else stored
+        )
+        for stored, full in zip(lab_test_set["observations"], full_observations)
+    ]
+    if observations != lab_test_set["observations"]:
+        update_lab_test_set(lab_test_set["id"], {"observations": observations})
+        lab_test_set["observations"] = observations
+
+
+def resolve_lab_set_observations(lab_test_sets: list, refresh: bool = False):
+    """
+    Returns the full observations of each lab test set.
+
+    Sets whose observations all carry a snapshot are served from MongoDB. The others
+    (stored before snapshots existed), or every set when `refresh` is True, are read
+    from FHIR with one batched read and their snapshots are updated.
+
+    Args:
+        lab_test_sets (list): Lab test sets from MongoDB, with a string `id`.
+        refresh (bool): If True, reads everything from FHIR.
+
+    Returns:
+        list: For each lab test set, its observations as FHIR Observation resources
+            (or `{"error": ...}` markers for those missing from FHIR).
+    """
+    resolved = [None] * len(lab_test_sets)
+    to_fetch = []
+
+    for index, test_set in enumerate(lab_test_sets):
+        observations = test_set.get("observations", [])
+        if not refresh and all(has_snapshot(obs) for obs in observations):
+            resolved[index] = [
+                snapshot_to_observation(
+                    obs, test_set["patient_fhir_id"], test_set["test_date"]
+                )
+                for obs in observations
+            ]
+        else:
+            to_fetch.append(index)
+
+    if to_fetch:
+        observation_ids = [
+            obs["id"]
+            for index in to_fetch
+            for obs in lab_test_sets[index].get("observations", [])
+        ]
+        full_observations = get_fhir_observations(observation_ids, refresh=refresh)
+
+        offset = 0
+        for index in to_fetch:
+            test_set = lab_test_sets[index]
+            count = len(test_set.get("observations", []))
+            resolved[index] = full_observations[offset : offset + count]
+            offset += count
+            _store_snapshots(test_set, resolved[index])
+
+    return resolved
+
+
+def backfill_observation_snapshots(batch_size: int = 50):
+    """
+    Adds value snapshots to lab test sets stored before snapshots existed,
+    reading their observations from FHIR one batch of sets at a time.
+
+    Args:
+        batch_size (int): Number of lab test sets per batched FHIR read.
+
+    Yields:
+        dict: Progress after each batch (sets processed, sets still incomplete).
+    """
+    progress = {"processed": 0, "incomplete": 0}
+    lab_test_sets = iter_lab_test_sets_without_snapshots(batch_size)
+
+    while batch := list(islice(lab_test_sets, batch_size)):
+        resolve_lab_set_observations(batch)
+        progress["processed"] += len(batch)
+        progress["incomplete"] += sum(
+            1
+            for test_set in batch
+            if not all(has_snapshot(obs) for obs in test_set["observations"])
+        )
+        yield dict(progress)
@@ -0,0 +1,123 @@
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.utils.file_parser import extract_pages
+from app.services.openai import extract_lab_results_with_gpt, interpret_full_lab_set
+from app.services.fhir import new_fhir_id, build_lab_observation
+from app.services.jobs import register_job
+from app.services.lab_sets import resolve_lab_set_observations
+from app.models.lab_upload import get_lab_upload, update_lab_upload, remove_lab_upload
+from app.models.lab_test_set import (
+    store_lab_test_set,
+    get_lab_test_set_by_id,
+    update_lab_test_set,
+)
+
+PROCESS_LAB_UPLOAD_JOB = "process_lab_upload"
+INTERPRET_LAB_TEST_SET_JOB = "interpret_lab_test_set"
+
+
+def build_upload_observations(lab_results: list, patient_fhir_id: str, test_date: str):
+    """Builds the Observations of extracted lab results, with their FHIR IDs assigned up front."""
+    return [
+        {
+            **build_lab_observation(test, patient_fhir_id, test_date),
+            "id": new_fhir_id(),
+        }
+        for test in lab_results
+    ]
+
+
+def _upload(job: dict):
+    upload = get_lab_upload(job["params"]["upload_id"])
+    if not upload:
+        raise RuntimeError("Uploaded file not found (expired or already processed)")
+    return upload
+
+
+def _extract_text(job: dict, report):
+    """Extracts the text of each page of the uploaded file (OCR)."""
+    upload = _upload(job)
+    pages = extract_pages(upload["filename"], upload["contents"])
+    update_lab_upload(job["params"]["upload_id"], {"pages": pages})
+    report(pages=len(pages), text_length=sum(len(page) for page in pages))
+
+
+def _extract_lab_results(job: dict, report):
+    """Extracts the lab results from the text with GPT and builds their Observations."""
+    params = job["params"]
+    upload = _upload(job)
+    # Uploads whose text was extracted before pages were kept have a single text
+    lab_results = extract_lab_results_with_gpt(upload.get("pages") or upload["text"])
+    observations = build_upload_observations(
+        lab_results, params["patient_fhir_id"], params["test_date"]
+    )
+    update_lab_upload(params["upload_id"], {"observations": observations})
+    report(lab_results_found=len(observations))
+
+
+def _store_lab_test_set(job: dict, report):
+    """
+    Stores the lab test set (under the upload's ID, so a retry cannot store it twice)
+    and queues its Observations for FHIR, then drops the upload.
+    """
+    params = job["params"]
+    upload_id = params["upload_id"]
+    if not get_lab_test_set_by_id(upload_id):
+        try:
+            result = store_lab_test_set(
+                patient_fhir_id=params["patient_fhir_id"],
+                test_date=params["test_date"],
+                observations=_upload(job)["observations"],
+                sync_to_fhir=True,
+                lab_test_set_id=ObjectId(upload_id),
+            )
+        except DuplicateKeyError:
+            result = {}
+        if "error" in result:
+            raise RuntimeError(result["error"])
+
+    remove_lab_upload(upload_id)
+    report(lab_test_set_id=upload_id)
+    return get_lab_test_set_by_id(upload_id)
+
+
+def _interpret(job: dict, report):
+    """Generates the interpretation of a lab test set and stores it."""
+    lab_test_set_id = job["params"]["lab_test_set_id"]
+    lab_test_set = get_lab_test_set_by_id(lab_test_set_id)
+    if not lab_test_set:
+        raise RuntimeError("Lab test set not found.")
+
+    full_lab_tests = resolve_lab_set_observations(
+        [lab_test_set], job["params"].get("refresh", False)
+    )[0]
+    if not full_lab_tests:
+        raise RuntimeError("No lab test results found in FHIR.")
+
+    interpretation = interpret_full_lab_set(
+        full_lab_tests,
+        lab_test_set.get("birth_date", "Unknown"),
+        lab_test_set.get("gender", "Unknown"),
+        raise_errors=True,
+    )
+    update_result = update_lab_test_set(
+        lab_test_set_id, {"interpretation": interpretation}
+    )
+    if "error" in update_result:
+        raise RuntimeError(update_result["error"])
+    return {
+        "message": f"Interpretation added to lab test set {lab_test_set_id}",
+        "interpretation": interpretation,
+    }
+
+
+register_job(
+    PROCESS_LAB_UPLOAD_JOB,
+    [
+        ("extract_text", _extract_text),
+        ("extract_lab_results", _extract_lab_results),
+        ("store_lab_test_set", _store_lab_test_set),
+    ],
+)
+
+register_job(INTERPRET_LAB_TEST_SET_JOB, [("interpret", _interpret)])
@@ -1,12 +1,100 @@
 import re
-from openai import OpenAI
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from datetime import datetime
 import json
-from app.config import GITHUB_TOKEN
-from app.utils.file_parser import clean_reference_range
-
-
-def interpret_full_lab_set(lab_tests: list, birth_date: str, gender: str):
+from app.config import (
+    GITHUB_TOKEN,
+    OPENAI_BASE_URL,
+    OPENAI_MODEL,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_READ_TIMEOUT,
+    OPENAI_MAX_RETRIES,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_EXTRACTION_CHUNK_TOKENS,
+    OPENAI_EXTRACTION_CONCURRENCY,
+)
+from app.utils.file_parser import clean_reference_range, split_ocr_text
+from app.models.interpretation_cache import (
+    get_cached_interpretation,
+    get_cached_interpretation_async,
+    cache_interpretation,
+    cache_interpretation_async,
+)
+
+OPENAI_TIMEOUT = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+OPENAI_LIMITS = httpx.Limits(
+    max_connections=OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+)
+
+# ✅ Shared clients, created on first use: connections (and TLS sessions) to the
+# inference endpoint are pooled and reused across calls
+_openai_client = None
+_async_openai_client = None
+_openai_clients_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Returns the shared sync OpenAI client."""
+    global _openai_client
+    with _openai_clients_lock:
+        if _openai_client is None:
+            _openai_client = OpenAI(
+                base_url=OPENAI_BASE_URL,
+                api_key=GITHUB_TOKEN,
+                timeout=OPENAI_TIMEOUT,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultHttpxClient(limits=OPENAI_LIMITS),
+            )
+        return _openai_client
+
+
+def get_async_openai_client():
+    """Returns the shared AsyncOpenAI client."""
+    global _async_openai_client
+    with _openai_clients_lock:
+        if _async_openai_client is None:
+            _async_openai_client = AsyncOpenAI(
+                base_url=OPENAI_BASE_URL,
+                api_key=GITHUB_TOKEN,
+                timeout=OPENAI_TIMEOUT,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultAsyncHttpxClient(limits=OPENAI_LIMITS),
+            )
+        return _async_openai_client
+
+
+async def close_openai_clients():
+    """Closes the shared OpenAI clients that were created (app shutdown)."""
+    global _openai_client, _async_openai_client
+    with _openai_clients_lock:
+        client, async_client = _openai_client, _async_openai_client
+        _openai_client = _async_openai_client = None
+    if client:
+        client.close()
+    if async_client:
+        await async_client.close()
+
+
+def _chat_request(prompt: str):
+    """Arguments of a chat completion for a single-prompt conversation."""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 4096,
+        "temperature": 0.2,  # Lower temperature for a more factual, deterministic response
+    }
+
+
+def interpret_full_lab_set(
+    lab_tests: list, birth_date: str, gender: str, raise_errors: bool = False
+):
     """
     Uses OpenAI to generate an overall interpretation for the full lab test set.
 
@@ -16,16 +104,93 @@ def interpret_full_lab_set(lab_tests: list, birth_date: str, gender: str):
             - value (float): Test result value
             - unit (str): Measurement unit
             - reference_range (str, optional): Normal reference range
+        raise_errors (bool): If True, a failed model call raises instead of returning
+            an error message (used by background jobs, which retry).
 
     Returns:
-        str: AI-generated interpretation.
+        str: AI-generated interpretation. Interpretations of identical inputs are
+            served from the interpretation cache without calling the model.
     """
-    if not GITHUB_TOKEN:
-        raise ValueError(
-            "Missing Github Token. Set GITHUB_TOKEN as an environment variable."
+    prompt = _interpretation_prompt(lab_tests, birth_date, gender)
+    cache_key = interpretation_cache_key(lab_tests, birth_date, gender)
+    cached = get_cached_interpretation(cache_key)
+    if cached:
+        return cached
+
+    try:
+        response = get_openai_client().chat.completions.create(**_chat_request(prompt))
+        interpretation = response.choices[0].message.content.strip()
+
+    except Exception as e:
+        if raise_errors:
+            raise
+        return f"Error generating interpretation: {str(e)}"
+
+    cache_interpretation(cache_key, interpretation, OPENAI_MODEL)
+    return interpretation
+
+
+async def interpret_full_lab_set_async(lab_tests: list, birth_date: str, gender: str):
+    """Awaitable version of `interpret_full_lab_set`, for async route handlers."""
+    prompt = _interpretation_prompt(lab_tests, birth_date, gender)
+    cache_key = interpretation_cache_key(lab_tests, birth_date, gender)
+    cached = await get_cached_interpretation_async(cache_key)
+    if cached:
+        return cached
+
+    try:
+        response = await get_async_openai_client().chat.completions.create(
+            **_chat_request(prompt)
         )
+        interpretation = response.choices[0].message.content.strip()
 
-    # ✅ Extract relevant lab test details from FHIR Observations
+    except Exception as e:
+        return f"Error generating interpretation: {str(e)}"
+
+    await cache_interpretation_async(cache_key, interpretation, OPENAI_MODEL)
+    return interpretation
+
+
+def stream_full_lab_set_interpretation(lab_tests: list, birth_date: str, gender: str):
+    """
+    Streaming version of `interpret_full_lab_set`: returns an async iterator over the
+    interpretation text as the model generates it (`stream=True`). A cached
+    interpretation is yielded at once. Once the stream completes, the full text is
+    cached.
+
+    Raises:
+        ValueError: If the API token is missing (before anything is streamed).
+    """
+    prompt = _interpretation_prompt(lab_tests, birth_date, gender)
+    cache_key = interpretation_cache_key(lab_tests, birth_date, gender)
+    return _stream_interpretation(prompt, cache_key)
+
+
+async def _stream_interpretation(prompt: str, cache_key: str):
+    cached = await get_cached_interpretation_async(cache_key)
+    if cached:
+        yield cached
+        return
+
+    stream = await get_async_openai_client().chat.completions.create(
+        **_chat_request(prompt), stream=True
+    )
+    parts = []
+    async for chunk in stream:
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            parts.append(text)
+            yield text
+
+    await cache_interpretation_async(cache_key, "".join(parts).strip(), OPENAI_MODEL)
+
+
+# Bump whenever the interpretation prompt changes, so older cached interpretations are not reused
+INTERPRETATION_PROMPT_VERSION = 1
+
+
+def _extract_tests(lab_tests: list):
+    """The details of each FHIR Observation that the interpretation is based on."""
     extracted_tests = []
     for obs in lab_tests:
         if "resourceType" in obs and obs["resourceType"] == "Observation":
@@ -39,6 +204,37 @@ def interpret_full_lab_set(lab_tests: list, birth_date: str, gender: str):
                     .get("value", "N/A"),
                 }
             )
+    return extracted_tests
+
+
+def interpretation_cache_key(lab_tests: list, birth_date: str, gender: str):
+    """
+    Stable hash of everything an interpretation depends on: the tests (in any order),
+    the patient's age as given to the model, gender, model and prompt version.
+    """
+    inputs = {
+        "tests": sorted(
+            _extract_tests(lab_tests),
+            key=lambda test: json.dumps(test, sort_keys=True, default=str),
+        ),
+        "age": calculate_age(birth_date) if birth_date else None,
+        "gender": (gender or "").lower(),
+        "model": OPENAI_MODEL,
+        "prompt_version": INTERPRETATION_PROMPT_VERSION,
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _interpretation_prompt(lab_tests: list, birth_date: str, gender: str):
+    """Builds the interpretation prompt for a full lab test set."""
+    if not GITHUB_TOKEN:
+        raise ValueError(
+            "Missing Github Token. Set GITHUB_TOKEN as an environment variable."
+        )
+
+    # ✅ Extract relevant lab test details from FHIR Observations
+    extracted_tests = _extract_tests(lab_tests)
 
     # ✅ Convert to JSON for AI processing
     lab_results_json = json.dumps(extracted_tests, indent=2)
@@ -91,28 +287,82 @@ def interpret_full_lab_set(lab_tests: list, birth_date: str, gender: str):
     - Ensure your response explicitly acknowledges how gender and age influence the interpretation.
     - Ensure the interpretation is medically informative, neutral in tone, and structured in a clear and professional manner.
     """
+    return prompt
 
-    client = OpenAI(
-        base_url="https://models.inference.ai.azure.com", api_key=GITHUB_TOKEN
-    )
 
+def extract_lab_results_with_gpt(ocr_text: list | str):
+    """
+    Uses OpenAI's GPT to extract structured lab results from OCR-extracted text, given
+    as the text of each page (`extract_pages`) or as a single text.
+
+    Long reports are split into chunks of whole pages (or sections of a page too long on
+    its own) of at most OPENAI_EXTRACTION_CHUNK_TOKENS, extracted concurrently, and merged
+    (see `merge_lab_results`), so latency follows the largest chunk rather than the report.
+    """
+    chunks = split_ocr_text(ocr_text, OPENAI_EXTRACTION_CHUNK_TOKENS)
+    if len(chunks) == 1:
+        return _extract_chunk(chunks[0])
+
+    with ThreadPoolExecutor(max_workers=OPENAI_EXTRACTION_CONCURRENCY) as pool:
+        return merge_lab_results(pool.map(_extract_chunk, chunks))
+
+
+async def extract_lab_results_with_gpt_async(ocr_text: list | str):
+    """Awaitable version of `extract_lab_results_with_gpt`, for async route handlers."""
+    chunks = split_ocr_text(ocr_text, OPENAI_EXTRACTION_CHUNK_TOKENS)
+    if len(chunks) == 1:
+        return await _extract_chunk_async(chunks[0])
+
+    semaphore = asyncio.Semaphore(OPENAI_EXTRACTION_CONCURRENCY)
+
+    async def extract(chunk: str):
+        async with semaphore:
+            return await _extract_chunk_async(chunk)
+
+    return merge_lab_results(await asyncio.gather(*(extract(c) for c in chunks)))
+
+
+def merge_lab_results(chunk_results):
+    """
+    Merges the lab results extracted from each chunk, in order, keeping one result per
+    test name (case-insensitive). A test repeated across chunks (e.g. on a summary
+    page) keeps its first value, and gets a reference range from a later one if needed.
+    """
+    merged = {}
+    for lab_results in chunk_results:
+        for test in lab_results:
+            key = " ".join(str(test.get("name", "")).lower().split())
+            if key not in merged:
+                merged[key] = test
+            elif not merged[key].get("reference_range"):
+                merged[key]["reference_range"] = test.get("reference_range")
+    return list(merged.values())
+
+
+def _extract_chunk(ocr_text: str):
+    prompt = _extraction_prompt(ocr_text)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=4096,
-            temperature=0.2,  # Lower temperature for a more factual, deterministic response
+        ai_response = get_openai_client().chat.completions.create(
+            **_chat_request(prompt)
         )
+    except Exception as e:
+        raise ValueError(f"Error calling OpenAI API: {e}")
+    return _parse_extracted_results(ai_response)
 
-        return response.choices[0].message.content.strip()
 
+async def _extract_chunk_async(ocr_text: str):
+    prompt = _extraction_prompt(ocr_text)
+    try:
+        ai_response = await get_async_openai_client().chat.completions.create(
+            **_chat_request(prompt)
+        )
     except Exception as e:
-        return f"Error generating interpretation: {str(e)}"
-
+        raise ValueError(f"Error calling OpenAI API: {e}")
+    return _parse_extracted_results(ai_response)
 
-def extract_lab_results_with_gpt(ocr_text: str):
-    """Uses OpenAI's GPT to extract structured lab results from OCR-extracted text."""
 
+def _extraction_prompt(ocr_text: str):
+    """Builds the prompt extracting structured lab results from OCR text."""
     if not GITHUB_TOKEN:
         raise ValueError(
             "Missing OpenAI API Key. Set your GITHUB_TOKEN as an environment variable."
@@ -158,18 +408,13 @@ def extract_lab_results_with_gpt(ocr_text: str):
 
     **Extract the structured lab results and return them as JSON:**
     """
+    return prompt
 
-    client = OpenAI(
-        base_url="https://models.inference.ai.azure.com", api_key=GITHUB_TOKEN
-    )
-    try:
-        ai_response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=4096,
-            temperature=0.2,  # Low temperature for more deterministic responses
-        )
 
+def _parse_extracted_results(ai_response):
+    """Parses the extracted lab results out of a chat completion."""
+    result = None
+    try:
         if not ai_response or not ai_response.choices:
             raise ValueError("Received an empty response from OpenAI API.")
 
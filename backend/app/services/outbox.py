@@ -0,0 +1,179 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from app.config import (
+    FHIR_OUTBOX_POLL_INTERVAL,
+    FHIR_OUTBOX_BATCH_SIZE,
+    FHIR_OUTBOX_CONCURRENCY,
+    FHIR_OUTBOX_MAX_ATTEMPTS,
+    FHIR_OUTBOX_RETRY_BASE_DELAY,
+    FHIR_OUTBOX_RETRY_MAX_DELAY,
+    FHIR_OUTBOX_LEASE,
+    FHIR_LAB_SET_BUNDLE_TYPE,
+)
+from app.services.fhir import put_fhir_resources, delete_fhir_resources
+from app.models.outbox import (
+    claim_outbox_entries,
+    complete_outbox_entry,
+    retry_outbox_entry,
+    requeue_expired_outbox_entries,
+    claim_expired_cancelled_outbox_entry,
+    remove_cancelled_outbox_entry,
+    get_outbox_stats,
+)
+
+
+def _retry_delay(attempts: int):
+    """Exponential backoff between attempts of the same entry."""
+    return min(FHIR_OUTBOX_RETRY_MAX_DELAY, FHIR_OUTBOX_RETRY_BASE_DELAY * 2**attempts)
+
+
+def _put_entries(entries: list, bundle_type: str | None):
+    """
+    Writes the resources of claimed entries to FHIR with Bundles of PUTs: one transaction
+    per entry (so a lab set is written all-or-nothing, several in flight at once), or a
+    single batch shared by all entries.
+
+    Returns:
+        list: For each entry, the errors of its resources (None where written).
+    """
+    if bundle_type == "transaction":
+        with ThreadPoolExecutor(max_workers=FHIR_OUTBOX_CONCURRENCY) as executor:
+            return list(
+                executor.map(
+                    lambda entry: put_fhir_resources(entry["resources"], "transaction"),
+                    entries,
+                )
+            )
+
+    resources = [resource for entry in entries for resource in entry["resources"]]
+    errors = iter(put_fhir_resources(resources) if resources else [])
+    return [[next(errors) for _ in entry["resources"]] for entry in entries]
+
+
+def sweep_cancelled_outbox_entries():
+    """
+    Removes from FHIR the resources of entries that were cancelled while a worker that
+    has since died was syncing them, then drops the entries.
+
+    Returns:
+        int: The number of entries swept.
+    """
+    swept = 0
+    while entry := claim_expired_cancelled_outbox_entry(FHIR_OUTBOX_LEASE):
+        errors = [error for error in delete_fhir_resources(entry["resources"]) if error]
+        if errors:
+            # Left in place: swept again once the new lease expires
+            print(f"⚠️ Cancelled FHIR outbox entry {entry['_id']} not swept: {errors[0]}")
+            break
+        remove_cancelled_outbox_entry(entry["_id"])
+        swept += 1
+    return swept
+
+
+def sync_outbox_batch(
+    batch_size: int = FHIR_OUTBOX_BATCH_SIZE,
+    bundle_type: str | None = FHIR_LAB_SET_BUNDLE_TYPE,
+):
+    """
+    Runs one pass of the outbox: claims the next entry of each patient and writes their
+    resources to FHIR with PUTs, each entry in its own transaction Bundle by default (see
+    `_put_entries`). Failed entries are retried later with backoff; entries cancelled
+    while in flight have their resources removed again.
+
+    Returns:
+        dict: Number of entries synced and retried in this pass.
+    """
+    requeue_expired_outbox_entries()
+    sweep_cancelled_outbox_entries()
+    entries = claim_outbox_entries(batch_size, FHIR_OUTBOX_LEASE)
+    entries_errors = _put_entries(entries, bundle_type)
+
+    result = {"synced": 0, "retried": 0}
+    for entry, errors in zip(entries, entries_errors):
+        entry_errors = [error for error in errors if error]
+        if entry_errors:
+            print(f"⚠️ FHIR outbox entry {entry['_id']} failed: {entry_errors[0]}")
+            retry_outbox_entry(
+                entry,
+                "; ".join(entry_errors),
+                _retry_delay(entry["attempts"]),
+                FHIR_OUTBOX_MAX_ATTEMPTS,
+            )
+            result["retried"] += 1
+        elif complete_outbox_entry(entry["_id"]):
+            result["synced"] += 1
+        else:
+            # Its lab set or patient was deleted while the write was in flight
+            delete_fhir_resources(entry["resources"])
+
+    return result
+
+
+class OutboxWorker:
+    """Background thread that drains the FHIR outbox."""
+
+    def __init__(self, poll_interval: float = FHIR_OUTBOX_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.synced = 0
+        self.retried = 0
+        self.errors = 0
+        self.last_run_at = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="fhir-outbox", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = sync_outbox_batch()
+            except HTTPException as e:
+                # FHIR unavailable (circuit open): entries stay queued
+                print(f"⚠️ FHIR outbox pass skipped: {e.detail}")
+                result = {"synced": 0, "retried": 0}
+                self.errors += 1
+            except Exception as e:
+                print(f"❌ FHIR outbox pass failed: {e}")
+                result = {"synced": 0, "retried": 0}
+                self.errors += 1
+
+            self.synced += result["synced"]
+            self.retried += result["retried"]
+            self.last_run_at = time.time()
+
+            # Keep draining while there is work, otherwise wait for the next poll
+            if not result["synced"] and not result["retried"]:
+                self._stop.wait(self.poll_interval)
+
+    def stats(self):
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "synced": self.synced,
+            "retried": self.retried,
+            "errors": self.errors,
+            "seconds_since_last_run": (
+                round(time.time() - self.last_run_at, 3) if self.last_run_at else None
+            ),
+        }
+
+
+outbox_worker = OutboxWorker()
+
+
+def get_outbox_metrics():
+    """Returns the outbox queue depth and lag, and the worker counters."""
+    return {**get_outbox_stats(), "worker": outbox_worker.stats()}
@@ -0,0 +1,81 @@
+from app.services.fhir import (
+    remove_all_observations_for_patient,
+    delete_fhir_patient,
+    get_fhir_patient,
+)
+from app.services.jobs import register_job
+from app.models.outbox import cancel_outbox_entries
+from app.models.lab_test_set import remove_lab_test_sets_for_patient
+from app.models.patient import delete_patient
+
+DELETE_PATIENT_JOB = "delete_patient"
+
+
+def _cancel_pending_writes(job: dict, report):
+    """Drops the patient's writes that haven't reached FHIR yet."""
+    fhir_id = job["params"]["fhir_id"]
+    never_sent = cancel_outbox_entries({"patient_fhir_id": fhir_id})
+    if fhir_id in never_sent:
+        report(in_fhir=False)
+
+
+def _delete_observations(job: dict, report):
+    """Deletes the patient's Observations from FHIR, in concurrent batch Bundles."""
+    if job["progress"].get("in_fhir") is False:
+        return
+
+    # Reporting each Bundle keeps extending the lease of a long deletion
+    result = remove_all_observations_for_patient(
+        job["params"]["fhir_id"],
+        lambda deleted, total: report(
+            observations_deleted=deleted, observations_found=total
+        ),
+    )
+    if "error" in result:
+        raise RuntimeError(
+            f"Failed to delete patient's observations: {result['error']}"
+        )
+    report(
+        observations_deleted=len(result.get("deleted", [])),
+        warnings=result.get("warnings", []),
+    )
+
+
+def _delete_fhir_patient(job: dict, report):
+    """Deletes the Patient from FHIR (cascading, with a plain delete as fallback)."""
+    fhir_id = job["params"]["fhir_id"]
+    if job["progress"].get("in_fhir") is False:
+        return
+
+    # A resumed job may find the Patient already gone
+    if not delete_fhir_patient(fhir_id) and get_fhir_patient(fhir_id):
+        raise RuntimeError("Failed to delete patient from FHIR")
+
+
+def _delete_lab_test_sets(job: dict, report):
+    """Deletes all of the patient's lab test sets from MongoDB."""
+    report(
+        lab_test_sets_deleted=remove_lab_test_sets_for_patient(job["params"]["fhir_id"])
+    )
+
+
+def _delete_patient_record(job: dict, report):
+    """Finally deletes the patient from MongoDB."""
+    fhir_id = job["params"]["fhir_id"]
+    delete_patient(fhir_id)
+    return {
+        "message": "Patient and all associated data deleted successfully",
+        "fhir_id": fhir_id,
+    }
+
+
+register_job(
+    DELETE_PATIENT_JOB,
+    [
+        ("cancel_pending_writes", _cancel_pending_writes),
+        ("delete_observations", _delete_observations),
+        ("delete_fhir_patient", _delete_fhir_patient),
+        ("delete_lab_test_sets", _delete_lab_test_sets),
+        ("delete_patient", _delete_patient_record),
+    ],
+)
@@ -47,6 +47,7 @@ def verify_password(plain_password: str, hashed_password: str):
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -61,6 +62,11 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     return {"email": email, "role": role}
 
 
+def get_optional_current_user(token: str | None = Depends(optional_oauth2_scheme)):
+    """Get the current user from the JWT token, or None if no token was sent."""
+    return get_current_user(token) if token else None
+
+
 def admin_required(current_user: dict = Depends(get_current_user)):
     """Check if the current user is an admin."""
     if current_user["role"] != "admin":
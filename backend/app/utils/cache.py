@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A thread-safe, size-bounded LRU cache whose entries go stale after `ttl` seconds.
+
+    Stale entries are kept (not dropped) so callers can revalidate them cheaply,
+    e.g. with a conditional request, and then call `mark_revalidated`.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Looks up a key.
+
+        Returns:
+            tuple: (value, is_fresh), or (None, False) when the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            self._entries.move_to_end(key)
+            value, stored_at = entry
+            if time.monotonic() - stored_at < self.ttl:
+                self.hits += 1
+                return value, True
+
+            self.stale += 1
+            return value, False
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used entries beyond `maxsize`."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def mark_revalidated(self, key):
+        """Marks a stale entry as fresh again after the origin confirmed it is unchanged."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], time.monotonic())
+                self.revalidations += 1
+
+    def invalidate(self, key):
+        """Removes a key from the cache, if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the cache size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker driven by the failure ratio over a rolling time window.
+
+    - closed: calls go through; once at least `minimum_calls` were made in the last `window`
+      seconds and the failure ratio reaches `failure_ratio`, the breaker opens.
+    - open: calls are rejected immediately until `reset_timeout` seconds have passed.
+    - half-open: a single probe call is let through; its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_ratio: float,
+        minimum_calls: int,
+        window: float,
+        reset_timeout: float,
+    ):
+        self.failure_ratio = failure_ratio
+        self.minimum_calls = minimum_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes = deque()  # (timestamp, succeeded)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self):
+        """Returns True if a call may be attempted now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._current_state() == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            self._record(True)
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            if state == self.HALF_OPEN:
+                self._open()
+                return
+            self._record(False)
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            if (
+                state == self.CLOSED
+                and len(self._outcomes) >= self.minimum_calls
+                and failures / len(self._outcomes) >= self.failure_ratio
+            ):
+                self._open()
+
+    def _record(self, succeeded: bool):
+        now = time.monotonic()
+        self._outcomes.append((now, succeeded))
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._outcomes.clear()
+
+    def stats(self):
+        """Returns the breaker state and the outcomes counted in the current window."""
+        with self._lock:
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            return {
+                "state": self._current_state(),
+                "window_calls": len(self._outcomes),
+                "window_failures": failures,
+                "rejected": self.rejected,
+            }
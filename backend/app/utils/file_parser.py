@@ -7,10 +7,13 @@ from io import BytesIO
 from PIL import Image
 from app.config import OCR_SPACE_API_KEY
 
+# Rough size of a token in English text, to budget prompts without a tokenizer
+CHARS_PER_TOKEN = 4
 
-def extract_text(filename: str, file_contents: bytes) -> str:
+
+def extract_pages(filename: str, file_contents: bytes) -> list:
     """
-    Extract text from an image or PDF file using OCR.Space API.
+    Extract the text of each page of an image or PDF file using OCR.Space API.
     """
     texts = []
 
@@ -41,10 +44,7 @@ def extract_text(filename: str, file_contents: bytes) -> str:
     else:
         texts.append(ocr_image(file_contents, filename))
 
-    final_result = "\n".join(texts)
-
-    print("Final OCR.space text extraction", final_result)
-    return final_result
+    return texts
 
 
 def parse_reference_range(reference_range: str, unit: str):
@@ -118,3 +118,61 @@ def clean_reference_range(reference_range: str):
             return reference_range
 
     return None  # Return None if the format is invalid
+
+
+def split_ocr_text(pages: list | str, max_tokens: int):
+    """
+    Splits OCR text into chunks of about `max_tokens` tokens at most. Whole pages are
+    packed together, in order, while they fit; a page over the budget on its own gets
+    chunks of its own, cut at blank lines (sections), then at line ends for oversized
+    sections, and inside lines that are longer than the budget on their own.
+
+    Args:
+        pages (list | str): The text of each page (`extract_pages`), or a single page.
+        max_tokens (int): Token budget of a chunk (estimated at CHARS_PER_TOKEN chars each).
+
+    Returns:
+        list: The chunks; text within the budget is a single chunk, its pages joined by newlines.
+    """
+    if isinstance(pages, str):
+        pages = [pages]
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    text = "\n".join(pages)
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    # Whether the last chunk holds whole pages, so the next page may join it
+    packing_pages = False
+    for page in pages:
+        if not page.strip():
+            continue
+        if len(page) <= max_chars:
+            if packing_pages:
+                _pack(chunks, page, max_chars)
+            else:
+                chunks.append(page)
+            packing_pages = True
+            continue
+
+        page_chunks = []
+        for section in re.split(r"\n\s*\n", page):
+            if len(section) <= max_chars:
+                _pack(page_chunks, section, max_chars)
+                continue
+            for line in section.splitlines():
+                for start in range(0, len(line), max_chars):
+                    _pack(page_chunks, line[start : start + max_chars], max_chars)
+        chunks.extend(page_chunks)
+        packing_pages = False
+    return chunks
+
+
+def _pack(chunks: list, piece: str, max_chars: int):
+    """Appends `piece` to the last chunk if it fits there, or starts a new chunk."""
+    if not piece.strip():
+        return
+    if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+        chunks[-1] += "\n" + piece
+    else:
+        chunks.append(piece)
@@ -0,0 +1,82 @@
+import pytest
+from app.services import bulk_import
+from app.services.fake_fhir import FakeFHIRServer, install_fake_fhir_server
+
+ROWS = [
+    {
+        "patient_fhir_id": "p1",
+        "test_date": "2024-01-05",
+        "name": "Glucose",
+        "value": "5.1",
+        "unit": "mmol/L",
+    },
+    {
+        "patient_fhir_id": "p1",
+        "test_date": "2024-01-05",
+        "name": "Sodium",
+        "value": "140",
+        "unit": "mmol/L",
+    },
+]
+
+
+@pytest.fixture
+def lab_sets(monkeypatch):
+    """Stands in for the lab test set collection."""
+    install_fake_fhir_server(FakeFHIRServer())
+    stored = []
+
+    def find_lab_sets_by_observation_ids(observation_ids):
+        return {
+            obs["id"]: {**lab_set, "observations": list(lab_set["observations"])}
+            for lab_set in stored
+            for obs in lab_set["observations"]
+            if obs["id"] in observation_ids
+        }
+
+    def store_lab_test_sets(documents):
+        inserted_ids = []
+        for document in documents:
+            inserted_ids.append(str(len(stored)))
+            stored.append({**document, "id": inserted_ids[-1]})
+        return inserted_ids
+
+    def update_lab_test_set(lab_test_set_id, update_data):
+        stored[int(lab_test_set_id)].update(update_data)
+        return {"message": "Lab test set updated successfully."}
+
+    monkeypatch.setattr(
+        bulk_import,
+        "get_patients_by_fhir_ids",
+        lambda ids: {"p1": {"fhir_id": "p1", "birth_date": "1980-01-01", "gender": "female"}},
+    )
+    monkeypatch.setattr(
+        bulk_import, "find_lab_sets_by_observation_ids", find_lab_sets_by_observation_ids
+    )
+    monkeypatch.setattr(bulk_import, "store_lab_test_sets", store_lab_test_sets)
+    monkeypatch.setattr(bulk_import, "update_lab_test_set", update_lab_test_set)
+    return stored
+
+
+def _import(rows):
+    return list(bulk_import.import_lab_results(rows))[-1]
+
+
+def test_reimport_skips_stored_lab_sets(lab_sets):
+    assert _import(ROWS)["lab_sets_created"] == 1
+    assert _import(ROWS)["lab_sets_created"] == 0
+    assert len(lab_sets) == 1
+    assert len(lab_sets[0]["observations"]) == 2
+
+
+def test_reimport_completes_partially_stored_lab_set(lab_sets):
+    # An earlier run stored the set with only its first Observation
+    _import(ROWS[:1])
+    assert len(lab_sets[0]["observations"]) == 1
+
+    assert _import(ROWS)["lab_sets_created"] == 0
+    assert len(lab_sets) == 1
+    assert [obs["id"] for obs in lab_sets[0]["observations"]] == [
+        bulk_import.import_observation_id("p1", "2024-01-05", 0, "Glucose"),
+        bulk_import.import_observation_id("p1", "2024-01-05", 1, "Sodium"),
+    ]
@@ -0,0 +1,45 @@
+import pytest
+from app.services import fhir
+from app.services.fake_fhir import FakeFHIRServer, install_fake_fhir_server
+
+
+@pytest.fixture
+def fake_fhir():
+    return install_fake_fhir_server(FakeFHIRServer())
+
+
+def _observation(observation_id: str):
+    return {
+        "resourceType": "Observation",
+        "id": observation_id,
+        "status": "final",
+        "code": {"text": "Glucose"},
+        "subject": {"reference": "Patient/p1"},
+    }
+
+
+def test_delete_fhir_resources_removes_written_resources(fake_fhir):
+    resources = [_observation("o1"), _observation("o2")]
+    assert fhir.put_fhir_resources(resources) == [None, None]
+
+    assert fhir.delete_fhir_resources(resources) == [None, None]
+    assert ("Observation", "o1") not in fake_fhir.resources
+    assert ("Observation", "o2") not in fake_fhir.resources
+
+
+def test_delete_fhir_resources_counts_missing_resources_as_deleted(fake_fhir):
+    assert fhir.delete_fhir_resources([_observation("never-written")]) == [None]
+
+
+def test_remove_all_observations_reports_progress_per_bundle(fake_fhir, monkeypatch):
+    monkeypatch.setattr(fhir, "FHIR_DELETE_BATCH_SIZE", 2)
+    fhir.put_fhir_resources([_observation(f"o{i}") for i in range(5)])
+    progress = []
+
+    result = fhir.remove_all_observations_for_patient(
+        "p1", lambda deleted, total: progress.append((deleted, total))
+    )
+
+    assert len(result["deleted"]) == 5
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    assert not any(key[0] == "Observation" for key in fake_fhir.resources)
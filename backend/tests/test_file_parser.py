@@ -0,0 +1,23 @@
+from app.utils.file_parser import CHARS_PER_TOKEN, split_ocr_text
+
+
+def test_split_ocr_text_keeps_text_within_budget_whole():
+    assert split_ocr_text(["page one", "page two"], 100) == ["page one\npage two"]
+    assert split_ocr_text("single page", 100) == ["single page"]
+
+
+def test_split_ocr_text_packs_whole_pages():
+    pages = ["a" * 12, "b" * 12, "c" * 12]
+    # Two pages and the newline between them fit in 7 tokens, three don't
+    assert split_ocr_text(pages, 7) == ["a" * 12 + "\n" + "b" * 12, "c" * 12]
+
+
+def test_split_ocr_text_splits_only_oversized_pages():
+    long_page = "x" * 20 + "\n\n" + "y" * 20
+    pages = ["a" * 8, long_page, "b" * 8, "c" * 8]
+    max_chars = 6 * CHARS_PER_TOKEN
+
+    chunks = split_ocr_text(pages, 6)
+
+    assert chunks == ["a" * 8, "x" * 20, "y" * 20, "b" * 8 + "\n" + "c" * 8]
+    assert all(len(chunk) <= max_chars for chunk in chunks)
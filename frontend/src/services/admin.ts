@@ -80,6 +80,19 @@ interface UpdatePatientResponse {
   message: string;
 }
 
+interface JobAccepted {
+  message: string;
+  job_id: string;
+  status_url: string;
+}
+
+interface Job<T> {
+  id: string;
+  status: "queued" | "running" | "succeeded" | "failed";
+  result: T | null;
+  error: string | null;
+}
+
 const LOCALHOST = "http://localhost:8000";
 
 const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || LOCALHOST;
@@ -88,6 +101,25 @@ if (!process.env.REACT_APP_API_BASE_URL) {
   console.warn(`REACT_APP_API_BASE_URL is not defined in environment variables. Using fallback: ${LOCALHOST}`);
 }
 
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_TIMEOUT_MS = 5 * 60 * 1000;
+
+// Uploads and interpretations run as background jobs: poll until the job is done
+async function waitForJob<T>(accepted: JobAccepted): Promise<T> {
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const job = await apiRequest<Job<T>>(`${API_BASE_URL}/jobs/${accepted.job_id}`);
+    if (job.status === "succeeded") {
+      return job.result as T;
+    }
+    if (job.status === "failed") {
+      throw new Error(job.error || "Processing failed");
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+  throw new Error("Processing is taking longer than expected, please check back later");
+}
+
 export const adminService = {
   async getPatients(page: number = 1, pageSize: number = 10): Promise<PatientsResponse> {
     return apiRequest<PatientsResponse>(`${API_BASE_URL}/patients?page=${page}&page_size=${pageSize}`);
@@ -108,9 +140,10 @@ export const adminService = {
   },
 
   async interpretLabTestSet(labTestSetId: string): Promise<{ interpretation: string }> {
-    return apiRequest<{ interpretation: string }>(`${API_BASE_URL}/lab_set/${labTestSetId}/interpret`, {
+    const accepted = await apiRequest<JobAccepted>(`${API_BASE_URL}/lab_set/${labTestSetId}/interpret`, {
       method: "POST",
     });
+    return waitForJob<{ interpretation: string }>(accepted);
   },
 
   async createPatient(patientData: CreatePatientRequest): Promise<CreatePatientResponse> {
@@ -143,10 +176,11 @@ export const adminService = {
     formData.append("test_date", new Date(testDate).toISOString().split("T")[0]); // Convert to YYYY-MM-DD
     formData.append("file", file);
 
-    return apiRequest<LabTestSet>(`${API_BASE_URL}/lab_set`, {
+    const accepted = await apiRequest<JobAccepted>(`${API_BASE_URL}/lab_set`, {
       method: "POST",
       body: formData,
     });
+    return waitForJob<LabTestSet>(accepted);
   },
 
   async deleteLabTestSet(labTestSetId: string): Promise<void> {